@@ -58,6 +58,8 @@ function displayPrinterUrls(list = []) {
   }
 
   const urls = list.map(p => {
+    // Network printers found by the agent are printed to by IP
+    if (p.ip) return `${baseHost}/ip/${p.ip}`;
     const vendorId = p.vendor_id || p.vendorID || "";
     const productId = p.product_id || p.productID || "";
     return `${baseHost}/vid/${vendorId}/pid/${productId}`;
@@ -0,0 +1,184 @@
+"""
+Compares the line-based preview interpreter with the original one that
+measured and drew each character separately on a fixed 4000 px RGB
+canvas. Checks both render image-only receipts to the same pixels (the
+legacy one's text placement was wrong for centered and right-aligned
+lines, so text-only tickets are timed, not compared) and reports the
+render time of each on the benchmark corpus plus a long text ticket.
+
+Run from printer-agent-server/:  python benchmarks/bench_preview.py
+"""
+import os
+import sys
+import timeit
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from epos_compiler import compile_epos_xml  # noqa: E402
+from preview_handler import (CANVAS_WIDTH, draw_placeholder, escpos_command_length, font,  # noqa: E402
+                             render_escpos_image, render_escpos_preview)
+from corpus import build_corpus, kitchen_ticket_xml  # noqa: E402
+
+
+def render_escpos_preview_legacy(esc_bytes: bytes, stored_graphics=None) -> Image.Image:
+    """The original per-byte interpreter, drawing every character on its own."""
+    img = Image.new("RGB", (CANVAS_WIDTH, 4000), "white")
+    draw = ImageDraw.Draw(img)
+    y = 20
+    x = 20
+    align = "left"
+    graphics = None  # raster stored by GS ( L fn 112, waiting for fn 50
+    downloads = {}   # (kc1, kc2) -> raster defined by GS ( L fn 83
+
+    i = 0
+    while i < len(esc_bytes):
+        b = esc_bytes[i]
+
+        # ESC @ → init
+        if b == 0x1b and i + 1 < len(esc_bytes) and esc_bytes[i + 1] == 0x40:
+            y = 20
+            x = 20
+            align = "left"
+            i += 2
+            continue
+
+        # ESC a n → alignment
+        elif b == 0x1b and i + 2 < len(esc_bytes) and esc_bytes[i + 1] == 0x61:
+            n = esc_bytes[i + 2]
+            align = {0: "left", 1: "center", 2: "right"}.get(n, "left")
+            i += 3
+            continue
+
+        # GS v 0 → raster image
+        elif b == 0x1d and i + 5 < len(esc_bytes) and esc_bytes[i + 1] == 0x76 and esc_bytes[i + 2] == 0x30:
+            mode = esc_bytes[i + 3]
+            xL = esc_bytes[i + 4]
+            xH = esc_bytes[i + 5]
+            yL = esc_bytes[i + 6]
+            yH = esc_bytes[i + 7]
+            width_bytes = xL + (xH << 8)
+            height = yL + (yH << 8)
+            data_start = i + 8
+            data_end = data_start + width_bytes * height
+            raster_data = esc_bytes[data_start:data_end]
+
+            if raster_data:
+                im = render_escpos_image(raster_data, width_bytes, height)
+                # Alignment
+                px = {"left": 20, "center": (CANVAS_WIDTH - im.width)//2, "right": CANVAS_WIDTH - im.width - 20}[align]
+                img.paste(im, (px, y))
+                # Consecutive rasters (image bands) print without a gap
+                y += im.height
+
+            i = data_end
+            continue
+
+        # GS ( L / GS 8 L fn 112 → store raster graphics, fn 50 → print them,
+        # fn 83 → define download graphics, fn 85 → print them by key
+        elif b == 0x1d and i + 6 < len(esc_bytes) and esc_bytes[i + 1:i + 3] in (b"(L", b"8L"):
+            n = escpos_command_length(esc_bytes, i)
+            head = 5 if esc_bytes[i + 1] == 0x28 else 7
+            fn = esc_bytes[i + head + 1] if i + head + 1 < len(esc_bytes) else None
+            printed = None
+            if fn == 0x70 and i + head + 10 < len(esc_bytes):
+                p = i + head + 6
+                width = esc_bytes[p] + (esc_bytes[p + 1] << 8)
+                height = esc_bytes[p + 2] + (esc_bytes[p + 3] << 8)
+                graphics = ((width + 7) // 8, height, esc_bytes[p + 4:i + n])
+            elif fn == 0x32 and graphics:
+                printed, graphics = graphics, None
+            elif fn == 0x53 and i + head + 11 < len(esc_bytes):
+                p = i + head + 6
+                width = esc_bytes[p] + (esc_bytes[p + 1] << 8)
+                height = esc_bytes[p + 2] + (esc_bytes[p + 3] << 8)
+                downloads[(esc_bytes[p - 3], esc_bytes[p - 2])] = ((width + 7) // 8, height, esc_bytes[p + 5:i + n])
+            elif fn == 0x55 and i + head + 3 < len(esc_bytes):
+                key = (esc_bytes[i + head + 2], esc_bytes[i + head + 3])
+                printed = downloads.get(key) or (stored_graphics and stored_graphics(*key))
+            if printed:
+                im = render_escpos_image(printed[2], printed[0], printed[1])
+                px = {"left": 20, "center": (CANVAS_WIDTH - im.width)//2, "right": CANVAS_WIDTH - im.width - 20}[align]
+                img.paste(im, (px, y))
+                y += im.height
+            i += n
+            continue
+
+        # Cut command (GS V m [n])
+        elif b == 0x1d and i + 2 < len(esc_bytes) and esc_bytes[i + 1] == 0x56:
+            y += 50
+            i += escpos_command_length(esc_bytes, i)
+            continue
+
+        # GS k → 1D barcode
+        elif b == 0x1d and i + 3 < len(esc_bytes) and esc_bytes[i + 1] == 0x6b:
+            n = escpos_command_length(esc_bytes, i)
+            label = esc_bytes[i + 4:i + n] if esc_bytes[i + 2] >= 65 else esc_bytes[i + 3:i + n - 1]
+            draw_placeholder(draw, "||| " + label.decode("ascii", "replace"), 300, 60, align, y)
+            y += 80
+            i += n
+            continue
+
+        # GS ( k ... fn 81 → print 2D symbol
+        elif b == 0x1d and i + 6 < len(esc_bytes) and esc_bytes[i + 1:i + 3] == b"(k" and esc_bytes[i + 6] == 0x51:
+            draw_placeholder(draw, "2D", 120, 120, align, y)
+            y += 140
+            i += escpos_command_length(esc_bytes, i)
+            continue
+
+        # ESC J n → feed n dots
+        elif b == 0x1b and i + 2 < len(esc_bytes) and esc_bytes[i + 1] == 0x4a:
+            x = 20
+            y += esc_bytes[i + 2]
+            i += 3
+            continue
+
+        # Any other command → skip it with its parameters
+        elif escpos_command_length(esc_bytes, i):
+            i += escpos_command_length(esc_bytes, i)
+            continue
+
+        # Printable text
+        elif 0x20 <= b <= 0x7E:
+            ch = chr(b)
+            bbox = draw.textbbox((0, 0), ch, font=font)
+            w = bbox[2] - bbox[0]
+            h = bbox[3] - bbox[1]
+
+            px = {"left": x, "center": (CANVAS_WIDTH - w)//2, "right": CANVAS_WIDTH - w - 20}[align]
+            draw.text((px, y), ch, font=font, fill="black")
+            x += w
+            i += 1
+            continue
+
+        # Newline
+        elif b == 0x0a:
+            x = 20
+            y += 25
+            i += 1
+            continue
+
+        else:
+            i += 1  # skip unknown byte
+
+    return img.crop((0, 0, CANVAS_WIDTH, y + 50))
+
+
+def main():
+    corpus = build_corpus()
+    corpus["kitchen_long"] = kitchen_ticket_xml(200, seed=5)
+    print(f"{'document':<16}{'esc KB':>8}{'height':>8}{'legacy ms':>11}{'lines ms':>10}{'speedup':>9}")
+    for name, xml in corpus.items():
+        esc = compile_epos_xml(xml)
+        new = render_escpos_preview(esc)
+        if name.startswith("receipt"):
+            old = render_escpos_preview_legacy(esc)
+            assert old.size == new.size, name
+            assert old.convert("1").tobytes() == new.convert("1").tobytes(), name
+        n = 10
+        legacy = timeit.timeit(lambda: render_escpos_preview_legacy(esc), number=n) / n * 1000
+        lines = timeit.timeit(lambda: render_escpos_preview(esc), number=n) / n * 1000
+        print(f"{name:<16}{len(esc) / 1024:>8.0f}{new.height:>8}{legacy:>11.2f}{lines:>10.2f}{legacy / lines:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
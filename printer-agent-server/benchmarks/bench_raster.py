@@ -0,0 +1,76 @@
+"""
+Compares the bulk GS v 0 raster decoder in preview_handler with the
+original per-pixel loop, checks both produce identical images and
+prints timings for typical receipt image sizes.
+
+Run from printer-agent-server/:  python benchmarks/bench_raster.py
+"""
+import os
+import random
+import sys
+import timeit
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from preview_handler import render_escpos_image  # noqa: E402
+
+
+def render_escpos_image_loop(data: bytes, width_bytes: int, height: int) -> Image.Image:
+    """The original bit-by-bit decoder, kept here as the reference."""
+    width = width_bytes * 8
+    img = Image.new("1", (width, height), 1)
+    pixels = img.load()
+
+    for y in range(height):
+        for x_byte in range(width_bytes):
+            index = y * width_bytes + x_byte
+            if index >= len(data):
+                continue
+            byte = data[index]
+            for bit in range(8):
+                x = x_byte * 8 + (7 - bit)
+                if x >= width:
+                    continue
+                pixels[x, y] = 0 if (byte >> bit) & 1 else 1
+    return img.convert("L")
+
+
+# (label, width_bytes, height)
+CASES = [
+    ("logo 384x120", 48, 120),
+    ("qr block 576x200", 72, 200),
+    ("full receipt 576x1200", 72, 1200),
+]
+
+
+def check_identical():
+    rnd = random.Random(0)
+    samples = [
+        (bytes(rnd.getrandbits(8) for _ in range(72 * 40)), 72, 40),
+        (bytes(rnd.getrandbits(8) for _ in range(13 * 7)), 13, 7),  # odd width
+        (bytes(rnd.getrandbits(8) for _ in range(72 * 40 - 100)), 72, 40),  # short data
+        (bytes(rnd.getrandbits(8) for _ in range(5)), 3, 4),  # ragged, part of a row
+        (b"\xff", 1, 1),
+    ]
+    for data, wb, h in samples:
+        fast = render_escpos_image(data, wb, h)
+        slow = render_escpos_image_loop(data, wb, h)
+        assert fast.size == slow.size and fast.tobytes() == slow.tobytes(), (wb, h, len(data))
+    print(f"identical output on {len(samples)} edge cases")
+
+
+def main():
+    check_identical()
+    rnd = random.Random(1)
+    print(f"{'case':<24}{'loop ms':>10}{'bulk ms':>10}{'speedup':>10}")
+    for label, wb, h in CASES:
+        data = bytes(rnd.getrandbits(8) for _ in range(wb * h))
+        n = 3
+        slow = timeit.timeit(lambda: render_escpos_image_loop(data, wb, h), number=n) / n * 1000
+        n = 50
+        fast = timeit.timeit(lambda: render_escpos_image(data, wb, h), number=n) / n * 1000
+        print(f"{label:<24}{slow:>10.2f}{fast:>10.3f}{slow / fast:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Checks that the raster pipeline (margin trim, blank rows as feeds, bands,
+GS ( L graphics) prints the same thing as sending each image as one GS v 0
+block, by rendering both through the preview interpreter, and reports the
+bytes on the wire and the transfer time they imply.
+
+Run from printer-agent-server/:  python benchmarks/bench_raster_pipeline.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from epos_compiler import compile_epos_xml  # noqa: E402
+from escpos_cache import compiled_cache  # noqa: E402
+from preview_handler import render_escpos_preview  # noqa: E402
+from corpus import build_corpus  # noqa: E402
+
+# Usable bulk throughput of a USB full-speed printer link and of a weak Wi-Fi hop
+LINKS = {"usb 12M": 12e6 / 8 * 0.8, "wifi 2M": 2e6 / 8}
+
+
+def main():
+    corpus = build_corpus()
+    header = f"{'document':<16}{'mode':<10}{'bytes':>9}{'saved':>8}{'compile ms':>12}"
+    header += "".join(f"{name + ' ms':>13}" for name in LINKS)
+    print(header)
+    for name, xml in corpus.items():
+        plain = compile_epos_xml(xml, optimize_images=False)
+        reference = render_escpos_preview(plain).tobytes()
+        rows = [("plain", plain, False, "raster")]
+        for mode in ("raster", "graphics"):
+            rows.append((mode, compile_epos_xml(xml, image_mode=mode), True, mode))
+
+        for label, esc, optimize, mode in rows:
+            assert render_escpos_preview(esc).tobytes() == reference, (name, label)
+            # Cold cache, so the timing covers the image encoding itself
+            ms = timeit.timeit(lambda: (compiled_cache.clear(),
+                                        compile_epos_xml(xml, image_mode=mode, optimize_images=optimize)),
+                               number=10) / 10 * 1000
+            line = f"{name:<16}{label:<10}{len(esc):>9}{1 - len(esc) / len(plain):>8.0%}{ms:>12.2f}"
+            line += "".join(f"{len(esc) / rate * 1000:>13.1f}" for rate in LINKS.values())
+            print(line)
+    print("rendered output identical for every document and mode")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark corpus of ePOS-Print documents shaped like the ones Odoo POS
+sends: the whole ticket rendered to one raster <image> followed by a cut
+(and a drawer pulse for cash payments), the same ticket split into many
+image bands, plus a text-only kitchen ticket.
+Receipts are drawn with Pillow so the raster has the same mix of text
+rows and blank gaps as a real ticket.
+
+    python benchmarks/corpus.py --write benchmarks/corpus   # dump the .xml files
+"""
+import argparse
+import base64
+import os
+import random
+from PIL import Image, ImageDraw, ImageFont
+
+ENVELOPE = (
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body>'
+    '<epos-print xmlns="http://www.epson-pos.com/schemas/2011/03/epos-print">{body}</epos-print>'
+    '</s:Body></s:Envelope>'
+)
+
+RECEIPT_WIDTH = 512  # px, Odoo's receipt canvas for 80 mm printers
+PRODUCTS = ["Espresso", "Cappuccino", "Croissant", "Club Sandwich", "Sparkling Water",
+            "Caesar Salad", "Cheesecake", "Margherita Pizza", "Iced Tea", "Tiramisu"]
+
+
+def pack_raster(img: Image.Image) -> bytes:
+    """Packs a 1-bit image into GS v 0 rows (MSB first, 1 = black)."""
+    return img.convert("1").tobytes("raw", "1;I")
+
+
+def draw_receipt(lines: int, seed: int) -> Image.Image:
+    rnd = random.Random(seed)
+    font = ImageFont.load_default()
+    height = 260 + lines * 26 + 220
+    img = Image.new("L", (RECEIPT_WIDTH, height), 255)
+    draw = ImageDraw.Draw(img)
+
+    draw.rectangle((156, 20, 356, 110), fill=0)  # logo block
+    draw.text((180, 130), "My Company (San Francisco)", font=font, fill=0)
+    draw.text((200, 150), "Tel: +1 555-555-5556", font=font, fill=0)
+    draw.text((170, 170), "info@yourcompany.com", font=font, fill=0)
+    draw.text((20, 210), "Served by Mitchell Admin", font=font, fill=0)
+
+    y = 260
+    total = 0.0
+    for _ in range(lines):
+        name = rnd.choice(PRODUCTS)
+        price = rnd.randint(150, 2500) / 100
+        total += price
+        draw.text((20, y), f"{rnd.randint(1, 3)} x {name}", font=font, fill=0)
+        draw.text((420, y), f"$ {price:.2f}", font=font, fill=0)
+        y += 26
+
+    draw.line((20, y + 10, RECEIPT_WIDTH - 20, y + 10), fill=0, width=2)
+    draw.text((20, y + 30), "TOTAL", font=font, fill=0)
+    draw.text((420, y + 30), f"$ {total:.2f}", font=font, fill=0)
+    draw.text((20, y + 70), "Cash", font=font, fill=0)
+    draw.text((170, y + 150), "Order 00042-003-0001", font=font, fill=0)
+    return img
+
+
+def receipt_xml(lines: int, seed: int = 0, pulse: bool = False) -> str:
+    img = draw_receipt(lines, seed)
+    raster = base64.b64encode(pack_raster(img)).decode()
+    body = f'<image width="{img.width}" height="{img.height}" align="center">{raster}</image>'
+    if pulse:
+        body += '<pulse drawer="drawer_1" time="pulse_100"/>'
+    body += '<cut type="feed"/>'
+    return ENVELOPE.format(body=body)
+
+
+def banded_receipt_xml(lines: int, band: int = 24, seed: int = 0) -> str:
+    """Same ticket sent as many short images, the worst case for ``bytes +=``."""
+    img = draw_receipt(lines, seed)
+    body = ""
+    for top in range(0, img.height, band):
+        part = img.crop((0, top, img.width, min(top + band, img.height)))
+        raster = base64.b64encode(pack_raster(part)).decode()
+        body += f'<image width="{part.width}" height="{part.height}" align="center">{raster}</image>'
+    body += '<cut type="feed"/>'
+    return ENVELOPE.format(body=body)
+
+
+def kitchen_ticket_xml(lines: int, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    body = '<text align="center">KITCHEN - Table 12&#10;</text><feed line="1"/>'
+    for _ in range(lines):
+        body += f'<text align="left">{rnd.randint(1, 4)} x {rnd.choice(PRODUCTS)}&#10;</text>'
+    body += '<feed line="3"/><cut type="feed"/>'
+    return ENVELOPE.format(body=body)
+
+
+def build_corpus() -> dict:
+    return {
+        "receipt_short": receipt_xml(5, seed=1, pulse=True),
+        "receipt_medium": receipt_xml(25, seed=2),
+        "receipt_long": receipt_xml(90, seed=3),
+        "receipt_banded": banded_receipt_xml(90, seed=3),
+        "kitchen_ticket": kitchen_ticket_xml(12, seed=4),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--write", metavar="DIR", help="write the corpus as .xml files")
+    args = parser.parse_args()
+    corpus = build_corpus()
+    for name, xml in corpus.items():
+        print(f"{name:<16}{len(xml):>10} bytes")
+        if args.write:
+            os.makedirs(args.write, exist_ok=True)
+            with open(os.path.join(args.write, name + ".xml"), "w") as f:
+                f.write(xml)
@@ -0,0 +1,228 @@
+"""
+Stand-in printers for load tests, so the agent can be driven without
+hardware:
+
+- FakeUsbBackend implements the pyusb backend interface with ESC/POS
+  printers that take bulk writes at a set rate and answer DLE EOT status
+  queries. Install it with ``install_fake_usb(...)`` before the first USB
+  access; ``usb.core.find`` and the agent's pool then see only these.
+- TcpPrinterSink listens on port 9100 of a loopback address (127.0.0.2,
+  127.0.0.3... on Linux every 127.x address is local) in its own thread,
+  reads at a set rate and can add latency or drop connections.
+"""
+import array
+import asyncio
+import random
+import threading
+import time
+from types import SimpleNamespace
+import usb.backend
+import usb.core
+
+ENDPOINT_OUT = 0x01
+ENDPOINT_IN = 0x82
+DLE_EOT = b"\x10\x04"
+
+
+def status_byte(n: int, paper_out: bool) -> int:
+    """DLE EOT n answer: bits 1 and 4 are always set, paper end shows in n=2 and n=4."""
+    if paper_out and n == 2:
+        return 0x12 | 0x04
+    if paper_out and n == 4:
+        return 0x12 | 0x60
+    return 0x12
+
+
+# ================================================================
+# USB
+# ================================================================
+class FakeUsbPrinter:
+    def __init__(self, vid: int = 0x04b8, pid: int = 0x0202, address: int = 1,
+                 bytes_per_second: float = 1_000_000, max_packet: int = 64,
+                 manufacturer: str = "EPSON", product: str = "TM-T20III (fake)",
+                 interface_class: int = 0x07):
+        self.vid = vid
+        self.pid = pid
+        self.address = address
+        self.bytes_per_second = bytes_per_second
+        self.max_packet = max_packet
+        self.strings = {1: manufacturer, 2: product}
+        self.interface_class = interface_class  # 0x07 printer, 0xff vendor specific
+        self.paper_out = False
+        self.fail_rate = 0.0  # probability that a bulk write times out
+        self.received = 0
+        self.writes = 0
+        self._status = []
+        self._lock = threading.Lock()
+
+
+class FakeUsbBackend(usb.backend.IBackend):
+    def __init__(self, printers):
+        self.printers = list(printers)
+
+    def enumerate_devices(self):
+        return iter(self.printers)
+
+    def get_device_descriptor(self, dev):
+        return SimpleNamespace(
+            bLength=18, bDescriptorType=1, bcdUSB=0x0200, bDeviceClass=0, bDeviceSubClass=0,
+            bDeviceProtocol=0, bMaxPacketSize0=64, idVendor=dev.vid, idProduct=dev.pid, bcdDevice=0x0100,
+            iManufacturer=1, iProduct=2, iSerialNumber=0, bNumConfigurations=1,
+            address=dev.address, bus=1, port_number=dev.address, port_numbers=(dev.address,), speed=2)
+
+    def get_configuration_descriptor(self, dev, config):
+        return SimpleNamespace(
+            bLength=9, bDescriptorType=2, wTotalLength=32, bNumInterfaces=1, bConfigurationValue=1,
+            iConfiguration=0, bmAttributes=0xC0, bMaxPower=50, extra_descriptors=[])
+
+    def get_interface_descriptor(self, dev, intf, alt, config):
+        if intf or alt:
+            raise IndexError("One interface without alternate settings")
+        return SimpleNamespace(
+            bLength=9, bDescriptorType=4, bInterfaceNumber=0, bAlternateSetting=0, bNumEndpoints=2,
+            bInterfaceClass=dev.interface_class, bInterfaceSubClass=1, bInterfaceProtocol=2, iInterface=0,
+            extra_descriptors=[])
+
+    def get_endpoint_descriptor(self, dev, ep, intf, alt, config):
+        return SimpleNamespace(
+            bLength=7, bDescriptorType=5, bEndpointAddress=(ENDPOINT_OUT, ENDPOINT_IN)[ep], bmAttributes=2,
+            wMaxPacketSize=dev.max_packet, bInterval=0, bRefresh=0, bSynchAddress=0, extra_descriptors=[])
+
+    def open_device(self, dev):
+        return dev
+
+    def close_device(self, dev_handle):
+        pass
+
+    def set_configuration(self, dev_handle, config_value):
+        pass
+
+    def get_configuration(self, dev_handle):
+        return 1
+
+    def claim_interface(self, dev_handle, intf):
+        pass
+
+    def release_interface(self, dev_handle, intf):
+        pass
+
+    def is_kernel_driver_active(self, dev_handle, intf):
+        return False
+
+    def detach_kernel_driver(self, dev_handle, intf):
+        pass
+
+    def reset_device(self, dev_handle):
+        pass
+
+    def clear_halt(self, dev_handle, ep):
+        pass
+
+    def bulk_write(self, dev_handle, ep, intf, data, timeout):
+        p = dev_handle
+        seconds = len(data) / p.bytes_per_second
+        if p.fail_rate and random.random() < p.fail_rate or (timeout and seconds * 1000 > timeout):
+            time.sleep(min(seconds, timeout / 1000 if timeout else seconds))
+            raise usb.core.USBTimeoutError("Operation timed out", -7, 110)
+        time.sleep(seconds)
+        with p._lock:
+            p.received += len(data)
+            p.writes += 1
+            raw = bytes(data)
+            i = raw.find(DLE_EOT)
+            while i != -1 and i + 2 < len(raw):
+                p._status.append(status_byte(raw[i + 2], p.paper_out))
+                i = raw.find(DLE_EOT, i + 3)
+        return len(data)
+
+    def bulk_read(self, dev_handle, ep, intf, buff, timeout):
+        p = dev_handle
+        with p._lock:
+            if not p._status:
+                raise usb.core.USBTimeoutError("Operation timed out", -7, 110)
+            buff[0] = p._status.pop(0)
+        return 1
+
+    def ctrl_transfer(self, dev_handle, bmRequestType, bRequest, wValue, wIndex, data, timeout):
+        # Only GET_DESCRIPTOR(STRING): index 0 is the language list
+        index = wValue & 0xFF
+        if index == 0:
+            payload = bytes([4, 3, 0x09, 0x04])
+        else:
+            text = dev_handle.strings.get(index, "").encode("utf-16-le")
+            payload = bytes([2 + len(text), 3]) + text
+        n = min(len(data), len(payload))
+        data[:n] = array.array("B", payload[:n])
+        return n
+
+
+def install_fake_usb(printers):
+    """Makes ``printers`` the only USB devices the agent sees."""
+    import ddl_path
+    backend = FakeUsbBackend(printers)
+    ddl_path.backend = backend
+    return backend
+
+
+# ================================================================
+# TCP port 9100
+# ================================================================
+class TcpPrinterSink:
+    def __init__(self, host: str, port: int = 9100, bytes_per_second: float = 2_000_000,
+                 latency: float = 0.0, drop_rate: float = 0.0, paper_out: bool = False):
+        self.host = host
+        self.port = port
+        self.bytes_per_second = bytes_per_second
+        self.latency = latency        # seconds added before each read
+        self.drop_rate = drop_rate    # probability that a read closes the connection instead
+        self.paper_out = paper_out
+        self.received = 0
+        self.connections = 0
+        self.dropped = 0
+        self.loop = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                data = await reader.read(65536)
+                if not data:
+                    break
+                if self.drop_rate and random.random() < self.drop_rate:
+                    self.dropped += 1
+                    writer.transport.abort()
+                    return
+                self.received += len(data)
+                await asyncio.sleep(len(data) / self.bytes_per_second)
+                i = data.find(DLE_EOT)
+                while i != -1 and i + 2 < len(data):
+                    writer.write(bytes([status_byte(data[i + 2], self.paper_out)]))
+                    i = data.find(DLE_EOT, i + 3)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def start(self):
+        def run():
+            self.loop = asyncio.new_event_loop()
+            self._server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, reuse_address=True))
+            self._ready.set()
+            self.loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name=f"sink-{self.host}", daemon=True)
+        self._thread.start()
+        self._ready.wait(5)
+        return self
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._server.close)
+            self.loop.call_soon_threadsafe(self.loop.stop)
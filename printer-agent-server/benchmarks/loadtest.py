@@ -0,0 +1,176 @@
+"""
+Load test of the agent against simulated printers: a fake pyusb backend
+(benchmarks/fake_printers.py) and TCP port 9100 sinks on loopback
+addresses. The real FastAPI app runs under uvicorn in this process and
+the benchmark corpus is replayed over HTTP at a fixed concurrency against
+the USB, IP and /success routes. Reports p50/p99 latency, receipts per
+second, failed requests and the process RSS.
+
+Run from printer-agent-server/:
+    python benchmarks/loadtest.py
+    python benchmarks/loadtest.py --routes usb,ip --concurrency 32 --requests 2000 \\
+        --usb-printers 2 --net-printers 4 --usb-rate 400000 --net-latency 0.005 --net-drop 0.01
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+# The agent reads its configuration at import time: no LAN scan, no
+# status polling and no spool unless asked for
+os.environ.setdefault("NET_DISCOVERY_INTERVAL", "0")
+os.environ.setdefault("STATUS_POLL_INTERVAL", "0")
+os.environ.setdefault("SPOOL_PATH", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+from fake_printers import FakeUsbPrinter, TcpPrinterSink, install_fake_usb  # noqa: E402
+from corpus import build_corpus  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def rss_mb() -> float:
+    """Current resident set size, from /proc when available, else the peak."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def start_agent(port: int):
+    import main
+    # One log line per request would dominate the measurement (the /success
+    # route logs at ERROR level); failures are counted in the report instead
+    logging.disable(logging.ERROR)
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="agent", daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+async def replay(base: str, urls: list, documents: list, concurrency: int, requests: int):
+    """Sends ``requests`` documents round-robin over ``urls``; returns [(url, seconds, ok)]."""
+    semaphore = asyncio.Semaphore(concurrency)
+    jobs = zip(range(requests), itertools.cycle(urls), itertools.cycle(documents))
+    results = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=120) as client:
+        async def one(url, xml):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    # A fresh key per request, or the agent would answer repeats from its cache
+                    r = await client.post(url, content=xml, headers={
+                        "Content-Type": "text/xml", "Idempotency-Key": uuid.uuid4().hex})
+                    ok = r.status_code == 200 and "success='true'" in r.text
+                except httpx.HTTPError:
+                    ok = False
+                results.append((url, time.perf_counter() - start, ok))
+
+        await asyncio.gather(*(one(url, xml) for _, url, xml in jobs))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--routes", default="usb,ip,success", help="comma-separated: usb, ip, success")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400, help="requests per route")
+    parser.add_argument("--usb-printers", type=int, default=1)
+    parser.add_argument("--net-printers", type=int, default=2)
+    parser.add_argument("--usb-rate", type=float, default=1_000_000, help="USB bytes per second")
+    parser.add_argument("--usb-fail", type=float, default=0.0, help="probability a USB write times out")
+    parser.add_argument("--net-rate", type=float, default=2_000_000, help="TCP bytes per second")
+    parser.add_argument("--net-latency", type=float, default=0.0, help="seconds added to each TCP read")
+    parser.add_argument("--net-drop", type=float, default=0.0, help="probability a TCP read drops the connection")
+    args = parser.parse_args()
+
+    usb_printers = [FakeUsbPrinter(pid=0x0202 + i, address=i + 1, bytes_per_second=args.usb_rate)
+                    for i in range(args.usb_printers)]
+    for p in usb_printers:
+        p.fail_rate = args.usb_fail
+    install_fake_usb(usb_printers)
+    sinks = [TcpPrinterSink(f"127.0.0.{i + 2}", bytes_per_second=args.net_rate, latency=args.net_latency,
+                            drop_rate=args.net_drop).start() for i in range(args.net_printers)]
+
+    port = free_port()
+    server, thread = start_agent(port)
+    base = f"http://127.0.0.1:{port}"
+    targets = {
+        "usb": [f"/vid/{p.vid:04x}/pid/{p.pid:04x}/cgi-bin/epos/service.cgi" for p in usb_printers],
+        "ip": [f"/ip/{s.host}/cgi-bin/epos/service.cgi" for s in sinks],
+        "success": [f"/vid/{p.vid:04x}/pid/{p.pid:04x}/success/cgi-bin/epos/service.cgi" for p in usb_printers],
+    }
+    documents = list(build_corpus().values())
+
+    print(f"concurrency {args.concurrency}, {args.requests} requests per route, "
+          f"{args.usb_printers} USB / {args.net_printers} network printers, RSS {rss_mb():.0f} MB")
+    print(f"{'route':<10}{'requests':>9}{'failed':>8}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+          f"{'receipts/s':>12}{'RSS MB':>8}")
+    try:
+        for route in filter(None, args.routes.split(",")):
+            urls = targets[route]
+            if not urls:
+                continue
+            start = time.perf_counter()
+            results = asyncio.run(replay(base, urls, documents, args.concurrency, args.requests))
+            elapsed = time.perf_counter() - start
+            latencies = [seconds * 1000 for _, seconds, _ in results]
+            failed = sum(1 for _, _, ok in results if not ok)
+            print(f"{route:<10}{len(results):>9}{failed:>8}{statistics.median(latencies):>9.1f}"
+                  f"{percentile(latencies, 99):>9.1f}{max(latencies):>9.1f}"
+                  f"{(len(results) - failed) / elapsed:>12.1f}{rss_mb():>8.0f}")
+    finally:
+        server.should_exit = True
+        thread.join(10)
+        for sink in sinks:
+            sink.stop()
+
+    usb_bytes = sum(p.received for p in usb_printers)
+    net_bytes = sum(s.received for s in sinks)
+    dropped = sum(s.dropped for s in sinks)
+    print(f"printers received {usb_bytes / 1e6:.1f} MB over USB, {net_bytes / 1e6:.1f} MB over TCP "
+          f"({dropped} connections dropped); peak RSS {peak_rss_mb():.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
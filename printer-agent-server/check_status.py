@@ -1,6 +1,13 @@
+import asyncio
+import os
 import usb.core
-import usb.util
-from usb.util import endpoint_direction, ENDPOINT_IN, ENDPOINT_OUT
+from usb_pool import usb_pool, UsbDeviceNotFound, parse_usb_id
+from net_pool import net_pool
+from metrics import stage_seconds
+
+# Milliseconds a USB printer has to answer each DLE EOT query; short, since a
+# printer that does not answer holds its handle and the job queue waits
+USB_STATUS_TIMEOUT = int(os.environ.get("USB_STATUS_TIMEOUT", "300"))
 
 STATUS_COMMANDS = {
     'Printer Status': b'\x10\x04\x01',
@@ -46,66 +53,81 @@ def decode_status(name, byte_val):
     return messages
 
 
-def check_printer_status(vendor_id, product_id):
-    device = None 
-    try:
-        # Convert hex strings (if needed)
-        if isinstance(vendor_id, str): vendor_id = int(vendor_id, 16)
-        if isinstance(product_id, str): product_id = int(product_id, 16)
-
-        device = usb.core.find(idVendor=vendor_id, idProduct=product_id)
-        if not device:
-            return {"status": "error", "message": "Printer not found"}
-        try:
-            if device.is_kernel_driver_active(0):
-                device.detach_kernel_driver(0)
-        except:
-            pass
+def status_errors(responses: dict) -> dict:
+    """Keeps the non-OK messages of each decoded DLE EOT response."""
+    errors = {}
+    for name, response in responses.items():
+        decoded = decode_status(name, response)
+        for msg in decoded:
+            if "OK" not in msg and "adequate" not in msg and "online" not in msg and "No printer errors" not in msg:
+                errors.setdefault(name, []).append(msg)
+    return errors
 
-        device.set_configuration()
-        cfg = device.get_active_configuration()
-        intf = cfg[(0, 0)]
 
-        ep_out = usb.util.find_descriptor(
-            intf, custom_match=lambda e: endpoint_direction(e.bEndpointAddress) == ENDPOINT_OUT
-        )
-        ep_in = usb.util.find_descriptor(
-            intf, custom_match=lambda e: endpoint_direction(e.bEndpointAddress) == ENDPOINT_IN
+def status_result(errors: dict) -> dict:
+    if errors:
+        flat_errors = "".join(
+            f"{k}: {', '.join(v)}\n" for k, v in errors.items()
         )
+        return {
+            "status": "error",
+            "message": flat_errors
+        }
+    return {
+        "status": "success",
+        "message": "Printer is ready"
+    }
+
+
+def query_printer_status(handle):
+    """Sends the DLE EOT queries over a claimed pool handle and collects the non-OK messages."""
+    if handle.ep_in is None:
+        raise Exception("Could not find printer endpoints.")
+
+    responses = {}
+    for name, cmd in STATUS_COMMANDS.items():
+        handle.ep_out.write(cmd)
+        responses[name] = handle.ep_in.read(handle.ep_in.wMaxPacketSize, timeout=USB_STATUS_TIMEOUT)
+    return status_errors(responses)
+
+
+async def query_network_status(conn, timeout: float = 2):
+    """Same DLE EOT queries over a pooled TCP connection to port 9100."""
+    responses = {}
+    for name, cmd in STATUS_COMMANDS.items():
+        conn.writer.write(cmd)
+        await conn.writer.drain()
+        try:
+            responses[name] = await asyncio.wait_for(conn.reader.readexactly(1), timeout)
+        except asyncio.IncompleteReadError:
+            raise ConnectionResetError("Printer closed the connection")
+        except asyncio.TimeoutError:
+            raise TimeoutError("Printer did not answer the status query")
+    return status_errors(responses)
 
-        if not ep_out or not ep_in:
-            return {"status": "error", "message": "Could not find printer endpoints."}
-
-        errors = {}
-        for name, cmd in STATUS_COMMANDS.items():
-            ep_out.write(cmd)
-            response = ep_in.read(ep_in.wMaxPacketSize, timeout=2000)
-            decoded = decode_status(name, response)
-            for msg in decoded:
-                if "OK" not in msg and "adequate" not in msg and "online" not in msg and "No printer errors" not in msg:
-                    errors.setdefault(name, []).append(msg)
-
-        if errors:
-            flat_errors = "".join(
-                f"{k}: {', '.join(v)}\n" for k, v in errors.items()
-            )
-            return {
-                "status": "error",
-                "message": flat_errors
-            }
-        else:
-            return {
-                "status": "success",
-                "message": "Printer is ready"
-            }
 
+def check_printer_status(vendor_id, product_id, release: bool = False):
+    try:
+        with stage_seconds.time("status_check", f"{parse_usb_id(vendor_id):04x}_{parse_usb_id(product_id):04x}"):
+            # A printer that is slow to answer is not reset for it, only a job's errors do that
+            errors = usb_pool.run(vendor_id, product_id, query_printer_status, reset=False, release=release)
+        return status_result(errors)
+
+    except UsbDeviceNotFound:
+        return {"status": "error", "message": "Printer not found"}
     except usb.core.USBError as e:
         return {"status": "error", "message": f"USB communication failed: {str(e)}"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
-    finally:
-        try:
-            usb.util.dispose_resources(device)
-            usb.util.release_interface(device, 0)
-        except Exception as e:
-            print(e)
+
+
+async def check_network_printer_status(ip: str):
+    try:
+        with stage_seconds.time("status_check", ip):
+            errors = await net_pool.run(ip, query_network_status)
+        return status_result(errors)
+
+    except (ConnectionRefusedError, TimeoutError) as e:
+        return {"status": "error", "message": f"Printer not reachable: {e}"}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
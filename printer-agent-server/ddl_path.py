@@ -35,6 +35,13 @@ def load_libusb_backend():
 
 backend = load_libusb_backend()
 
+def get_libusb_backend():
+    """Returns the process-wide libusb backend, loading it again only if the first load failed."""
+    global backend
+    if backend is None:
+        backend = load_libusb_backend()
+    return backend
+
 if backend is not None:
     devices = usb.core.find(find_all=True, backend=backend)
     for dev in devices:
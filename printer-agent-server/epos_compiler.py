@@ -0,0 +1,530 @@
+# epos_compiler.py
+import base64
+import logging
+import xml.etree.ElementTree as ET
+from raster import encode_raster_image, Commands
+from escpos_cache import compiled_cache, content_key, download_graphics, DOWNLOAD_GRAPHICS_MAX_BYTES
+
+logger = logging.getLogger("epos-compiler")
+
+EPOS_NS = "{http://www.epson-pos.com/schemas/2011/03/epos-print}"
+EPOS_PRINT_TAG = EPOS_NS + "epos-print"
+
+# Size of the slices fed to the pull parser
+PARSE_CHUNK = 64 * 1024
+# Transports get chunks of at least this size, so short text elements do
+# not each turn into their own USB transfer or TCP segment
+WRITE_CHUNK = 16 * 1024
+
+INIT = b"\x1b@"      # ESC @
+CUT = b"\x1dV\x00"   # GS V 0
+
+ALIGN = {
+    "center": b"\x1b\x61\x01",
+    "right":  b"\x1b\x61\x02"
+}
+ALIGN_LEFT = b"\x1b\x61\x00"
+
+
+# ================================================================
+# Incremental parsing
+# ================================================================
+def _slices(source):
+    if isinstance(source, (str, bytes, bytearray)):
+        for start in range(0, len(source), PARSE_CHUNK):
+            yield source[start:start + PARSE_CHUNK]
+    else:
+        yield from source
+
+
+def iter_epos_elements(source):
+    """
+    Yields the direct children of <epos-print> as soon as each one is
+    closed, feeding ``source`` (text, bytes or an iterable of chunks) to a
+    pull parser. Elements are cleared once the caller is done with them.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    depth = 0  # 1 = inside <epos-print>, 2 = inside one of its children...
+    found = False
+
+    for data in _slices(source):
+        parser.feed(data)
+        for event, elem in parser.read_events():
+            if event == "start":
+                if depth:
+                    depth += 1
+                elif elem.tag == EPOS_PRINT_TAG and not found:
+                    depth = 1
+                    found = True
+            elif depth:
+                if depth == 2:
+                    yield elem
+                    elem.clear()
+                depth -= 1
+
+    parser.close()
+    if not found:
+        raise Exception("<epos-print> not found")
+
+
+# ================================================================
+# Helpers
+# ================================================================
+class CompileState:
+    """Printer state that ePOS carries from one element to the next, plus compile options."""
+
+    def __init__(self, image_mode: str = "raster", optimize_images: bool = True, download_printer: str = None,
+                 graphics: list = None):
+        self.image_mode = image_mode
+        self.optimize_images = optimize_images
+        self.download_printer = download_printer
+        self.graphics = [] if graphics is None else graphics  # download graphics digests the job prints
+        self.cut = False
+        self.reset()
+
+    def reset(self):
+        self.encoding = "utf-8"
+        self.align = "left"
+        self.width = 1
+        self.height = 1
+        self.modes = {}  # name -> last command setting a mode that lasts until changed
+
+    def preamble(self) -> bytes:
+        """ESC @ and the modes set since, bringing a reset printer back to this state."""
+        return INIT + b"".join(self.modes.values())
+
+
+def _u16(n: int) -> bytes:
+    return bytes([n & 0xFF, (n >> 8) & 0xFF])
+
+
+def _flag(value: str) -> bytes:
+    return b"\x01" if value == "true" else b"\x00"
+
+
+def _int(attrib, name, default, low=0, high=255) -> int:
+    try:
+        value = int(attrib.get(name, default))
+    except ValueError:
+        value = default
+    return max(low, min(high, value))
+
+
+def _mode(state, name: str, command: bytes) -> bytes:
+    """A command setting a mode that lasts, remembered so a resumed job can restore it."""
+    state.modes[name] = command
+    return command
+
+
+def _align(attrib, state) -> bytes:
+    align = attrib.get("align")
+    if not align:
+        return b""
+    state.align = align if align in ALIGN else "left"
+    return _mode(state, "align", ALIGN.get(align, ALIGN_LEFT))
+
+
+def _gs_k(cn: bytes, params: bytes) -> bytes:
+    """GS ( k: 2D symbol function ``cn`` with its fn byte and parameters."""
+    return b"\x1d(k" + _u16(len(params) + 1) + cn + params
+
+
+def raster(width_bytes: int, height: int, raw: bytes) -> bytes:
+    """GS v 0 raster bit image."""
+    return b"\x1d\x76\x30\x00" + bytes([width_bytes & 0xFF, width_bytes >> 8, height & 0xFF, height >> 8]) + raw
+
+
+# ================================================================
+# Element compilers
+# ================================================================
+def compile_feed(elem, state) -> bytes:
+    a = elem.attrib
+    out = bytearray()
+    if "linespc" in a:
+        out += _mode(state, "linespc", b"\x1b3" + bytes([_int(a, "linespc", 30)]))
+    if "unit" in a:
+        dots = _int(a, "unit", 0, high=0xFFFF)
+        while dots > 0:
+            out += b"\x1bJ" + bytes([min(dots, 255)])  # ESC J n: feed n dots
+            dots -= 255
+    elif "line" in a or not a:
+        # A bare <feed/> is one line; linespc alone (addLineSpace) only sets the spacing
+        out += b"\n" * int(a.get("line", "1"))
+    return bytes(out)
+
+
+TEXT_FONTS = {"font_a": 0, "font_b": 1, "font_c": 2, "font_d": 3, "font_e": 4, "special_a": 97, "special_b": 98}
+
+# lang -> (commands, Python codec for the text that follows)
+TEXT_LANGS = {
+    "en": (b"\x1c.\x1bt\x00", "cp437"),              # FS . kanji off, ESC t 0 (PC437)
+    "ja": (b"\x1cC\x01\x1c&", "shift_jis"),          # FS C 1 Shift JIS, FS & kanji on
+    "zh-cn": (b"\x1c&", "gb18030"),
+    "zh-tw": (b"\x1c&", "big5"),
+    "ko": (b"\x1c&", "euc_kr"),
+    "multi": (b"\x1c(C\x02\x000\x02", "utf-8"),      # FS ( C fn 48: UTF-8
+}
+
+TEXT_COLORS = {"color_1": 0, "color_2": 1}
+
+
+def compile_text(elem, state) -> bytes:
+    a = elem.attrib
+    # Like every other text attribute, alignment holds until a later element changes it
+    out = bytearray(_align(a, state))
+
+    if "lang" in a:
+        if a["lang"] in TEXT_LANGS:
+            cmd, state.encoding = TEXT_LANGS[a["lang"]]
+            out += _mode(state, "lang", cmd)
+        else:
+            logger.warning(f"Unsupported text lang={a['lang']}, keeping {state.encoding}")
+    if a.get("font") in TEXT_FONTS:
+        out += _mode(state, "font", b"\x1bM" + bytes([TEXT_FONTS[a["font"]]]))
+    if "smooth" in a:
+        out += _mode(state, "smooth", b"\x1db" + _flag(a["smooth"]))
+
+    if any(k in a for k in ("dw", "dh", "width", "height")):
+        if "dw" in a:
+            state.width = 2 if a["dw"] == "true" else 1
+        if "dh" in a:
+            state.height = 2 if a["dh"] == "true" else 1
+        state.width = _int(a, "width", state.width, 1, 8)
+        state.height = _int(a, "height", state.height, 1, 8)
+        out += _mode(state, "size", b"\x1d!" + bytes([((state.width - 1) << 4) | (state.height - 1)]))
+
+    if "em" in a:
+        out += _mode(state, "em", b"\x1bE" + _flag(a["em"]))
+    if "ul" in a:
+        out += _mode(state, "ul", b"\x1b-" + _flag(a["ul"]))
+    if "reverse" in a:
+        out += _mode(state, "reverse", b"\x1dB" + _flag(a["reverse"]))
+    if a.get("color") in TEXT_COLORS:
+        out += _mode(state, "color", b"\x1br" + bytes([TEXT_COLORS[a["color"]]]))
+    if "rotate" in a:
+        out += _mode(state, "rotate", b"\x1b{" + _flag(a["rotate"]))
+    if "linespc" in a:
+        out += _mode(state, "linespc", b"\x1b3" + bytes([_int(a, "linespc", 30)]))
+    if "x" in a:
+        out += b"\x1b$" + _u16(_int(a, "x", 0, high=0xFFFF))
+
+    # Line feeds come from the document (&#10;): a line may span several <text> elements
+    if elem.text:
+        out += elem.text.encode(state.encoding, "replace")
+    return bytes(out)
+
+
+def compile_image(elem, state) -> bytes:
+    img_data_b64 = (elem.text or "").strip()
+    if not img_data_b64:
+        return b""
+
+    height = int(elem.attrib["height"])
+    out = _align(elem.attrib, state)
+    # Repeated images (logos, reprints) are served without decoding them again
+    key = content_key(img_data_b64, height, state.align, state.image_mode, state.optimize_images)
+
+    def decode():
+        raw = base64.b64decode(img_data_b64)
+        if len(raw) % height != 0:
+            raise Exception(f"Image RAW length mismatch height={height}")
+        return raw
+
+    # An image seen before is a logo: keep it in the printer's download graphics
+    if state.download_printer and key in compiled_cache and len(img_data_b64) * 3 // 4 <= DOWNLOAD_GRAPHICS_MAX_BYTES:
+        def image():
+            raw = decode()
+            return len(raw) // height, height, raw
+        state.graphics.append(key)
+        return out + download_graphics.command_for(state.download_printer, key, image)
+
+    def compile_body():
+        raw = decode()
+        if not state.optimize_images:
+            return raster(len(raw) // height, height, raw)
+        return encode_raster_image(raw, len(raw) // height, height, state.align, state.image_mode)
+
+    return Commands.from_chunks([out, compiled_cache.get_or_compile(key, compile_body)])
+
+
+BARCODE_TYPES = {
+    "upc_a": 65, "upc_e": 66, "ean13": 67, "jan13": 67, "ean8": 68, "jan8": 68,
+    "code39": 69, "itf": 70, "codabar": 71, "nw7": 71, "code93": 72, "code128": 73,
+    "gs1_128": 74, "gs1_databar_omnidirectional": 75, "gs1_databar_truncated": 76,
+    "gs1_databar_limited": 77, "gs1_databar_expanded": 78,
+}
+BARCODE_HRI = {"none": 0, "above": 1, "below": 2, "both": 3}
+
+
+def compile_barcode(elem, state) -> bytes:
+    a = elem.attrib
+    m = BARCODE_TYPES.get(a.get("type"))
+    if m is None:
+        logger.warning(f"Unsupported barcode type={a.get('type')}, skipped")
+        return b""
+
+    data = (elem.text or "").encode("ascii", "replace")
+    if m == 73 and not data.startswith(b"{"):
+        data = b"{B" + data  # CODE128 needs a code set, default to B
+    if not data or len(data) > 255:
+        raise Exception(f"Barcode data length {len(data)} out of range")
+
+    out = bytearray(_align(a, state))
+    out += b"\x1dH" + bytes([BARCODE_HRI.get(a.get("hri", "none"), 0)])
+    out += b"\x1df" + (b"\x01" if a.get("font") == "font_b" else b"\x00")
+    out += b"\x1dw" + bytes([_int(a, "width", 3, 2, 6)])
+    out += b"\x1dh" + bytes([_int(a, "height", 162, 1, 255)])
+    out += b"\x1dk" + bytes([m, len(data)]) + data
+    return bytes(out)
+
+
+QR_MODELS = {"qrcode_model_1": 49, "qrcode_model_2": 50, "qrcode_micro": 51}
+QR_LEVELS = {"level_l": 48, "level_m": 49, "level_q": 50, "level_h": 51}
+MAXICODE_MODES = {"maxicode_mode_2": 50, "maxicode_mode_3": 51, "maxicode_mode_4": 52,
+                  "maxicode_mode_5": 53, "maxicode_mode_6": 54}
+DATAMATRIX_TYPES = {"datamatrix_square": (48, 0), "datamatrix_rectangle_8": (49, 8),
+                    "datamatrix_rectangle_12": (49, 12), "datamatrix_rectangle_16": (49, 16)}
+
+
+def compile_symbol(elem, state) -> bytes:
+    a = elem.attrib
+    kind = a.get("type", "qrcode_model_2")
+    level = a.get("level", "default")
+    data = (elem.text or "").encode(state.encoding, "replace")
+    out = bytearray(_align(a, state))
+
+    if kind in QR_MODELS:
+        cn = b"1"
+        out += _gs_k(cn, b"A" + bytes([QR_MODELS[kind], 0]))
+        out += _gs_k(cn, b"C" + bytes([_int(a, "width", 3, 1, 16)]))
+        out += _gs_k(cn, b"E" + bytes([QR_LEVELS.get(level, 49)]))
+    elif kind in ("pdf417_standard", "pdf417_truncated"):
+        cn = b"0"
+        out += _gs_k(cn, b"A" + bytes([_int(a, "size", 0, 0, 30)]))
+        out += _gs_k(cn, b"C" + bytes([_int(a, "width", 3, 2, 8)]))
+        out += _gs_k(cn, b"D" + bytes([_int(a, "height", 3, 2, 8)]))
+        if level.startswith("level_") and level[6:].isdigit():
+            out += _gs_k(cn, b"E0" + bytes([48 + min(int(level[6:]), 8)]))
+        else:
+            out += _gs_k(cn, b"E1\x01")  # error correction ratio 10%
+        out += _gs_k(cn, b"F" + (b"\x01" if kind == "pdf417_truncated" else b"\x00"))
+    elif kind in MAXICODE_MODES:
+        cn = b"2"
+        out += _gs_k(cn, b"A" + bytes([MAXICODE_MODES[kind]]))
+    elif kind in ("azteccode_fullrange", "azteccode_compact"):
+        cn = b"5"
+        out += _gs_k(cn, b"B" + (b"1" if kind == "azteccode_compact" else b"0") + b"\x00")
+        out += _gs_k(cn, b"C" + bytes([_int(a, "width", 3, 2, 16)]))
+    elif kind in DATAMATRIX_TYPES:
+        cn = b"6"
+        shape, rows = DATAMATRIX_TYPES[kind]
+        out += _gs_k(cn, b"B" + bytes([shape, rows, 0]))
+        out += _gs_k(cn, b"C" + bytes([_int(a, "width", 3, 2, 16)]))
+    else:
+        logger.warning(f"Unsupported symbol type={kind}, skipped")
+        return b""
+
+    out += _gs_k(cn, b"P0" + data)  # store
+    out += _gs_k(cn, b"Q0")         # print
+    return bytes(out)
+
+
+CUT_TYPES = {
+    "no_feed": b"\x1dV\x01",
+    "feed": b"\x1dVB\x00",
+    "reserve": b"\x1dVh\x00",
+    "full_cut_no_feed": b"\x1dV\x00",
+    "full_cut_feed": b"\x1dVA\x00",
+    "full_cut_reserve": b"\x1dVg\x00",
+}
+
+
+def compile_cut(elem, state) -> bytes:
+    state.cut = True
+    return CUT_TYPES.get(elem.attrib.get("type", "feed"), CUT_TYPES["feed"])
+
+
+def compile_pulse(elem, state) -> bytes:
+    a = elem.attrib
+    pin = 1 if a.get("drawer") == "drawer_2" else 0
+    try:
+        ms = int(a.get("time", "pulse_100").split("_")[-1])
+    except ValueError:
+        ms = 100
+    on = max(1, min(ms // 2, 255))  # ESC p m t1 t2, units of 2 ms
+    return b"\x1bp" + bytes([pin, on, min(on * 2, 255)])
+
+
+def compile_logo(elem, state) -> bytes:
+    a = elem.attrib
+    key1, key2 = _int(a, "key1", 32), _int(a, "key2", 32)
+    # GS ( L fn 69: print NV graphics stored under (key1, key2), scale 1x1
+    return _align(a, state) + b"\x1d(L\x06\x000E" + bytes([key1, key2, 1, 1])
+
+
+SOUND_PATTERNS = {"none": 48, "pattern_a": 49, "pattern_b": 50, "pattern_c": 51,
+                  "pattern_d": 52, "pattern_e": 53, "error": 54, "paper_end": 55}
+
+
+def compile_sound(elem, state) -> bytes:
+    a = elem.attrib
+    pattern = SOUND_PATTERNS.get(a.get("pattern", "pattern_a"))
+    if pattern is None:
+        logger.warning(f"Unsupported sound pattern={a.get('pattern')}, skipped")
+        return b""
+    cycle = _int(a, "cycle", 1000, 0, 25500) // 100
+    # ESC ( A fn 48: buzzer pattern, repeat count, cycle in 100 ms units
+    return b"\x1b(A\x04\x000" + bytes([pattern, _int(a, "repeat", 1, 0, 63), max(cycle, 1)])
+
+
+LINE_STYLES = {"thin": (1, False), "medium": (2, False), "thick": (3, False),
+               "thin_double": (1, True), "medium_double": (2, True), "thick_double": (3, True)}
+
+
+def compile_hline(elem, state) -> bytes:
+    """Horizontal ruled line, sent as a small raster so it prints on any model."""
+    a = elem.attrib
+    x1 = _int(a, "x1", 0, high=0xFFFF)
+    x2 = _int(a, "x2", 575, high=0xFFFF)
+    x1, x2 = min(x1, x2), max(x1, x2)
+    thickness, double = LINE_STYLES.get(a.get("style", "thin"), LINE_STYLES["thin"])
+
+    width_bytes = x2 // 8 + 1
+    row = bytearray(width_bytes)
+    for x in range(x1, x2 + 1):
+        row[x // 8] |= 0x80 >> (x % 8)
+    rows = [bytes(row)] * thickness
+    if double:
+        rows += [bytes(width_bytes)] * thickness + [bytes(row)] * thickness
+    return raster(width_bytes, len(rows), b"".join(rows))
+
+
+def compile_command(elem, state) -> bytes:
+    """Raw ESC/POS given as hexadecimal text."""
+    return bytes.fromhex("".join((elem.text or "").split()))
+
+
+def compile_reset(elem, state) -> bytes:
+    state.reset()
+    return INIT
+
+
+PAGE_DIRECTIONS = {"left_to_right": 0, "bottom_to_top": 1, "right_to_left": 2, "top_to_bottom": 3}
+
+
+def _page_shape(fn: bytes, a) -> bytes:
+    # GS ( Q fn 48 (line) / fn 49 (rectangle): x1 y1 x2 y2, style, color, type
+    thickness, double = LINE_STYLES.get(a.get("style", "thin"), LINE_STYLES["thin"])
+    coords = b"".join(_u16(_int(a, k, 0, high=0xFFFF)) for k in ("x1", "y1", "x2", "y2"))
+    return b"\x1d(Q\x0c\x00" + fn + coords + bytes([thickness, 1, 2 if double else 1])
+
+
+def compile_page(elem, state) -> bytes:
+    out = bytearray(b"\x1bL")  # ESC L: enter page mode
+    for child in elem:
+        tag = child.tag.split("}")[-1]
+        a = child.attrib
+        if tag == "area":
+            out += b"\x1bW" + b"".join(_u16(_int(a, k, 0, high=0xFFFF)) for k in ("x", "y", "width", "height"))
+        elif tag == "direction":
+            out += b"\x1bT" + bytes([PAGE_DIRECTIONS.get(a.get("dir"), 0)])
+        elif tag == "position":
+            out += b"\x1b$" + _u16(_int(a, "x", 0, high=0xFFFF))
+            out += b"\x1d$" + _u16(_int(a, "y", 0, high=0xFFFF))
+        elif tag == "line":
+            out += _page_shape(b"0", a)
+        elif tag == "rectangle":
+            out += _page_shape(b"1", a)
+        elif tag in ELEMENT_COMPILERS and tag != "page":
+            out += ELEMENT_COMPILERS[tag](child, state)
+        else:
+            logger.warning(f"Unsupported page element <{tag}>, skipped")
+    out += b"\x0c"  # FF: print the page and go back to standard mode
+    return bytes(out)
+
+
+ELEMENT_COMPILERS = {
+    "feed": compile_feed,
+    "text": compile_text,
+    "image": compile_image,
+    "barcode": compile_barcode,
+    "symbol": compile_symbol,
+    "cut": compile_cut,
+    "pulse": compile_pulse,
+    "logo": compile_logo,
+    "sound": compile_sound,
+    "hline": compile_hline,
+    "command": compile_command,
+    "reset": compile_reset,
+    "page": compile_page,
+}
+
+# Layout and recovery only matter to Epson's own ePOS service
+IGNORED_ELEMENTS = {"layout", "recovery", "vline-begin", "vline-end"}
+
+
+# ================================================================
+# Public API
+# ================================================================
+def iter_escpos_from_epos_xml(source, image_mode: str = "raster", optimize_images: bool = True,
+                              download_printer: str = None, graphics: list = None, states: list = None):
+    """
+    Compiles an ePOS-Print SOAP document to ESC/POS, one chunk per element.
+    ``image_mode`` is ``"raster"`` (GS v 0) or ``"graphics"`` (GS ( L) and
+    ``optimize_images`` runs images through raster.encode_raster_image.
+    With ``download_printer`` set, repeated images are stored in that
+    printer's download graphics memory and printed by key; the digests of
+    those images are appended to ``graphics``, to be committed to
+    download_graphics once the job has printed. ``states`` gets
+    ``(end, preamble)`` for each chunk: the job offset where it ends and
+    the commands restoring the printer state in effect there.
+    """
+    state = CompileState(image_mode, optimize_images, download_printer, graphics)
+    pos = len(INIT)
+    yield INIT
+    if states is not None:
+        states.append((pos, INIT))
+    for elem in iter_epos_elements(source):
+        tag = elem.tag.split("}")[-1]
+        compiler = ELEMENT_COMPILERS.get(tag)
+        if compiler is not None:
+            chunk = compiler(elem, state)
+            if chunk:
+                yield chunk
+                pos += len(chunk)
+                if states is not None:
+                    preamble = state.preamble()
+                    # Most elements change no mode: share the previous bytes
+                    if preamble == states[-1][1]:
+                        preamble = states[-1][1]
+                    states.append((pos, preamble))
+        elif tag not in IGNORED_ELEMENTS:
+            logger.warning(f"Unsupported ePOS element <{tag}>, skipped")
+    # Documents without an explicit <cut> keep the historical trailing cut
+    if not state.cut:
+        yield CUT
+
+
+def compile_epos_xml(source, image_mode: str = "raster", optimize_images: bool = True,
+                     download_printer: str = None) -> Commands:
+    graphics, states = [], []
+    commands = Commands.from_chunks(iter_escpos_from_epos_xml(source, image_mode, optimize_images,
+                                                              download_printer, graphics, states))
+    commands.graphics = graphics
+    commands.states = states
+    return commands
+
+
+def coalesce_chunks(chunks, min_size: int = WRITE_CHUNK):
+    """Re-groups an iterable of chunks into writes of at least ``min_size`` bytes."""
+    if isinstance(chunks, (bytes, bytearray, memoryview)):
+        yield chunks
+        return
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        if len(buf) >= min_size:
+            yield bytes(buf)
+            buf.clear()
+    if buf:
+        yield bytes(buf)
@@ -1,17 +1,45 @@
 # epson_epos_handler.py
-import socket
-import xml.etree.ElementTree as ET
-from fastapi import APIRouter, Body, Response
-import logging
-import usb.core
-import usb.util
-import base64
-from ddl_path import load_libusb_backend
-from preview_handler import send_escpos_preview
 import asyncio
+import html
+import os
+import re
+import time
+from fastapi import APIRouter, Body, Header, Query, Response
+import logging
+from usb_pool import usb_pool, WriteProgress
+from net_pool import net_pool
+from epos_compiler import compile_epos_xml, coalesce_chunks
+from preview_handler import schedule_escpos_preview
+from print_queue import submit_job, QueueFullError
+from raster import raster_stats, Commands
+from escpos_cache import compiled_cache, download_graphics
+from printer_events import printer_events
+from net_discovery import net_discovery
+from render_api import render_async, render_response, RenderBusyError
+from spool import spool, SPOOL_REPLY_SUCCESS
+from get_printer_list import usb_discovery
+from status_monitor import status_monitor, printer_key
+from idempotency import idempotency_key, print_requests
+from metrics import stage_seconds, print_jobs, bytes_sent, print_errors
+from printer_config import printer_config, pool_balancer, parse_target, member_paper_end
 router = APIRouter()
 logger = logging.getLogger("epson-epos")
 
+# Printers (vid_pid or IP) that get images as GS ( L graphics instead of GS v 0
+GRAPHICS_MODE_PRINTERS = {parse_target(p)[1]
+                          for p in filter(None, os.environ.get("GRAPHICS_MODE_PRINTERS", "").split(","))}
+# Printers (vid_pid or IP) that keep repeated logos in download graphics memory
+DOWNLOAD_GRAPHICS_PRINTERS = {parse_target(p)[1]
+                              for p in filter(None, os.environ.get("DOWNLOAD_GRAPHICS_PRINTERS", "").split(","))}
+
+# printer -> jobs, failures, bytes written and seconds spent writing
+print_stats = {}
+# Printers that have taken a job since the agent started
+printed_to = set()
+
+# A drawer kick must happen while the cashier is there, never from the spool
+DRAWER_KICK = re.compile(r"<(?:[\w-]+:)?pulse\b")
+
 # ================================================================
 # Utils
 # ================================================================
@@ -19,146 +47,486 @@ def xml_success():
     return Response("<response success='true' code=''></response>", media_type="text/xml")
 
 def xml_error(code, msg=""):
+    print_errors.inc(code)
     return Response(f"<response success='false' code='{code}'>{msg}</response>", media_type="text/xml")
 
+def xml_succeeded(response: Response) -> bool:
+    return b"success='true'" in response.body
+
+def xml_spooled(job_ids, code):
+    """
+    A failed print that was spooled: the print error with the spool ids, or
+    with SPOOL_REPLY_SUCCESS a success the POS will not send again.
+    """
+    job_ids = ",".join(map(str, job_ids))
+    if not SPOOL_REPLY_SUCCESS:
+        return xml_error(code, f"Spooled as job {job_ids}")
+    print_errors.inc("SPOOLED")
+    return Response(f"<response success='true' code='SPOOLED'>{job_ids}</response>", media_type="text/xml")
+
+def xml_targets(results: dict):
+    """
+    One ``<response>`` for a job sent to several printers, with a ``<target>``
+    per printer. ``results`` maps each target to ``(code, printer, job_id)``:
+    the member a pool target went to and the spool id of a failed job. It
+    succeeds when every printer printed the job; otherwise the code is the
+    printers' common error when none of them printed, else PARTIAL_ERROR,
+    and the POS reads the targets to see which. A spooled target keeps its
+    error unless SPOOL_REPLY_SUCCESS makes it a success with code SPOOLED.
+    """
+    codes, attrs = {}, {}
+    for target, (code, printer, job_id) in results.items():
+        codes[target] = "SPOOLED" if job_id and SPOOL_REPLY_SUCCESS else code
+        attrs[target] = ((f" printer='{html.escape(printer)}'" if printer else "")
+                         + (f" spooled='{job_id}'" if job_id else ""))
+    failed = {target: code for target, code in codes.items() if code not in ("", "SPOOLED")}
+    if not failed:
+        code = "SPOOLED" if "SPOOLED" in codes.values() else ""
+    elif len(failed) == len(codes) and len(set(failed.values())) == 1:
+        code = next(iter(failed.values()))
+    else:
+        code = "PARTIAL_ERROR"
+    if code:
+        print_errors.inc(code)
+    targets = "".join(
+        f"<target name='{html.escape(target)}' success='{str(target not in failed).lower()}' code='{c}'{attrs[target]}/>"
+        for target, c in codes.items())
+    return Response(f"<response success='{str(not failed).lower()}' code='{code}'>{targets}</response>",
+                    media_type="text/xml")
+
+def record_print(printer: str, written: int, seconds: float, ok: bool):
+    stats = print_stats.setdefault(printer, {"jobs": 0, "failures": 0, "bytes": 0, "seconds": 0.0})
+    stats["jobs"] += 1
+    stats["failures"] += 0 if ok else 1
+    stats["bytes"] += written
+    stats["seconds"] += seconds
+    print_jobs.inc(printer, "ok" if ok else "failed")
+    if ok:
+        printed_to.add(printer)
+    bytes_sent.inc(printer, amount=written)
+    if not ok:
+        # The printer may have been power cycled, send stored logos again
+        download_graphics.forget(printer)
+    printer_events.publish({"type": "job", "printer": printer, "ok": ok, "bytes": written,
+                            "seconds": round(seconds, 3)})
+
 
 # ================================================================
 # Epson ePOS XML → ESC/POS Converter
 # ================================================================
-def generate_escpos_from_epos_xml(xml_text: str, printer: str) -> bytes:
-    ns = {
-        "s": "http://schemas.xmlsoap.org/soap/envelope/",
-        "e": "http://www.epson-pos.com/schemas/2011/03/epos-print"
-    }
-
-    root = ET.fromstring(xml_text)
-    epos = root.find(".//e:epos-print", ns)
-    if epos is None:
-        raise Exception("<epos-print> not found")
-    esc = b"\x1b@"  # ESC @ (init)
-
-    for child in epos:
-        tag = child.tag.split("}")[-1]
-
-        # FEED
-        if tag == "feed":
-            esc += b"\n" * int(child.attrib.get("line", "1"))
-
-        # TEXT
-        elif tag == "text":
-            align = child.attrib.get("align", "left")
-            esc += {
-                "center": b"\x1b\x61\x01",
-                "right":  b"\x1b\x61\x02"
-            }.get(align, b"\x1b\x61\x00")
-
-            esc += (child.text or "").encode("utf-8") + b"\n"
-
-        # IMAGE
-        elif tag == "image":
-            img_data_b64 = (child.text or "").strip()
-            if not img_data_b64:
-                continue
-
-            raw = base64.b64decode(img_data_b64)
-            height = int(child.attrib["height"])
-
-            if len(raw) % height != 0:
-                raise Exception(f"Image RAW length mismatch height={height}")
-
-            width_bytes = len(raw) // height
-            esc += b"\x1d\x76\x30\x00"
-            esc += bytes([width_bytes & 0xFF, width_bytes >> 8])
-            esc += bytes([height & 0xFF, height >> 8])
-            esc += raw
-
-    esc += b"\x1dV\x00"  # CUT
-    asyncio.create_task(send_escpos_preview(esc, printer))
+def compile_options(printer: str, dry_run: bool = False) -> tuple:
+    """The (image_mode, download_printer) a printer's jobs are compiled with."""
+    image_mode = "graphics" if printer in GRAPHICS_MODE_PRINTERS else "raster"
+    # A dry run never reaches the printer, so it must not assume logos are stored there
+    download_printer = printer if printer in DOWNLOAD_GRAPHICS_PRINTERS and not dry_run else None
+    return image_mode, download_printer
+
+
+def generate_escpos_from_epos_xml(xml_text: str, printer: str, dry_run: bool = False) -> bytes:
+    image_mode, download_printer = compile_options(printer, dry_run)
+    with stage_seconds.time("compile", printer):
+        esc = compile_epos_xml(xml_text, image_mode=image_mode, download_printer=download_printer)
+    schedule_escpos_preview(esc, printer)
     return esc
 
 
+def generate_escpos_for_printers(xml_text: str, printers: list, compiled: dict = None,
+                                 preview: bool = True) -> dict:
+    """
+    ``{printer: esc}``, compiling once per distinct set of compile options
+    rather than per printer. Pass the same ``compiled`` dict to later calls
+    for the same document to keep reusing it. ``preview=False`` leaves the
+    preview to the caller, once it knows which printer got the job.
+    """
+    compiled = {} if compiled is None else compiled
+    jobs = {}
+    for printer in printers:
+        options = compile_options(printer)
+        if options not in compiled:
+            with stage_seconds.time("compile", printer):
+                compiled[options] = compile_epos_xml(xml_text, image_mode=options[0], download_printer=options[1])
+        jobs[printer] = compiled[options]
+        if preview:
+            schedule_escpos_preview(jobs[printer], printer)
+    return jobs
+
+
+def usb_printer(vid: str, pid: str):
+    """
+    The one key of a USB printer (``04b8_0e28``) for its queue, stats, spool
+    and graphics, however the URL spells the ids; None when they are not hex.
+    """
+    try:
+        return printer_key(vid, pid)
+    except ValueError:
+        return None
+
+
+def printer_seen(printer: str, transport: str) -> bool:
+    """
+    Whether a printer is known to exist: it took a job before, is on the
+    USB bus, or was found on the LAN. A failure on any other printer is a
+    wrong VID/PID or IP, not something a retry fixes.
+    """
+    if printer in printed_to:
+        return True
+    if transport == "usb":
+        return usb_discovery.get(*printer.split("_")) is not None
+    info = net_discovery.printers.get(printer)
+    return info is not None and info["matched_by"] in ("mDNS", "Port 9100", "Configured")
+
+
+def spool_failed_job(printer: str, transport: str, xml_text: str, esc: bytes, *args, resume: int = 0):
+    """
+    Spools a job that failed to print, returning its id, or None when it
+    cannot or must not be spooled. ``resume`` is where the failed write
+    stopped on a command boundary: only the rest of the job is spooled,
+    behind the commands restoring the printer state it had reached.
+    """
+    if not spool.enabled:
+        return None
+    if not printer_seen(printer, transport):
+        logger.warning(f"Not spooling the job for {printer}: the printer has never been seen")
+        return None
+    if DRAWER_KICK.search(xml_text):
+        logger.warning(f"Not spooling the job for {printer}: it opens the cash drawer")
+        return None
+    try:
+        if printer in DOWNLOAD_GRAPHICS_PRINTERS:
+            # The failure made us forget the stored logos, the retry must define them again
+            esc = compile_epos_xml(xml_text, image_mode=compile_options(printer)[0])
+        elif resume:
+            logger.info(f"Spooling {printer} job from byte {resume} of {len(esc)}, the rest was printed")
+            esc = (esc.preamble(resume) if isinstance(esc, Commands) else b"") + esc[resume:]
+        return spool.add(printer, transport, esc, *args)
+    except Exception as e:
+        logger.error(f"Could not spool job for {printer}: {e}")
+        return None
+
+
 # ================================================================
 # USB Printing
 # ================================================================
-def direct_usb_print(data: bytes, pid: str, vid: str):
+def direct_usb_print(data: bytes, pid: str, vid: str, progress: WriteProgress = None):
+    """Streams a job to the printer command by command; ``progress`` tells the caller how far it got."""
+    start = time.perf_counter()
+    printer = printer_key(vid, pid)
+    progress = progress or WriteProgress()
+    progress.total = len(data)
     try:
-        dev = usb.core.find(
-            idVendor=int(vid, 16),
-            idProduct=int(pid, 16),
-            backend=load_libusb_backend()
-        )
-        if dev is None:
-            raise Exception("USB printer not found")
-
-        try:
-            if dev.is_kernel_driver_active(0):
-                dev.detach_kernel_driver(0)
-        except:
-            pass
-
-        usb.util.claim_interface(dev, 0)
-        cfg = dev.get_active_configuration()
-        intf = cfg[(0, 0)]
-
-        ep_out = None
-        for ep in intf:
-            if usb.util.endpoint_direction(ep.bEndpointAddress) == usb.util.ENDPOINT_OUT:
-                ep_out = ep.bEndpointAddress
-                break
-
-        if ep_out is None:
-            raise Exception("No USB OUT endpoint found")
-        
-        dev.write(ep_out, data, timeout=5000)
-
-        usb.util.release_interface(dev, 0)
-        dev.reset()
+        commands, preamble = (data.commands(), data.preamble) if isinstance(data, Commands) else (data, None)
+        written = usb_pool.write(vid, pid, commands, progress=progress, preamble=preamble)
+        record_print(printer, written, time.perf_counter() - start, True)
+        spool.supersede(printer, data)
+        download_graphics.commit(printer, getattr(data, "graphics", ()))
         return True
 
     except Exception as e:
-        logger.error(f"USB Print Error: {e}")
+        logger.error(f"USB Print Error after {progress.written} of {len(data)} bytes: {e}")
+        record_print(printer, progress.written, time.perf_counter() - start, False)
         return False
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, "usb_print", printer)
 
 
 # ================================================================
 # Network Printing
 # ================================================================
-def direct_network_print(data: bytes, ip: str):
+async def direct_network_print(data: bytes, ip: str):
+    start = time.perf_counter()
     try:
-        with socket.create_connection((ip, 9100), timeout=10) as s:
-            s.sendall(data)
+        written = await net_pool.write(ip, coalesce_chunks(data))
+        record_print(ip, written, time.perf_counter() - start, True)
+        spool.supersede(ip, data)
+        download_graphics.commit(ip, getattr(data, "graphics", ()))
         return True
     except Exception as e:
         logger.error(f"Network Print Error: {e}")
+        record_print(ip, 0, time.perf_counter() - start, False)
         return False
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, "net_print", ip)
+
+
+async def network_print_many(jobs: dict) -> dict:
+    """Prints ``{ip: esc}`` on every printer at once, each through its own queue."""
+    results = await asyncio.gather(
+        *(submit_job(ip, direct_network_print, esc, ip) for ip, esc in jobs.items()),
+        return_exceptions=True,
+    )
+    return dict(zip(jobs, results))
+
+
+# Transport name (as returned by printer_config.parse_target) -> print function
+TRANSPORTS = {"usb": direct_usb_print, "network": direct_network_print}
+spool.transports.update(TRANSPORTS)
+
+
+def pool_usb_print(data: bytes, pid: str, vid: str, progress: WriteProgress = None):
+    """A pool job: the print, then a fresh status on the same queue, so paper that ran out shows right away."""
+    ok = direct_usb_print(data, pid, vid, progress)
+    if ok:
+        try:
+            status_monitor.poll(printer_key(vid, pid))
+        except Exception as e:
+            logger.warning(f"Status check after the pool job on {vid}_{pid} failed: {e}")
+    return ok
+
+
+async def pool_network_print(data: bytes, ip: str):
+    ok = await direct_network_print(data, ip)
+    if ok:
+        try:
+            await net_discovery.refresh_status(ip)
+        except Exception as e:
+            logger.warning(f"Status check after the pool job on {ip} failed: {e}")
+    return ok
+
+
+POOL_TRANSPORTS = {"usb": pool_usb_print, "network": pool_network_print}
 
 
 # ================================================================
 # ROUTES
 # ================================================================
-@router.post("/vid/{vid}/pid/{pid}/cgi-bin/epos/service.cgi")
-async def epson_usb_route(vid: str, pid: str, xml_data: str = Body(..., media_type="text/xml")):
+async def print_usb(printer: str, xml_data: str):
+    """Prints on the USB printer ``printer``, a normalised ``vvvv_pppp`` (see usb_printer)."""
+    vid, pid = printer.split("_")
+    if not printer_seen(printer, "usb"):
+        # No queue (and worker thread) for a printer that is not there
+        return xml_error("USB_ERROR", "Printer not found")
     try:
-        esc = generate_escpos_from_epos_xml(xml_data, vid+"_"+pid)
-        return xml_success() if direct_usb_print(esc, pid, vid) else xml_error("USB_ERROR")
+        esc = generate_escpos_from_epos_xml(xml_data, printer)
+        progress = WriteProgress()
+        ok = await submit_job(printer, direct_usb_print, esc, pid, vid, progress)
+        if ok:
+            return xml_success()
+        job_id = spool_failed_job(printer, "usb", xml_data, esc, pid, vid, resume=progress.committed)
+        return xml_spooled([job_id], "USB_ERROR") if job_id else xml_error("USB_ERROR")
+    except QueueFullError as e:
+        return xml_error("BUSY", str(e))
     except Exception as e:
         return xml_error("PARSE_ERROR", str(e))
 
 
-@router.post("/ip/{ip}/cgi-bin/epos/service.cgi")
-async def epson_ip_route(ip: str, xml_data: str = Body(..., media_type="text/xml")):
+async def print_network(ips: list, xml_data: str):
+    if not ips:
+        return xml_error("UNKNOWN_TARGET", "No printer address given")
+    try:
+        jobs = generate_escpos_for_printers(xml_data, ips)
+    except Exception as e:
+        return xml_error("PARSE_ERROR", str(e))
+
+    results = await network_print_many(jobs)
+    codes = {}
+    for i, r in results.items():
+        if r is True:
+            net_discovery.watch(i)
+            codes[i] = ("", None, None)
+        elif isinstance(r, QueueFullError):
+            codes[i] = ("BUSY", None, None)
+        else:
+            codes[i] = ("NETWORK_ERROR", None, spool_failed_job(i, "network", xml_data, jobs[i], i))
+    if len(ips) > 1:
+        # Each printer answers for itself, as on /print: one full queue must not hide the copies that printed
+        return xml_targets(codes)
+
+    code, _, job_id = codes[ips[0]]
+    if code == "BUSY":
+        return xml_error("BUSY", str(results[ips[0]]))
+    if job_id:
+        return xml_spooled([job_id], "NETWORK_ERROR")
+    return xml_error(code) if code else xml_success()
+
+
+async def print_target(target: str, xml_data: str, esc: bytes) -> tuple:
+    """Prints on one printer, spooling the job when it fails; returns ``(code, None, spool job id)``."""
+    transport, _, args = parse_target(target)
+    if transport == "usb" and not printer_seen(target, "usb"):
+        return "USB_ERROR", None, None
+    progress = WriteProgress()
+    try:
+        ok = await submit_job(target, TRANSPORTS[transport], esc, *args,
+                              *((progress,) if transport == "usb" else ()))
+    except QueueFullError:
+        return "BUSY", None, None
+    if ok:
+        if transport == "network":
+            net_discovery.watch(target)
+        return "", None, None
+    job_id = spool_failed_job(target, transport, xml_data, esc, *args, resume=progress.committed)
+    return ("USB_ERROR" if transport == "usb" else "NETWORK_ERROR"), None, job_id
+
+
+async def print_pool(name: str, xml_data: str, compiled: dict = None) -> tuple:
+    """
+    Prints on the least-loaded ready member of a pool, failing over to the
+    next member when one fails or reports paper end right after taking
+    the job, and spools the job for the first choice when they
+    all fail. Returns ``(code, member used, spool job id)``.
+    """
+    compiled = {} if compiled is None else compiled
+    code, member, job_id = await send_pool_job(name, xml_data, compiled)
+    if member:
+        # One preview per job, for the member that has it, rather than one per member tried
+        schedule_escpos_preview(compiled[compile_options(member)], member)
+    return code, member, job_id
+
+
+async def send_pool_job(name: str, xml_data: str, compiled: dict) -> tuple:
+    members = pool_balancer.rank(printer_config.pools.get(name, []))
+    if not members:
+        return "UNKNOWN_TARGET", None, None
+    code = "BUSY"
+    progress = {}   # member -> WriteProgress of its USB write
+    stalled = None  # first member that took the job but ran out of paper
+    for member in members:
+        transport, _, args = parse_target(member)
+        try:
+            esc = generate_escpos_for_printers(xml_data, [member], compiled, preview=False)[member]
+        except Exception as e:
+            logger.error(f"Pool {name}: could not compile the job for {member}: {e}")
+            return "PARSE_ERROR", None, None
+        if transport == "usb":
+            progress[member] = WriteProgress()
+        try:
+            with pool_balancer.assign(member):
+                ok = await submit_job(member, POOL_TRANSPORTS[transport], esc, *args,
+                                      *((progress[member],) if transport == "usb" else ()))
+        except QueueFullError:
+            continue
+        if ok:
+            if transport == "network":
+                net_discovery.watch(member)
+            # Only paper running out during the job means it may not have printed;
+            # a drawer pin or the FEED button says nothing about the ticket
+            if not member_paper_end(member):
+                return "", member, None
+            pool_balancer.mark_failed(member)
+            stalled = stalled or member
+            logger.warning(f"Pool {name}: {member} reports paper end after the job, trying the next member")
+            continue
+        pool_balancer.mark_failed(member)
+        code = "USB_ERROR" if transport == "usb" else "NETWORK_ERROR"
+        logger.warning(f"Pool {name}: job failed on {member}, trying the next member")
+
+    if stalled:
+        # No other member took it: it waits in that printer and prints once paper is loaded
+        return "", stalled, None
+    if code == "BUSY":
+        return code, None, None
+    # Every member failed: keep the job for the first choice
+    first = members[0]
+    transport, _, args = parse_target(first)
+    esc = generate_escpos_for_printers(xml_data, [first], compiled, preview=False)[first]
+    resume = progress[first].committed if first in progress else 0
+    job_id = spool_failed_job(first, transport, xml_data, esc, *args, resume=resume)
+    return code, (first if job_id else None), job_id
+
+
+async def print_targets(targets: list, xml_data: str):
+    """Prints one document on USB and network printers and pools at once, answering per target."""
+    compiled = {}
     try:
-        esc = generate_escpos_from_epos_xml(xml_data, str(ip))
-        return xml_success() if direct_network_print(esc, ip) else xml_error("NETWORK_ERROR")
+        jobs = generate_escpos_for_printers(
+            xml_data, [t for t in targets if t not in printer_config.pools], compiled)
     except Exception as e:
         return xml_error("PARSE_ERROR", str(e))
 
+    results = await asyncio.gather(*(
+        print_pool(target, xml_data, compiled) if target in printer_config.pools
+        else print_target(target, xml_data, jobs[target])
+        for target in targets))
+    return xml_targets(dict(zip(targets, results)))
+
+
+async def print_named_targets(names: list, xml_data: str, header: str = None):
+    try:
+        targets = printer_config.expand(names)
+    except KeyError as e:
+        return xml_error("UNKNOWN_TARGET", f"No printer group or pool {e.args[0]}")
+    if not targets:
+        return xml_error("UNKNOWN_TARGET", "No printers to print on")
+    key = idempotency_key(",".join(targets), xml_data, header)
+    return await print_requests.run(key, lambda: print_targets(targets, xml_data), keep=xml_succeeded,
+                                    remember=bool(header))
+
+
+# Repeats of a request with the same Idempotency-Key header within
+# IDEMPOTENCY_WINDOW get the first one's response instead of printing again.
+# Without the header, only a copy of a document still printing on the same
+# printer waits for the first one: the same document sent again later is a
+# reprint or another drawer kick. Errors are not kept, so a retry prints.
+@router.post("/vid/{vid}/pid/{pid}/cgi-bin/epos/service.cgi")
+async def epson_usb_route(vid: str, pid: str, xml_data: str = Body(..., media_type="text/xml"),
+                          idempotency_key_header: str = Header(None, alias="Idempotency-Key")):
+    printer = usb_printer(vid, pid)
+    if printer is None:
+        return xml_error("UNKNOWN_TARGET", f"Not a USB vendor/product id: {vid}/{pid}")
+    key = idempotency_key(printer, xml_data, idempotency_key_header)
+    return await print_requests.run(key, lambda: print_usb(printer, xml_data), keep=xml_succeeded,
+                                    remember=bool(idempotency_key_header))
+
+
+@router.post("/ip/{ip}/cgi-bin/epos/service.cgi")
+async def epson_ip_route(ip: str, xml_data: str = Body(..., media_type="text/xml"),
+                         idempotency_key_header: str = Header(None, alias="Idempotency-Key")):
+    # "10.0.0.5,10.0.0.6" sends the same ticket to several printers (kitchen + bar copy)
+    ips = list(dict.fromkeys(filter(None, (i.strip() for i in str(ip).split(",")))))
+    if not ips:
+        return xml_error("UNKNOWN_TARGET", "No printer address given")
+    key = idempotency_key(",".join(ips), xml_data, idempotency_key_header)
+    return await print_requests.run(key, lambda: print_network(ips, xml_data), keep=xml_succeeded,
+                                    remember=bool(idempotency_key_header))
+
+@router.post("/print")
+async def epson_targets_route(targets: str = Query(..., examples=["04b8_0202,192.168.1.20,kitchen"]),
+                              xml_data: str = Body(..., media_type="text/xml"),
+                              idempotency_key_header: str = Header(None, alias="Idempotency-Key")):
+    """One document to several printers: USB ``vid_pid``, IPs and printer group names, comma separated."""
+    return await print_named_targets(str(targets).split(","), xml_data, idempotency_key_header)
+
+
+@router.post("/group/{name}/cgi-bin/epos/service.cgi")
+async def epson_group_route(name: str, xml_data: str = Body(..., media_type="text/xml"),
+                            idempotency_key_header: str = Header(None, alias="Idempotency-Key")):
+    # The ePOS endpoint form of /print, for a POS that can only be given a printer URL
+    return await print_named_targets([name], xml_data, idempotency_key_header)
+
+
+@router.post("/pool/{name}/cgi-bin/epos/service.cgi")
+async def epson_pool_route(name: str, xml_data: str = Body(..., media_type="text/xml"),
+                           idempotency_key_header: str = Header(None, alias="Idempotency-Key")):
+    # The job prints once, on whichever pool member is ready and least loaded
+    if name not in printer_config.pools:
+        return xml_error("UNKNOWN_TARGET", f"No printer pool {name}")
+    return await print_named_targets([name], xml_data, idempotency_key_header)
+
 @router.post("/vid/{vid}/pid/{pid}/success/cgi-bin/epos/service.cgi")
-async def epson_usb_route_success(vid: str, pid: str, xml_data: str = Body(..., media_type="text/xml")):
+async def epson_usb_route_success(vid: str, pid: str, xml_data: str = Body(..., media_type="text/xml"),
+                                  format: str = Query(None, pattern="^(png|pdf)$")):
+    """Dry run: compiles without printing, returning the rendered receipt when ``format`` is given."""
     try:
-        generate_escpos_from_epos_xml(xml_data, vid+"_"+pid )
+        esc = generate_escpos_from_epos_xml(xml_data, usb_printer(vid, pid) or vid+"_"+pid, dry_run=True)
         print("")
         logger.error(f"=================== success at VID: {vid} | PID: {pid} ")
+        if format:
+            return render_response(await render_async(esc, format), format)
         return xml_success()
+    except RenderBusyError as e:
+        return xml_error("BUSY", str(e))
     except Exception as e:
         return xml_error("PARSE_ERROR", str(e))
+
+
+@router.get("/print-stats")
+def print_stats_route():
+    """Image bytes saved by the raster pipeline, cache hit rates, per-printer write throughput and USB writes in progress."""
+    return {"status": "success", "message": {
+        "raster": raster_stats,
+        "cache": compiled_cache.stats(),
+        "download_graphics": download_graphics.stats(),
+        "idempotency": print_requests.stats(),
+        "printers": print_stats,
+        "usb_writes": {printer: p.as_dict() for printer, p in list(usb_pool.writes.items())},
+    }}
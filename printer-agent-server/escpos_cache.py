@@ -0,0 +1,177 @@
+# escpos_cache.py
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+ESCPOS_CACHE_MAX_BYTES = int(os.environ.get("ESCPOS_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Download graphics (printer RAM, GS ( L fn 83/85): slots per printer, the
+# largest image worth keeping there, and how long a definition is trusted
+# before it is sent again (the printer loses it on power off)
+DOWNLOAD_GRAPHICS_SLOTS = int(os.environ.get("DOWNLOAD_GRAPHICS_SLOTS", "8"))
+DOWNLOAD_GRAPHICS_MAX_BYTES = int(os.environ.get("DOWNLOAD_GRAPHICS_MAX_BYTES", str(32 * 1024)))
+DOWNLOAD_GRAPHICS_TTL = float(os.environ.get("DOWNLOAD_GRAPHICS_TTL", "600"))
+
+
+def content_key(*parts) -> bytes:
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode())
+        h.update(b"\x00")
+    return h.digest()
+
+
+# ================================================================
+# Compiled fragment cache
+# ================================================================
+class CompiledCache:
+    """Content-addressed LRU of compiled ESC/POS, bounded by total bytes."""
+
+    def __init__(self, max_bytes: int = ESCPOS_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self.entries
+
+    def get_or_compile(self, key: bytes, compile_fn) -> bytes:
+        with self._lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = compile_fn()
+        if len(value) > self.max_bytes:
+            return value
+        with self._lock:
+            if key not in self.entries:
+                self.entries[key] = value
+                self.total_bytes += len(value)
+                while self.total_bytes > self.max_bytes:
+                    _, old = self.entries.popitem(last=False)
+                    self.total_bytes -= len(old)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "bytes": self.total_bytes, "hits": self.hits, "misses": self.misses}
+
+
+compiled_cache = CompiledCache()
+
+
+# ================================================================
+# Download graphics registry
+# ================================================================
+def define_download_graphics(kc1: int, kc2: int, width_bytes: int, height: int, data: bytes) -> bytes:
+    """GS ( L / GS 8 L fn 83: define raster download graphics under (kc1, kc2)."""
+    width = width_bytes * 8
+    params = b"0S0" + bytes([kc1, kc2, 1, width & 0xFF, width >> 8, height & 0xFF, height >> 8]) + b"1"
+    size = len(params) + len(data)
+    if size <= 0xFFFF:
+        return b"\x1d(L" + bytes([size & 0xFF, size >> 8]) + params + data
+    return b"\x1d8L" + size.to_bytes(4, "little") + params + data
+
+
+def print_download_graphics(kc1: int, kc2: int) -> bytes:
+    """GS ( L fn 85: print the download graphics stored under (kc1, kc2) at 1x1."""
+    return b"\x1d(L\x06\x000U" + bytes([kc1, kc2, 1, 1])
+
+
+class DownloadGraphics:
+    """
+    Remembers which images each printer holds in download graphics memory,
+    so a repeated logo is sent once and then printed by key. A definition
+    only counts as stored once the job carrying it has printed (``commit``).
+    Definitions are forgotten after DOWNLOAD_GRAPHICS_TTL, after a failed
+    print, when the USB handle has to be reopened and when the printer is
+    detached, since the printer may have been power cycled.
+    """
+
+    KC1 = ord("P")
+
+    def __init__(self, slots: int = DOWNLOAD_GRAPHICS_SLOTS, ttl: float = DOWNLOAD_GRAPHICS_TTL):
+        self.slots = slots
+        self.ttl = ttl
+        # printer -> OrderedDict digest -> (kc2, stored_at or None until committed, (width_bytes, height, data))
+        self.printers = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def command_for(self, printer: str, digest: bytes, image) -> bytes:
+        """
+        Commands printing the image stored under ``digest``, defining it first
+        when the printer is not known to hold it. ``image()`` returns
+        (width_bytes, height, data) and is only called to define it. The
+        definition keeps its slot but is sent again by every job until one
+        carrying it is committed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            defined = self.printers.setdefault(printer, OrderedDict())
+            entry = defined.get(digest)
+            if entry is not None and entry[1] is not None and now - entry[1] < self.ttl:
+                defined.move_to_end(digest)
+                self.hits += 1
+                return print_download_graphics(self.KC1, entry[0])
+
+            self.misses += 1
+            if entry is not None:
+                kc2 = entry[0]
+                del defined[digest]
+            elif len(defined) >= self.slots:
+                _, (kc2, _, _) = defined.popitem(last=False)
+            else:
+                used = {e[0] for e in defined.values()}
+                kc2 = next(k for k in range(ord("0"), ord("0") + self.slots) if k not in used)
+            width_bytes, height, data = image()
+            defined[digest] = (kc2, None, (width_bytes, height, data))
+
+        return define_download_graphics(self.KC1, kc2, width_bytes, height, data) + \
+            print_download_graphics(self.KC1, kc2)
+
+    def commit(self, printer: str, digests):
+        """Marks the images of a job that has printed as stored in the printer."""
+        now = time.monotonic()
+        with self._lock:
+            defined = self.printers.get(printer, {})
+            for digest in digests:
+                entry = defined.get(digest)
+                if entry is not None and entry[1] is None:
+                    defined[digest] = (entry[0], now, entry[2])
+
+    def image_for(self, printer: str, kc1: int, kc2: int):
+        """(width_bytes, height, data) defined under the key, used by the preview."""
+        with self._lock:
+            for slot, _, image in self.printers.get(printer, {}).values():
+                if kc1 == self.KC1 and slot == kc2:
+                    return image
+        return None
+
+    def forget(self, printer: str):
+        with self._lock:
+            self.printers.pop(printer, None)
+
+    def on_device(self, event: str, info: dict):
+        if event in ("detached", "reopened"):
+            self.forget(f"{info['vid']:04x}_{info['pid']:04x}")
+
+    def stats(self) -> dict:
+        return {"printers": len(self.printers), "hits": self.hits, "misses": self.misses}
+
+
+download_graphics = DownloadGraphics()
@@ -3,7 +3,11 @@ import usb.core
 import usb.util
 import os
 import sys
+import threading
+import time
 from starlette.templating import Jinja2Templates
+from ddl_path import get_libusb_backend
+from usb_pool import parse_usb_id
 logger = logging.getLogger(__name__)
 
 if getattr(sys, 'frozen', False):
@@ -58,63 +62,170 @@ def is_system_usb_device(manufacturer, product):
     return any(k in m or k in p for k in SYSTEM_USB_KEYWORDS)
 
 KEYWORDS = ["printer", "thermal", "receipt", "pos", "rugtek", "xprinter"]
+
+# Seconds a discovery snapshot is served before the bus is rescanned
+USB_DISCOVERY_TTL = float(os.environ.get("USB_DISCOVERY_TTL", "5"))
+
+
+# ================================================================
+# Discovery cache
+# ================================================================
+def describe_device(device):
+    """Reads the descriptor strings and interface class of a newly seen device."""
+    is_printer_interface = False
+    for cfg in device:
+        for intf in cfg:
+            if intf.bInterfaceClass == 0x07:
+                is_printer_interface = True
+                break
+        if is_printer_interface:
+            break
+
+    manufacturer = usb.util.get_string(device, device.iManufacturer) or "Unknown"
+    product = usb.util.get_string(device, device.iProduct) or "Unknown"
+    return {
+        "vid": device.idVendor,
+        "pid": device.idProduct,
+        "manufacturer": manufacturer,
+        "product": product,
+        "is_printer_interface": is_printer_interface,
+        "is_system": is_system_usb_device(manufacturer, product),
+    }
+
+
+def unreadable_device(device):
+    """Stands in for a device whose descriptors could not be read, so it is not read again."""
+    return {
+        "vid": device.idVendor,
+        "pid": device.idProduct,
+        "manufacturer": "Unknown",
+        "product": "Unknown",
+        "is_printer_interface": False,
+        "is_system": False,
+    }
+
+
+class UsbDiscoveryCache:
+    """
+    Snapshot of the USB bus indexed by ``vid_pid``. A rescan only walks the
+    device list; descriptor strings are read once per newly attached device,
+    and a device they cannot be read from is kept with "Unknown" strings
+    rather than retried on every rescan.
+    Listeners get ``(event, info)`` with event ``"attached"``/``"detached"``.
+    """
+
+    def __init__(self, ttl: float = USB_DISCOVERY_TTL):
+        self.ttl = ttl
+        self.devices = {}  # (bus, address, vid, pid) -> info
+        self.by_id = {}    # "vvvv_pppp" -> info
+        self.listeners = []
+        self.scanned_at = 0.0
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def refresh(self, force: bool = False):
+        with self._lock:
+            if not force and time.monotonic() - self.scanned_at < self.ttl:
+                return
+            seen = {}
+            for device in usb.core.find(find_all=True, backend=get_libusb_backend()):
+                key = (device.bus, device.address, device.idVendor, device.idProduct)
+                info = self.devices.get(key)
+                if info is None:
+                    try:
+                        info = describe_device(device)
+                    except usb.core.USBError:
+                        info = unreadable_device(device)
+                    except Exception as e:
+                        logger.warning(f"Error reading device info: {e}")
+                        info = unreadable_device(device)
+                seen[key] = info
+
+            attached = [info for key, info in seen.items() if key not in self.devices]
+            detached = [info for key, info in self.devices.items() if key not in seen]
+            self.devices = seen
+            self.by_id = {f"{i['vid']:04x}_{i['pid']:04x}": i for i in seen.values()}
+            self.scanned_at = time.monotonic()
+
+        for info in attached:
+            self._notify("attached", info)
+        for info in detached:
+            self._notify("detached", info)
+
+    def _notify(self, event: str, info: dict):
+        for listener in list(self.listeners):
+            try:
+                listener(event, info)
+            except Exception as e:
+                logger.warning(f"USB {event} listener failed: {e}")
+
+    def get(self, vid, pid):
+        self.refresh()
+        return self.by_id.get(f"{parse_usb_id(vid):04x}_{parse_usb_id(pid):04x}")
+
+    def start_watcher(self, interval: float = None):
+        """
+        Rescans in the background so attach/detach events fire without a
+        request. pyusb does not expose libusb hotplug callbacks, so this is
+        a cheap periodic walk of the device list.
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        # Rescan a bit faster than the TTL so requests never hit a stale snapshot
+        interval = interval or self.ttl / 2
+
+        def loop():
+            while True:
+                try:
+                    self.refresh(force=True)
+                except Exception as e:
+                    logger.warning(f"USB discovery rescan failed: {e}")
+                time.sleep(interval)
+
+        self._watcher = threading.Thread(target=loop, name="usb-discovery", daemon=True)
+        self._watcher.start()
+
+
+usb_discovery = UsbDiscoveryCache()
+
+
 def list_known_epos_printers(known=True):
-    devices = usb.core.find(find_all=True)
+    usb_discovery.refresh()
     printers = []
 
-    for device in devices:
-        try:
-            vid = device.idVendor
-            pid = device.idProduct
-
-            # Flags
-            is_known_vendor = vid in EPOS_PRINTERS
-            is_printer_interface = False
-
-            # Check interface class
-            for cfg in device:
-                for intf in cfg:
-                    if intf.bInterfaceClass == 0x07:
-                        is_printer_interface = True
-                        break
-                if is_printer_interface:
-                    break
-
-            # Manufacturer/Product strings
-            manufacturer = usb.util.get_string(device, device.iManufacturer) or "Unknown"
-            product = usb.util.get_string(device, device.iProduct) or "Unknown"
-            name_combined = f"{manufacturer} {product}".lower()
-
-            if is_system_usb_device(manufacturer, product):
-                continue
-
-            has_keyword_match = any(keyword in name_combined for keyword in KEYWORDS)
-
-            # Skip logic
-            if known and not is_known_vendor:
-                continue
-            elif known and not (is_known_vendor or is_printer_interface or has_keyword_match):
-                continue
-
-            printers.append({
-                "vendor_id": f"{vid:04x}",
-                "product_id": f"{pid:04x}",
-                "manufacturer": manufacturer,
-                "vendor_name": EPOS_PRINTERS.get(vid, "Unknown"),
-                "product": product,
-                "matched_by": (
-                    "No Filter Applied" if not known else
-                    "Vendor id" if is_known_vendor else
-                    "Interface class" if is_printer_interface else
-                    "Name keyword"
-                ),
-            })
-
-        except usb.core.USBError:
+    for info in usb_discovery.devices.values():
+        vid = info["vid"]
+        pid = info["pid"]
+        manufacturer = info["manufacturer"]
+        product = info["product"]
+
+        if info["is_system"]:
             continue
-        except Exception as e:
-            logger.warning(f"Error reading device info: {e}")
+
+        # Flags
+        is_known_vendor = vid in EPOS_PRINTERS
+        is_printer_interface = info["is_printer_interface"]
+        has_keyword_match = any(keyword in f"{manufacturer} {product}".lower() for keyword in KEYWORDS)
+
+        # Skip logic
+        if known and not is_known_vendor:
             continue
+        elif known and not (is_known_vendor or is_printer_interface or has_keyword_match):
+            continue
+
+        printers.append({
+            "vendor_id": f"{vid:04x}",
+            "product_id": f"{pid:04x}",
+            "manufacturer": manufacturer,
+            "vendor_name": EPOS_PRINTERS.get(vid, "Unknown"),
+            "product": product,
+            "matched_by": (
+                "No Filter Applied" if not known else
+                "Vendor id" if is_known_vendor else
+                "Interface class" if is_printer_interface else
+                "Name keyword"
+            ),
+        })
 
     return printers
 
@@ -0,0 +1,87 @@
+# idempotency.py
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from metrics import register, Gauge
+
+# Seconds a finished job answers repeats of its request, 0 disables it
+IDEMPOTENCY_WINDOW = float(os.environ.get("IDEMPOTENCY_WINDOW", "60"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", "1024"))
+
+
+def idempotency_key(target: str, body: str, header: str = None) -> str:
+    """The client's Idempotency-Key when it sent one, else a hash of the target and the document."""
+    if header:
+        return f"{target}\x00key\x00{header}"
+    return f"{target}\x00sha256\x00{hashlib.sha256(body.encode('utf-8', 'surrogateescape')).hexdigest()}"
+
+
+class IdempotencyCache:
+    """
+    Runs each print request once. The POS resends ``service.cgi`` when its
+    HTTP request times out, which happens while a slow printer is still
+    busy with the first copy: a repeat arriving while the job runs waits
+    for the same result, and one arriving within ``window`` seconds after
+    it finished gets the stored result. Results the caller does not want
+    kept (errors worth retrying) are dropped once the job ends, and so are
+    all results of requests run with ``remember=False``: those only join
+    a copy that is still running.
+    """
+
+    def __init__(self, window: float = IDEMPOTENCY_WINDOW, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self.window = window
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> [task, finished_at or None]
+        self.hits = 0
+        self.joined = 0
+        self.misses = 0
+
+    def _expire(self):
+        now = time.monotonic()
+        while self.entries:
+            _, (_, finished) = next(iter(self.entries.items()))
+            if finished is None or now - finished <= self.window:
+                break
+            self.entries.popitem(last=False)
+
+    async def run(self, key: str, func, keep=lambda result: True, remember: bool = True):
+        """Awaits ``func()`` once per ``key`` and window, returning its result to every repeat."""
+        if self.window <= 0:
+            return await func()
+        self._expire()
+        entry = self.entries.get(key)
+        if entry is not None and (entry[1] is None or time.monotonic() - entry[1] <= self.window):
+            if entry[1] is None:
+                self.joined += 1
+            else:
+                self.hits += 1
+            return await asyncio.shield(entry[0])
+
+        self.misses += 1
+        task = asyncio.ensure_future(func())
+        entry = self.entries[key] = [task, None]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+        def done(t: asyncio.Task):
+            if self.entries.get(key) is not entry:
+                return
+            if not remember or t.cancelled() or t.exception() is not None or not keep(t.result()):
+                del self.entries[key]
+            else:
+                entry[1] = time.monotonic()
+                self.entries.move_to_end(key)
+
+        task.add_done_callback(done)
+        # A client giving up must not cancel the print the repeats are waiting for
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "hits": self.hits, "joined": self.joined, "misses": self.misses}
+
+
+print_requests = IdempotencyCache()
+register(Gauge("print_agent_idempotency_total", "Print requests by idempotency cache outcome", ("result",),
+               lambda: {(k,): v for k, v in print_requests.stats().items() if k != "entries"}, type="counter"))
@@ -1,16 +1,28 @@
+import asyncio
 import logging
 import uvicorn
 import os
 import sys
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from check_status import check_printer_status
-from get_printer_list import list_known_epos_printers , printer_list_page
+from status_monitor import status_monitor
+from net_discovery import net_discovery
+from printer_events import printer_events
+from get_printer_list import list_known_epos_printers , printer_list_page, usb_discovery
 from fastapi.responses import HTMLResponse
 
 from epson_epos_handler import router as epson_router
 from preview_handler import router as preview_route
+from render_api import router as render_route
+from spool import spool, router as spool_route
+from metrics import router as metrics_route
+from printer_config import printer_config, pool_balancer, router as printer_config_route
+from print_queue import shutdown_queues
+from usb_pool import usb_pool
+from net_pool import net_pool
+from escpos_cache import download_graphics
 import ddl_path
 
 from set_local_ip import get_lan_ip
@@ -21,10 +33,38 @@ PORT=8090
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("print-server")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    printer_config.load()
+    printer_events.attach(asyncio.get_running_loop())
+    usb_discovery.listeners.append(printer_events.on_device)
+    status_monitor.listeners.append(printer_events.on_status)
+    net_discovery.listeners.append(printer_events.on_status)
+    usb_discovery.listeners.append(spool.on_device)
+    status_monitor.listeners.append(spool.on_status)
+    net_discovery.listeners.append(spool.on_status)
+    status_monitor.listeners.append(pool_balancer.on_status)
+    net_discovery.listeners.append(pool_balancer.on_status)
+    usb_discovery.listeners.append(download_graphics.on_device)
+    usb_pool.listeners.append(download_graphics.on_device)
+    usb_discovery.start_watcher()
+    status_monitor.start()
+    await net_discovery.start()
+    for members in printer_config.pools.values():
+        pool_balancer.watch(members)
+    spool.start()
+    yield
+    spool.stop()
+    await net_discovery.stop()
+    shutdown_queues()
+    usb_pool.close_all()
+    net_pool.close_all()
+
 app = FastAPI(
     title="Local Print Agent API",
     description="A FastAPI server to communicate with ESC/POS thermal printers over USB.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -47,21 +87,33 @@ def check_host_route():
     return {"status": "ok", "message": "success", "server_ip": get_lan_ip()+":"+str(PORT)}
 
 @app.get("/printer-list")
-async def printer_list(request: Request, all: bool = Query(False, description="Return all devices")):
+async def printer_list(request: Request, all: bool = Query(False, description="Return all devices"),
+                       network: bool = Query(True, description="Include network printers")):
     """
     Returns the list of known EPOS printers.
     If all=true, include all printers (even offline or unconfigured).
+    Network printers (with an ``ip`` and their cached status) follow the USB ones.
     """
     printers = list_known_epos_printers(known=not all)  # pass the param to your function
+    if network:
+        printers += net_discovery.list()
     return {"status": "success", "message": printers}
 
 
 @app.get("/vid/{vid}/pid/{pid}/printer/status-usb/saved")
 def checkPrinterStatus(vid: str, pid: str):
-    return check_printer_status(vid, pid)
+    return status_monitor.get(vid, pid)
+
+@app.get("/ip/{ip}/printer/status")
+async def checkNetworkPrinterStatus(ip: str):
+    return await net_discovery.get_status(ip)
 
 app.include_router(epson_router)
 app.include_router(preview_route)
+app.include_router(render_route)
+app.include_router(spool_route)
+app.include_router(metrics_route)
+app.include_router(printer_config_route)
 
 def resource_path(filename: str) -> str:
     if hasattr(sys, '_MEIPASS'):
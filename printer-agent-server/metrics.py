@@ -0,0 +1,161 @@
+# metrics.py
+import threading
+import time
+from bisect import bisect_left
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+router = APIRouter()
+
+# Seconds, from a cached compile (sub-millisecond) to a USB write timeout
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ================================================================
+# Metric types
+# ================================================================
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in list(self.values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Gauge:
+    """
+    A value read at scrape time: ``func()`` returns ``{label values tuple: value}``.
+    ``type="counter"`` exposes totals kept elsewhere (e.g. a cache's hits).
+    """
+
+    def __init__(self, name: str, help: str, labelnames, func, type: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.func = func
+        self.type = type
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        for labels, value in self.func().items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. ``observe`` is one bisect and a few additions
+    under a lock (about a microsecond), so it can sit on the print path.
+    """
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def time(self, *labels) -> _Timer:
+        return _Timer(self, labels)
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in list(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = 'le="' + (bound if isinstance(bound, str) else _number(float(bound))) + '"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+# ================================================================
+# Registry
+# ================================================================
+registry = []
+
+
+def register(metric):
+    registry.append(metric)
+    return metric
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+# Per-stage latency: compile, queue_wait, usb_open, usb_write, usb_print,
+# net_connect, net_print, preview_render, preview_send, status_check
+stage_seconds = register(Histogram(
+    "print_agent_stage_seconds", "Time spent in each stage of a print job, per printer", ("stage", "printer")))
+print_jobs = register(Counter(
+    "print_agent_jobs_total", "Print jobs written, by printer and outcome", ("printer", "result")))
+bytes_sent = register(Counter(
+    "print_agent_bytes_sent_total", "ESC/POS bytes written to each printer", ("printer",)))
+print_errors = register(Counter(
+    "print_agent_errors_total", "Print requests answered with an error or spooled, by response code", ("code",)))
+
+
+# ================================================================
+# ROUTES
+# ================================================================
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics_route():
+    """Prometheus text exposition of every registered metric."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,183 @@
+# net_discovery.py
+import asyncio
+import ipaddress
+import logging
+import os
+import time
+from zeroconf import IPVersion, ServiceStateChange
+from zeroconf.asyncio import AsyncServiceBrowser, AsyncServiceInfo, AsyncZeroconf
+from check_status import check_network_printer_status
+from net_pool import RAW_PORT
+from set_local_ip import get_lan_ip
+
+logger = logging.getLogger("net-discovery")
+
+# Seconds between two subnet probes, 0 disables discovery (mDNS and probe)
+NET_DISCOVERY_INTERVAL = float(os.environ.get("NET_DISCOVERY_INTERVAL", "300"))
+# Seconds between two status queries of each known network printer
+NET_STATUS_INTERVAL = float(os.environ.get("NET_STATUS_INTERVAL", "30"))
+NET_PROBE_CONCURRENCY = int(os.environ.get("NET_PROBE_CONCURRENCY", "64"))
+NET_PROBE_TIMEOUT = float(os.environ.get("NET_PROBE_TIMEOUT", "0.5"))
+
+# Network printers (IPs, comma-separated) whose status is queried from startup
+NETWORK_PRINTERS = list(filter(None, os.environ.get("NETWORK_PRINTERS", "").split(",")))
+
+# Raw port 9100 printers and LPD printers advertise themselves under these
+MDNS_SERVICE_TYPES = ["_pdl-datastream._tcp.local.", "_printer._tcp.local."]
+
+
+async def probe_port(ip: str, port: int = RAW_PORT, timeout: float = NET_PROBE_TIMEOUT) -> bool:
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+class NetworkPrinterDiscovery:
+    """
+    Network printers found by mDNS, by probing port 9100 across the local
+    /24 and by being printed to, keyed by IP, so /printer-list never waits
+    on the network.
+
+    Only printers known to speak ESC/POS (printed to through the agent or
+    listed in NETWORK_PRINTERS) get DLE EOT status queries: an office laser
+    printer on port 9100 would print those bytes as a page. Their last
+    status is cached with ``checked`` (epoch seconds) and listeners get
+    ``(ip, old, new)`` on status changes.
+    """
+
+    def __init__(self):
+        self.printers = {}  # ip -> {"ip", "name", "matched_by", "escpos", "status", "message", "checked"}
+        self.listeners = []
+        self._tasks = set()
+        self._zeroconf = None
+        self._browser = None
+
+    def add(self, ip: str, matched_by: str, name: str = None):
+        info = self.printers.get(ip)
+        if info is None:
+            info = self.printers[ip] = {"ip": ip, "name": name or ip, "matched_by": matched_by, "escpos": False,
+                                        "status": None, "message": None, "checked": None}
+            logger.info(f"Network printer found at {ip} ({matched_by})")
+        elif name and info["name"] == ip:
+            info["name"] = name
+        return info
+
+    def watch(self, ip: str, matched_by: str = "Printed to"):
+        """Marks ``ip`` as an ESC/POS printer, so its status gets polled."""
+        info = self.add(ip, matched_by)
+        if not info["escpos"]:
+            info["escpos"] = True
+            self._spawn(self.refresh_status(ip))
+
+    # ------------------------------------------------------------
+    # Status
+    # ------------------------------------------------------------
+    async def refresh_status(self, ip: str) -> dict:
+        result = await check_network_printer_status(ip)
+        info = self.printers.get(ip)
+        if info is None:
+            return result
+        old = {"status": info["status"], "message": info["message"]}
+        info.update(result, checked=time.time())
+        if (old["status"], old["message"]) != (info["status"], info["message"]):
+            for listener in list(self.listeners):
+                try:
+                    listener(ip, old if old["status"] else None, info)
+                except Exception as e:
+                    logger.warning(f"Network status listener failed: {e}")
+        return info
+
+    async def get_status(self, ip: str) -> dict:
+        """The cached status of ``ip``, queried right away when missing or stale."""
+        self.watch(ip, "Status requested")
+        info = self.printers[ip]
+        if info["checked"] is None or time.time() - info["checked"] > max(NET_STATUS_INTERVAL * 3, 15):
+            info = await self.refresh_status(ip)
+        return {"status": info["status"], "message": info["message"], "checked": info["checked"]}
+
+    async def refresh_all_status(self):
+        await asyncio.gather(*(self.refresh_status(ip) for ip, info in list(self.printers.items()) if info["escpos"]))
+
+    # ------------------------------------------------------------
+    # Discovery
+    # ------------------------------------------------------------
+    async def probe_subnet(self, ip: str = None):
+        """Connects to port 9100 on every host of the /24 around the LAN address, a bounded batch at a time."""
+        ip = ip or get_lan_ip()
+        if ip.startswith("127."):
+            return
+        network = ipaddress.ip_network(f"{ip}/24", strict=False)
+        semaphore = asyncio.Semaphore(NET_PROBE_CONCURRENCY)
+
+        async def probe(host: str):
+            async with semaphore:
+                if await probe_port(host):
+                    self.add(host, "Port 9100")
+
+        await asyncio.gather(*(probe(str(h)) for h in network.hosts() if str(h) != ip))
+
+    def _on_service(self, zeroconf, service_type: str, name: str, state_change: ServiceStateChange):
+        if state_change in (ServiceStateChange.Added, ServiceStateChange.Updated):
+            self._spawn(self._resolve(service_type, name))
+
+    async def _resolve(self, service_type: str, name: str):
+        info = AsyncServiceInfo(service_type, name)
+        if not await info.async_request(self._zeroconf.zeroconf, 3000):
+            return
+        label = name[:-len(service_type)].rstrip(".") or name
+        for ip in info.parsed_addresses(IPVersion.V4Only):
+            self.add(ip, "mDNS", label)
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def start(self):
+        for ip in NETWORK_PRINTERS:
+            self.watch(ip, "Configured")
+        if NET_DISCOVERY_INTERVAL > 0:
+            try:
+                self._zeroconf = AsyncZeroconf(ip_version=IPVersion.V4Only)
+                self._browser = AsyncServiceBrowser(self._zeroconf.zeroconf, MDNS_SERVICE_TYPES,
+                                                    handlers=[self._on_service])
+            except Exception as e:
+                logger.warning(f"mDNS discovery unavailable: {e}")
+            self._spawn(self._every(NET_DISCOVERY_INTERVAL, self.probe_subnet))
+        if NET_STATUS_INTERVAL > 0:
+            self._spawn(self._every(NET_STATUS_INTERVAL, self.refresh_all_status))
+
+    async def _every(self, interval: float, func):
+        while True:
+            try:
+                await func()
+            except Exception as e:
+                logger.warning(f"Network discovery step {func.__name__} failed: {e}")
+            await asyncio.sleep(interval)
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._browser is not None:
+            await self._browser.async_cancel()
+        if self._zeroconf is not None:
+            await self._zeroconf.async_close()
+
+    def list(self) -> list:
+        """Entries for /printer-list, shaped like the USB ones plus ``ip`` and the cached status."""
+        return [{
+            "ip": info["ip"],
+            "manufacturer": "Network",
+            "vendor_name": "Network",
+            "product": info["name"],
+            "matched_by": info["matched_by"],
+            "status": info["status"],
+            "message": info["message"],
+            "checked": info["checked"],
+        } for info in self.printers.values()]
+
+
+net_discovery = NetworkPrinterDiscovery()
@@ -0,0 +1,209 @@
+# net_pool.py
+import asyncio
+import logging
+import os
+import socket
+import time
+from metrics import stage_seconds
+
+logger = logging.getLogger("net-pool")
+
+RAW_PORT = 9100
+NET_CONNECT_TIMEOUT = float(os.environ.get("NET_CONNECT_TIMEOUT", "10"))
+NET_WRITE_TIMEOUT = float(os.environ.get("NET_WRITE_TIMEOUT", "10"))
+# Close idle sockets before the printer does (Epson drops idle port 9100
+# connections after a few minutes, some Wi-Fi adapters much sooner)
+NET_IDLE_TIMEOUT = float(os.environ.get("NET_IDLE_TIMEOUT", "30"))
+# How long the health check waits for unsolicited bytes or EOF
+HEALTH_CHECK_WAIT = 0.001
+
+
+class NetWriteError(OSError):
+    """A write that failed after ``sent`` bytes were handed to the socket."""
+
+    def __init__(self, msg: str, sent: int, timed_out: bool = False):
+        super().__init__(msg)
+        self.sent = sent
+        self.timed_out = timed_out
+
+
+# ================================================================
+# Connection
+# ================================================================
+class NetConnection:
+    """A warm TCP connection to one printer's raw port."""
+
+    def __init__(self, ip: str, port: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.ip = ip
+        self.port = port
+        self.reader = reader
+        self.writer = writer
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        self.jobs = 0
+
+    @classmethod
+    async def open(cls, ip: str, port: int = RAW_PORT, timeout: float = NET_CONNECT_TIMEOUT):
+        try:
+            with stage_seconds.time("net_connect", ip):
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Connecting to {ip}:{port} timed out after {timeout:g}s")
+        sock = writer.get_extra_info("socket")
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for name, value in (("TCP_KEEPIDLE", 10), ("TCP_KEEPINTVL", 5), ("TCP_KEEPCNT", 3)):
+            if hasattr(socket, name):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+        logger.info(f"Connected to network printer {ip}:{port}")
+        return cls(ip, port, reader, writer)
+
+    async def is_healthy(self) -> bool:
+        """
+        A socket the printer has closed reads as EOF. Bytes it sent on its
+        own (automatic status) are drained; they do not make it unhealthy.
+        """
+        if self.writer.is_closing():
+            return False
+        try:
+            while True:
+                data = await asyncio.wait_for(self.reader.read(4096), HEALTH_CHECK_WAIT)
+                if not data:
+                    return False
+        except asyncio.TimeoutError:
+            return True
+        except OSError:
+            return False
+
+    async def send(self, chunks, timeout: float = NET_WRITE_TIMEOUT) -> int:
+        """Writes every chunk within ``timeout`` seconds, raising NetWriteError on failure."""
+        written = 0
+
+        async def send_all():
+            nonlocal written
+            for chunk in chunks:
+                self.writer.write(chunk)
+                await self.writer.drain()
+                written += len(chunk)
+
+        try:
+            await asyncio.wait_for(send_all(), timeout)
+        except asyncio.TimeoutError:
+            raise NetWriteError(f"Writing to {self.ip}:{self.port} timed out after {timeout:g}s", written, True)
+        except OSError as e:
+            raise NetWriteError(f"Writing to {self.ip}:{self.port} failed: {e}", written)
+        return written
+
+    def close(self):
+        self.writer.close()
+
+
+# ================================================================
+# Pool
+# ================================================================
+class NetConnectionPool:
+    """
+    Keeps one connection per printer (ip, port) between jobs. Writes take
+    the connection's lock, so two jobs never interleave on the wire.
+    """
+
+    def __init__(self, idle_timeout: float = NET_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._conns = {}
+        self._connecting = {}
+        self._reaper = None
+
+    async def _get(self, ip: str, port: int) -> NetConnection:
+        key = (ip, port)
+        conn = self._conns.get(key)
+        if conn is not None:
+            return conn
+        # Jobs racing for the first connection share one connect attempt,
+        # which completes into the pool even if the job is cancelled
+        pending = self._connecting.get(key)
+        if pending is None:
+            pending = self._connecting[key] = asyncio.ensure_future(NetConnection.open(ip, port))
+            pending.add_done_callback(lambda f: self._connected(key, f))
+            self._start_reaper()
+        conn = await asyncio.shield(pending)
+        return self._conns.get(key, conn)
+
+    def _connected(self, key, future: asyncio.Future):
+        self._connecting.pop(key, None)
+        if not future.cancelled() and future.exception() is None:
+            self._conns.setdefault(key, future.result())
+
+    def _drop(self, conn: NetConnection):
+        if self._conns.get((conn.ip, conn.port)) is conn:
+            del self._conns[(conn.ip, conn.port)]
+        conn.close()
+        logger.info(f"Closed connection to network printer {conn.ip}:{conn.port}")
+
+    async def run(self, ip: str, func, port: int = RAW_PORT):
+        """
+        Awaits ``func(conn)`` with the printer's connection locked. A pooled
+        connection found dead before use, or failing before ``func`` sent
+        anything, is replaced once. A cancelled or failed job closes the
+        connection, since the printer may have received half a command.
+        """
+        retried = False
+        while True:
+            conn = await self._get(ip, port)
+            async with conn.lock:
+                if self._conns.get((ip, port)) is not conn:
+                    continue  # closed by the idle reaper while we waited
+                if not await conn.is_healthy():
+                    logger.info(f"Connection to {ip}:{port} went stale, reconnecting")
+                    self._drop(conn)
+                    continue
+                try:
+                    result = await func(conn)
+                    conn.last_used = time.monotonic()
+                    conn.jobs += 1
+                    return result
+                except NetWriteError as e:
+                    self._drop(conn)
+                    # A timeout may have sent part of a chunk, never resend after one
+                    if retried or not conn.jobs or e.sent or e.timed_out:
+                        raise
+                    retried = True
+                    logger.warning(f"Connection to {ip}:{port} failed ({e}), reconnecting")
+                except BaseException:
+                    self._drop(conn)
+                    raise
+
+    async def write(self, ip: str, data, port: int = RAW_PORT, timeout: float = NET_WRITE_TIMEOUT) -> int:
+        """Sends ``data`` (bytes or an iterable of chunks) and returns the bytes written."""
+        chunks = [data] if isinstance(data, (bytes, bytearray, memoryview)) else list(data)
+        return await self.run(ip, lambda conn: conn.send(chunks, timeout), port)
+
+    def reap_idle(self):
+        now = time.monotonic()
+        for conn in list(self._conns.values()):
+            # Skip connections that are busy with a job right now
+            if not conn.lock.locked() and now - conn.last_used > self.idle_timeout:
+                self._drop(conn)
+
+    def close_all(self):
+        for conn in list(self._conns.values()):
+            self._drop(conn)
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+
+    def _start_reaper(self):
+        if self._reaper is not None and not self._reaper.done():
+            return
+
+        async def loop():
+            while True:
+                await asyncio.sleep(max(self.idle_timeout / 2, 1))
+                try:
+                    self.reap_idle()
+                except Exception as e:
+                    logger.warning(f"Network idle reaper failed: {e}")
+
+        self._reaper = asyncio.get_running_loop().create_task(loop())
+
+
+net_pool = NetConnectionPool()
@@ -1,17 +1,41 @@
 # escpos_preview_handler.py
 
 import io
+import os
 import base64
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Response
+import zlib
+import asyncio
+import functools
+import json
+import re
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Response, Query
+from fastapi.responses import StreamingResponse
 from PIL import Image, ImageDraw, ImageFont
+from preview_history import PreviewHistory
+from escpos_cache import download_graphics
+from printer_events import printer_events
+from metrics import register, stage_seconds, Gauge
 
 router = APIRouter()
+logger = logging.getLogger("escpos-preview")
 printer_clients = {}
-printer_images = {}
+printer_images = {}  # printer -> PreviewHistory
 
 font = ImageFont.load_default()
 CANVAS_WIDTH = 600
 
+# Previews are rendered off the event loop by a small pool. Each printer has
+# at most one render running and one waiting; a newer receipt replaces the
+# waiting one, so a burst of prints never queues up preview work.
+PREVIEW_WORKERS = int(os.environ.get("PREVIEW_WORKERS", "2"))
+PREVIEW_SEND_TIMEOUT = float(os.environ.get("PREVIEW_SEND_TIMEOUT", "2"))
+preview_executor = ThreadPoolExecutor(max_workers=PREVIEW_WORKERS, thread_name_prefix="preview")
+pending_previews = {}
+rendering_printers = set()
+preview_tasks = set()
+
 
 # -----------------------------
 # WebSocket endpoint
@@ -34,26 +58,89 @@ async def preview_ws(websocket: WebSocket, printer: str):
         printer_clients[printer].discard(websocket)
 
 
+# -----------------------------
+# Printer events (status, job, attach/detach)
+# -----------------------------
+SSE_KEEPALIVE = 15
+
+
+@router.websocket("/events/ws")
+async def events_ws(websocket: WebSocket, printer: str = None):
+    """Pushes printer events as JSON text frames, for one printer or all of them."""
+    await websocket.accept()
+    sub = printer_events.subscribe(printer)
+
+    async def receive():
+        while True:
+            await websocket.receive_text()
+
+    receiver = asyncio.create_task(receive())
+    try:
+        while not receiver.done():
+            get = asyncio.create_task(sub.queue.get())
+            await asyncio.wait({get, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if not get.done():
+                get.cancel()
+                break
+            await websocket.send_text(json.dumps(get.result()))
+    except Exception:
+        pass
+    finally:
+        receiver.cancel()
+        printer_events.unsubscribe(sub)
+
+
+@router.get("/events")
+async def events_sse(printer: str = None):
+    """Server-Sent Events version of /events/ws."""
+    sub = printer_events.subscribe(printer)
+
+    async def stream():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            printer_events.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 # -----------------------------
 # Broadcast combined PNG
 # -----------------------------
-async def broadcast_new_image(img: Image.Image, printer: str):
+def encode_preview(img: Image.Image) -> bytes:
+    """Encodes a preview as a 1-bit PNG, receipts are black on white anyway."""
     buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    b64 = base64.b64encode(buf.getvalue()).decode()
+    img.convert("1", dither=Image.Dither.NONE).save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
 
-    if printer not in printer_clients:
+
+async def broadcast_new_image(png: bytes, printer: str):
+    """
+    Sends the encoded preview as one binary frame to every open page at once.
+    A client that does not take it within PREVIEW_SEND_TIMEOUT is dropped,
+    so one stalled browser never delays the others.
+    """
+    clients = list(printer_clients.get(printer, ()))
+    if not clients:
         return
 
-    dead = []
-    for ws in printer_clients[printer]:
+    async def send(ws):
         try:
-            await ws.send_text(b64)
-        except:
-            dead.append(ws)
+            await asyncio.wait_for(ws.send_bytes(png), PREVIEW_SEND_TIMEOUT)
+        except Exception:
+            printer_clients[printer].discard(ws)
+            try:
+                await ws.close()
+            except Exception:
+                pass
 
-    for ws in dead:
-        printer_clients[printer].discard(ws)
+    await asyncio.gather(*(send(ws) for ws in clients))
 
 
 
@@ -62,112 +149,360 @@ async def broadcast_new_image(img: Image.Image, printer: str):
 # -----------------------------
 def render_escpos_image(data: bytes, width_bytes: int, height: int) -> Image.Image:
     width = width_bytes * 8
-    img = Image.new("1", (width, height), 1)  # 1 = white
-    pixels = img.load()
+    size = width_bytes * height
+    if len(data) < size:
+        # Missing bytes render as white, like the printer's empty buffer
+        data = bytes(data) + b"\x00" * (size - len(data))
+    # GS v 0 rows are MSB-first with 1 = black, which is Pillow's inverted 1-bit raw mode
+    img = Image.frombytes("1", (width, height), bytes(data[:size]), "raw", "1;I")
+    return img.convert("L")
 
-    for y in range(height):
-        for x_byte in range(width_bytes):
-            index = y * width_bytes + x_byte
-            if index >= len(data):
-                continue
-            byte = data[index]
-            for bit in range(8):
-                x = x_byte * 8 + (7 - bit)  # MSB first
-                if x >= width:
-                    continue
-                pixels[x, y] = 0 if (byte >> bit) & 1 else 1
-    return img.convert("RGB")
+
+# -----------------------------
+# ESC/POS command lengths
+# -----------------------------
+# Fixed-length commands by the byte after ESC / GS / FS / DLE
+ESC_FIXED = {0x20: 3, 0x21: 3, 0x24: 4, 0x2d: 3, 0x32: 2, 0x33: 3, 0x40: 2, 0x45: 3, 0x47: 3, 0x4a: 3,
+             0x4c: 2, 0x4d: 3, 0x52: 3, 0x53: 2, 0x54: 3, 0x56: 3, 0x57: 10, 0x61: 3, 0x64: 3,
+             0x70: 5, 0x72: 3, 0x74: 3, 0x7b: 3, 0x0c: 2}
+GS_FIXED = {0x21: 3, 0x24: 4, 0x42: 3, 0x48: 3, 0x4c: 4, 0x57: 4, 0x61: 3, 0x62: 3, 0x66: 3,
+            0x68: 3, 0x77: 3}
+FS_FIXED = {0x26: 2, 0x2e: 2, 0x43: 3, 0x70: 4}
+DLE_FIXED = {0x04: 3, 0x14: 5}
+
+
+def escpos_command_length(data: bytes, i: int) -> int:
+    """Length of the ESC/POS command starting at ``data[i]``, 0 if none is recognised."""
+    n = len(data)
+    if i + 2 >= n:
+        return 0
+    b, c = data[i], data[i + 1]
+
+    # ESC ( X / FS ( X / GS ( X pL pH ...
+    if b in (0x1b, 0x1c, 0x1d) and c == 0x28:
+        return 5 + data[i + 3] + (data[i + 4] << 8) if i + 4 < n else n - i
+    if b == 0x1d:
+        if c == 0x56:  # GS V m [n]
+            return 3 if data[i + 2] in (0, 1, 48, 49) else 4
+        if c == 0x6b:  # GS k m ...
+            if data[i + 2] >= 65:
+                return 4 + data[i + 3] if i + 3 < n else n - i
+            end = data.find(b"\x00", i + 3)
+            return end - i + 1 if end >= 0 else n - i
+        if c == 0x76 and data[i + 2] == 0x30 and i + 7 < n:  # GS v 0
+            return 8 + (data[i + 4] + (data[i + 5] << 8)) * (data[i + 6] + (data[i + 7] << 8))
+        if c == 0x38 and data[i + 2] == 0x4c and i + 6 < n:  # GS 8 L p1..p4
+            return 7 + int.from_bytes(data[i + 3:i + 7], "little")
+        return GS_FIXED.get(c, 0)
+    if b == 0x1b:
+        return ESC_FIXED.get(c, 0)
+    if b == 0x1c:
+        return FS_FIXED.get(c, 0)
+    if b == 0x10:
+        return DLE_FIXED.get(c, 0)
+    return 0
+
+
+def draw_placeholder(draw, label: str, w: int, h: int, align: str, y: int):
+    """Outlined box standing in for printer-side barcodes and 2D symbols."""
+    px = {"left": 20, "center": (CANVAS_WIDTH - w)//2, "right": CANVAS_WIDTH - w - 20}[align]
+    draw.rectangle((px, y, px + w, y + h), outline="black", width=2)
+    draw.text((px + 8, y + h // 2 - 6), label[:40], font=font, fill="black")
 
 
 # -----------------------------
-# ESC/POS → Image Preview (prepend mode)
+# ESC/POS → Image Preview
 # -----------------------------
-async def send_escpos_preview(esc_bytes: bytes, printer:str):
-    img = Image.new("RGB", (CANVAS_WIDTH, 4000), "white")
-    draw = ImageDraw.Draw(img)
-    y = 20
-    x = 20
+PRINTABLE_RUN = re.compile(rb"[\x20-\x7e]+")
+LINE_HEIGHT = 25
+MARGIN = 20
+ALIGNS = {0: "left", 1: "center", 2: "right", 48: "left", 49: "center", 50: "right"}
+
+
+@functools.lru_cache(maxsize=None)
+def glyph(ch: str):
+    """(mask, offset, advance) of one character, rendered by FreeType once."""
+    mask, offset = font.getmask2(ch, mode="L")
+    im = Image.frombytes("L", mask.size, bytes(mask)) if mask.size[0] and mask.size[1] else None
+    return im, offset, font.getlength(ch)
+
+
+def text_width(text: str) -> int:
+    return round(sum(glyph(ch)[2] for ch in text))
+
+
+def draw_text(img: Image.Image, x: int, y: int, text: str):
+    """Pastes cached glyph masks, the same pixels as ``ImageDraw.text`` without rendering the line."""
+    for ch in text:
+        mask, (dx, dy), advance = glyph(ch)
+        if mask is not None:
+            img.paste(0, (round(x) + dx, y + dy), mask)
+        x += advance
+
+
+def aligned_x(width: int, align: str) -> int:
+    return {"left": MARGIN, "center": (CANVAS_WIDTH - width) // 2, "right": CANVAS_WIDTH - width - MARGIN}[align]
+
+
+def layout_escpos(esc_bytes: bytes, stored_graphics=None):
+    """
+    First pass of the preview: walks the ESC/POS once and returns the draw
+    operations with their positions, plus the height of the receipt, so the
+    canvas can be allocated at its exact size. Printable bytes are taken as
+    whole runs and laid out a line at a time.
+
+    Operations are ``("text", x, y, str)``, ``("raster", y, align, (width_bytes,
+    height, data))`` and ``("box", y, align, w, h, label)``.
+    """
+    ops = []
+    y = MARGIN
     align = "left"
+    line = []          # text runs of the current line
+    line_align = None  # alignment in effect when the line started
+    graphics = None    # raster stored by GS ( L fn 112, waiting for fn 50
+    downloads = {}     # (kc1, kc2) -> raster defined by GS ( L fn 83
+    n_bytes = len(esc_bytes)
+
+    def flush_line():
+        nonlocal line, line_align
+        if line:
+            text = "".join(line)
+            ops.append(("text", aligned_x(text_width(text), line_align), y, text))
+        line = []
+        line_align = None
+
+    def place_raster(raster):
+        nonlocal y
+        flush_line()
+        ops.append(("raster", y, align, raster))
+        # Consecutive rasters (image bands) print without a gap
+        y += raster[1]
 
     i = 0
-    while i < len(esc_bytes):
+    while i < n_bytes:
         b = esc_bytes[i]
 
+        # Printable text → extend the current line
+        if 0x20 <= b <= 0x7E:
+            run = PRINTABLE_RUN.match(esc_bytes, i).group()
+            if line_align is None:
+                line_align = align
+            line.append(run.decode("ascii"))
+            i += len(run)
+            continue
+
+        # Newline
+        if b == 0x0a:
+            flush_line()
+            y += LINE_HEIGHT
+            i += 1
+            continue
+
+        c = esc_bytes[i + 1] if i + 1 < n_bytes else None
+
         # ESC @ → init
-        if b == 0x1b and i + 1 < len(esc_bytes) and esc_bytes[i + 1] == 0x40:
-            y = 20
-            x = 20
+        if b == 0x1b and c == 0x40:
+            flush_line()
             align = "left"
             i += 2
             continue
 
         # ESC a n → alignment
-        elif b == 0x1b and i + 2 < len(esc_bytes) and esc_bytes[i + 1] == 0x61:
-            n = esc_bytes[i + 2]
-            align = {0: "left", 1: "center", 2: "right"}.get(n, "left")
+        if b == 0x1b and c == 0x61 and i + 2 < n_bytes:
+            align = ALIGNS.get(esc_bytes[i + 2], "left")
             i += 3
             continue
 
-        # GS v 0 → raster image
-        elif b == 0x1d and i + 5 < len(esc_bytes) and esc_bytes[i + 1] == 0x76 and esc_bytes[i + 2] == 0x30:
-            mode = esc_bytes[i + 3]
-            xL = esc_bytes[i + 4]
-            xH = esc_bytes[i + 5]
-            yL = esc_bytes[i + 6]
-            yH = esc_bytes[i + 7]
-            width_bytes = xL + (xH << 8)
-            height = yL + (yH << 8)
-            data_start = i + 8
-            data_end = data_start + width_bytes * height
-            raster_data = esc_bytes[data_start:data_end]
-
-            if raster_data:
-                im = render_escpos_image(raster_data, width_bytes, height)
-                # Alignment
-                px = {"left": 20, "center": (CANVAS_WIDTH - im.width)//2, "right": CANVAS_WIDTH - im.width - 20}[align]
-                img.paste(im, (px, y))
-                y += im.height + 20
+        # ESC J n → feed n dots
+        if b == 0x1b and c == 0x4a and i + 2 < n_bytes:
+            flush_line()
+            y += esc_bytes[i + 2]
+            i += 3
+            continue
 
+        # GS v 0 → raster image
+        if b == 0x1d and c == 0x76 and i + 7 < n_bytes and esc_bytes[i + 2] == 0x30:
+            width_bytes = esc_bytes[i + 4] + (esc_bytes[i + 5] << 8)
+            height = esc_bytes[i + 6] + (esc_bytes[i + 7] << 8)
+            data_end = i + 8 + width_bytes * height
+            if width_bytes and height and i + 8 < n_bytes:
+                place_raster((width_bytes, height, esc_bytes[i + 8:data_end]))
             i = data_end
             continue
 
-        # Cut command (GS V 0)
-        elif b == 0x1d and i + 2 < len(esc_bytes) and esc_bytes[i + 1] == 0x56:
-            y += 50
-            i += 3
+        # GS ( L / GS 8 L fn 112 → store raster graphics, fn 50 → print them,
+        # fn 83 → define download graphics, fn 85 → print them by key
+        if b == 0x1d and i + 6 < n_bytes and esc_bytes[i + 1:i + 3] in (b"(L", b"8L"):
+            n = escpos_command_length(esc_bytes, i)
+            head = 5 if c == 0x28 else 7
+            fn = esc_bytes[i + head + 1] if i + head + 1 < n_bytes else None
+            printed = None
+            if fn == 0x70 and i + head + 10 < n_bytes:
+                p = i + head + 6
+                width = esc_bytes[p] + (esc_bytes[p + 1] << 8)
+                height = esc_bytes[p + 2] + (esc_bytes[p + 3] << 8)
+                graphics = ((width + 7) // 8, height, esc_bytes[p + 4:i + n])
+            elif fn == 0x32 and graphics:
+                printed, graphics = graphics, None
+            elif fn == 0x53 and i + head + 11 < n_bytes:
+                p = i + head + 6
+                width = esc_bytes[p] + (esc_bytes[p + 1] << 8)
+                height = esc_bytes[p + 2] + (esc_bytes[p + 3] << 8)
+                downloads[(esc_bytes[p - 3], esc_bytes[p - 2])] = ((width + 7) // 8, height, esc_bytes[p + 5:i + n])
+            elif fn == 0x55 and i + head + 3 < n_bytes:
+                key = (esc_bytes[i + head + 2], esc_bytes[i + head + 3])
+                printed = downloads.get(key) or (stored_graphics and stored_graphics(*key))
+            if printed and printed[1]:
+                place_raster(printed)
+            i += n
             continue
 
-        # Printable text
-        elif 0x20 <= b <= 0x7E:
-            ch = chr(b)
-            bbox = draw.textbbox((0, 0), ch, font=font)
-            w = bbox[2] - bbox[0]
-            h = bbox[3] - bbox[1]
+        # Cut command (GS V m [n])
+        if b == 0x1d and c == 0x56 and i + 2 < n_bytes:
+            flush_line()
+            y += 50
+            i += escpos_command_length(esc_bytes, i)
+            continue
 
-            px = {"left": x, "center": (CANVAS_WIDTH - w)//2, "right": CANVAS_WIDTH - w - 20}[align]
-            draw.text((px, y), ch, font=font, fill="black")
-            x += w
-            i += 1
+        # GS k → 1D barcode
+        if b == 0x1d and c == 0x6b and i + 3 < n_bytes:
+            flush_line()
+            n = escpos_command_length(esc_bytes, i)
+            label = esc_bytes[i + 4:i + n] if esc_bytes[i + 2] >= 65 else esc_bytes[i + 3:i + n - 1]
+            ops.append(("box", y, align, 300, 60, "||| " + label.decode("ascii", "replace")))
+            y += 80
+            i += n
             continue
 
-        # Newline
-        elif b == 0x0a:
-            x = 20
-            y += 25
-            i += 1
+        # GS ( k ... fn 81 → print 2D symbol
+        if b == 0x1d and i + 6 < n_bytes and esc_bytes[i + 1:i + 3] == b"(k" and esc_bytes[i + 6] == 0x51:
+            flush_line()
+            ops.append(("box", y, align, 120, 120, "2D"))
+            y += 140
+            i += escpos_command_length(esc_bytes, i)
             continue
 
+        # Any other command → skip it with its parameters, else skip the byte
+        i += escpos_command_length(esc_bytes, i) or 1
+
+    flush_line()
+    return ops, y + 50
+
+
+def render_escpos_preview(esc_bytes: bytes, stored_graphics=None) -> Image.Image:
+    """``stored_graphics(kc1, kc2)`` looks up download graphics defined by earlier receipts."""
+    ops, height = layout_escpos(esc_bytes, stored_graphics)
+    # Grayscale is enough, the preview is encoded as 1-bit anyway
+    img = Image.new("L", (CANVAS_WIDTH, height), "white")
+    draw = ImageDraw.Draw(img)
+    for op in ops:
+        if op[0] == "text":
+            draw_text(img, op[1], op[2], op[3])
+        elif op[0] == "raster":
+            _, y, align, (width_bytes, h, data) = op
+            im = render_escpos_image(data, width_bytes, h)
+            img.paste(im, (aligned_x(im.width, align), y))
         else:
-            i += 1  # skip unknown byte
+            _, y, align, w, h, label = op
+            draw_placeholder(draw, label, w, h, align, y)
+    return img
 
-    cropped = img.crop((0, 0, CANVAS_WIDTH, y + 50))
 
-    # --- Prepend this print to preview list ---
-    if printer_images.get(printer):
-        printer_images[printer].insert(0, cropped)
-    else:
-        printer_images[printer] = [cropped]
-    await broadcast_new_image(cropped, printer)
+def render_and_encode_preview(esc_bytes: bytes, printer: str = None) -> bytes:
+    stored_graphics = functools.partial(download_graphics.image_for, printer) if printer else None
+    return encode_preview(render_escpos_preview(esc_bytes, stored_graphics))
+
+
+def get_history(printer: str) -> PreviewHistory:
+    history = printer_images.get(printer)
+    if history is None:
+        history = printer_images[printer] = PreviewHistory()
+    return history
+
+
+async def render_history_entry(history: PreviewHistory, entry, printer: str = None) -> bytes:
+    # set_png stores the PNG before dropping esc_z, so read esc_z first
+    esc_z = entry.esc_z
+    png = entry.png
+    if png is None:
+        loop = asyncio.get_running_loop()
+        png = await loop.run_in_executor(preview_executor, render_and_encode_preview, zlib.decompress(esc_z), printer)
+        history.set_png(entry, png)
+    return png
+
+
+# -----------------------------
+# Background renderer (prepend mode)
+# -----------------------------
+async def send_escpos_preview(esc_bytes: bytes, printer: str, entry=None):
+    loop = asyncio.get_running_loop()
+    with stage_seconds.time("preview_render", printer):
+        png = await loop.run_in_executor(preview_executor, render_and_encode_preview, esc_bytes, printer)
+    if entry is not None:
+        get_history(printer).set_png(entry, png)
+    with stage_seconds.time("preview_send", printer):
+        await broadcast_new_image(png, printer)
+
+
+async def drain_previews(printer: str):
+    rendering_printers.add(printer)
+    try:
+        while printer in pending_previews:
+            entry, esc_bytes = pending_previews.pop(printer)
+            if not printer_clients.get(printer):
+                continue
+            try:
+                await send_escpos_preview(esc_bytes, printer, entry)
+            except Exception as e:
+                logger.warning(f"Preview render failed for {printer}: {e}")
+    finally:
+        rendering_printers.discard(printer)
+
+
+def schedule_escpos_preview(esc_bytes: bytes, printer: str):
+    """
+    Records the receipt in the printer's history and queues a live render,
+    both only while a preview page is open for ``printer``: with nobody
+    watching, a print job pays nothing for previews.
+    """
+    if not printer_clients.get(printer):
+        return
+    entry = get_history(printer).add(esc_bytes)
+    pending_previews[printer] = (entry, esc_bytes)
+    if printer not in rendering_printers:
+        rendering_printers.add(printer)
+        task = asyncio.get_running_loop().create_task(drain_previews(printer))
+        preview_tasks.add(task)
+        task.add_done_callback(preview_tasks.discard)
+
+
+def websocket_clients() -> dict:
+    clients = {("preview", printer): len(sockets) for printer, sockets in printer_clients.items()}
+    for sub in list(printer_events.subscribers):
+        key = ("events", sub.printer or "")
+        clients[key] = clients.get(key, 0) + 1
+    return clients
+
+
+register(Gauge("print_agent_websocket_clients", "Open preview websockets and event subscribers (websocket or SSE)",
+               ("endpoint", "printer"), websocket_clients))
+
+
+# -----------------------------
+# History paging
+# -----------------------------
+@router.get("/preview/{printer}/history")
+async def preview_history(printer: str, offset: int = Query(0, ge=0), limit: int = Query(10, ge=1, le=50)):
+    """Newest-first page of recent receipts as base64 PNGs, used to backfill a freshly opened preview."""
+    history = printer_images.get(printer)
+    if history is None:
+        return {"status": "success", "message": [], "total": 0}
+
+    items = []
+    for entry in history.page(offset, limit):
+        png = await render_history_entry(history, entry, printer)
+        items.append({"id": entry.id, "created": entry.created, "image": base64.b64encode(png).decode()})
+    return {"status": "success", "message": items, "total": len(history)}
 
 
 
@@ -365,37 +700,60 @@ async def preview_html(printer: str):
             const statusText = document.getElementById("status-text");
             const statusDot = document.getElementById("status-dot");
 
-            const ws = new WebSocket("ws://" + location.host + "/preview/ws/{printer}");
-
-            ws.onopen = () => {{
-                statusText.innerText = "Connected";
-                statusDot.classList.add("connected");
-
-                document.getElementById("print-endpoint").innerText =
-                    location.host + "{url}";
-                document.getElementById("print-endpoint-success").innerText =
-                    location.host + "{url}/success";
-
-                setInterval(() => ws.send("ping"), 5000);
-            }};
-
-            ws.onmessage = (ev) => {{
+            function addPreview(src, prepend) {{
                 const container = document.getElementById("container");
 
                 const wrapper = document.createElement("div");
                 wrapper.className = "preview";
 
                 const img = document.createElement("img");
-                img.src = "data:image/png;base64," + ev.data;
+                img.src = src;
+                if (src.startsWith("blob:")) img.onload = () => URL.revokeObjectURL(src);
 
                 wrapper.appendChild(img);
-                container.insertBefore(wrapper, container.firstChild);
-            }};
+                if (prepend) {{
+                    container.insertBefore(wrapper, container.firstChild);
+                }} else {{
+                    container.appendChild(wrapper);
+                }}
+            }}
+
+            async function backfill() {{
+                try {{
+                    const res = await fetch("/preview/{printer}/history?limit=10");
+                    const data = await res.json();
+                    (data.message || []).forEach(item => addPreview("data:image/png;base64," + item.image, false));
+                }} catch (e) {{
+                    console.warn("Could not load preview history", e);
+                }}
+            }}
+
+            function connect() {{
+                const ws = new WebSocket("ws://" + location.host + "/preview/ws/{printer}");
+                ws.binaryType = "blob";
+
+                ws.onopen = () => {{
+                    statusText.innerText = "Connected";
+                    statusDot.classList.add("connected");
+
+                    document.getElementById("print-endpoint").innerText =
+                        location.host + "{url}";
+                    document.getElementById("print-endpoint-success").innerText =
+                        location.host + "{url}/success";
+
+                    setInterval(() => ws.send("ping"), 5000);
+                }};
+
+                // Each frame is a PNG, shown straight from the binary blob
+                ws.onmessage = (ev) => addPreview(URL.createObjectURL(new Blob([ev.data], {{ type: "image/png" }})), true);
+
+                ws.onclose = () => {{
+                    statusText.innerText = "Disconnected";
+                    statusDot.classList.remove("connected");
+                }};
+            }}
 
-            ws.onclose = () => {{
-                statusText.innerText = "Disconnected";
-                statusDot.classList.remove("connected");
-            }};
+            backfill().finally(connect);
 
             function copyText(elementId, btn) {{
                 const text = document.getElementById(elementId).innerText;
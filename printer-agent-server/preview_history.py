@@ -0,0 +1,86 @@
+# preview_history.py
+import itertools
+import os
+import threading
+import time
+import zlib
+from collections import deque
+
+# Caps per printer
+PREVIEW_HISTORY_MAX_ENTRIES = int(os.environ.get("PREVIEW_HISTORY_MAX_ENTRIES", "50"))
+PREVIEW_HISTORY_MAX_BYTES = int(os.environ.get("PREVIEW_HISTORY_MAX_BYTES", str(8 * 1024 * 1024)))
+PREVIEW_HISTORY_MAX_AGE = float(os.environ.get("PREVIEW_HISTORY_MAX_AGE", str(24 * 3600)))
+
+_ids = itertools.count(1)
+
+
+class PreviewEntry:
+    """
+    One printed receipt. Receipts that were rendered for a live preview keep
+    their 1-bit PNG; the others keep the zlib-compressed ESC/POS and are
+    rendered the first time someone pages through the history.
+    """
+    __slots__ = ("id", "created", "png", "esc_z")
+
+    def __init__(self, esc_bytes: bytes):
+        self.id = next(_ids)
+        self.created = time.time()
+        self.png = None
+        self.esc_z = zlib.compress(esc_bytes, 1)
+
+    @property
+    def size(self) -> int:
+        return len(self.png) if self.png is not None else len(self.esc_z)
+
+    @property
+    def esc_bytes(self) -> bytes:
+        return zlib.decompress(self.esc_z)
+
+
+class PreviewHistory:
+    """Newest-first receipt history for one printer, bounded by count, bytes and age."""
+
+    def __init__(self, max_entries=PREVIEW_HISTORY_MAX_ENTRIES, max_bytes=PREVIEW_HISTORY_MAX_BYTES,
+                 max_age=PREVIEW_HISTORY_MAX_AGE):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.entries = deque()
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, esc_bytes: bytes) -> PreviewEntry:
+        entry = PreviewEntry(esc_bytes)
+        with self._lock:
+            self.entries.appendleft(entry)
+            self.total_bytes += entry.size
+            self._evict()
+        return entry
+
+    def set_png(self, entry: PreviewEntry, png: bytes):
+        with self._lock:
+            if entry.png is not None:
+                return
+            old = entry.size
+            entry.png = png
+            entry.esc_z = None
+            if entry in self.entries:
+                self.total_bytes += entry.size - old
+                self._evict()
+
+    def page(self, offset: int = 0, limit: int = 10) -> list:
+        with self._lock:
+            self._evict()
+            return list(itertools.islice(self.entries, offset, offset + limit))
+
+    def _evict(self):
+        cutoff = time.time() - self.max_age
+        while self.entries and (
+            len(self.entries) > self.max_entries
+            or self.total_bytes > self.max_bytes
+            or self.entries[-1].created < cutoff
+        ):
+            self.total_bytes -= self.entries.pop().size
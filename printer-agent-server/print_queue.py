@@ -0,0 +1,109 @@
+# print_queue.py
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import register, stage_seconds, Gauge
+
+logger = logging.getLogger("print-queue")
+
+# Jobs waiting per printer (the running job is not counted)
+MAX_QUEUE_DEPTH = int(os.environ.get("PRINT_QUEUE_DEPTH", "16"))
+# Seconds a request waits for a free slot before it is rejected
+ENQUEUE_TIMEOUT = float(os.environ.get("PRINT_QUEUE_ENQUEUE_TIMEOUT", "5"))
+
+
+class QueueFullError(Exception):
+    pass
+
+
+# ================================================================
+# Per-printer queue
+# ================================================================
+class PrinterQueue:
+    """
+    FIFO of print jobs for one printer key (``vid_pid`` or IP).
+    A single worker task drains it and runs the blocking transport on a
+    thread dedicated to this printer, so a jammed device only ever blocks
+    its own queue. Coroutine transports are awaited on the event loop.
+    """
+
+    def __init__(self, key: str, max_depth: int = MAX_QUEUE_DEPTH):
+        self.key = key
+        self.queue = asyncio.Queue(maxsize=max_depth)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"print-{key}")
+        self.worker = asyncio.create_task(self._run())
+        self.busy = False
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize() + (1 if self.busy else 0)
+
+    async def submit(self, func, *args, timeout: float = ENQUEUE_TIMEOUT):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            await asyncio.wait_for(self.queue.put((future, func, args, time.perf_counter())), timeout)
+        except asyncio.TimeoutError:
+            raise QueueFullError(f"Print queue for {self.key} is full ({self.queue.maxsize} jobs)")
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            future, func, args, queued = await self.queue.get()
+            stage_seconds.observe(time.perf_counter() - queued, "queue_wait", self.key)
+            self.busy = True
+            try:
+                if future.cancelled():
+                    continue
+                if asyncio.iscoroutinefunction(func):
+                    result = await func(*args)
+                else:
+                    result = await loop.run_in_executor(self.executor, func, *args)
+                if not future.cancelled():
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"Print job failed on {self.key}: {e}")
+                if not future.cancelled():
+                    future.set_exception(e)
+            finally:
+                self.busy = False
+                self.queue.task_done()
+
+    def close(self):
+        self.worker.cancel()
+        self.executor.shutdown(wait=False)
+
+
+# ================================================================
+# Registry
+# ================================================================
+printer_queues = {}
+
+
+def get_queue(key: str) -> PrinterQueue:
+    q = printer_queues.get(key)
+    if q is None:
+        q = printer_queues[key] = PrinterQueue(key)
+    return q
+
+
+async def submit_job(key: str, func, *args):
+    """Queue ``func(*args)`` on the printer ``key`` and wait for its result."""
+    return await get_queue(key).submit(func, *args)
+
+
+def queue_depths() -> dict:
+    return {key: q.depth for key, q in printer_queues.items()}
+
+
+register(Gauge("print_agent_queue_depth", "Jobs waiting or running per printer", ("printer",),
+               lambda: {(key,): depth for key, depth in queue_depths().items()}))
+
+
+def shutdown_queues():
+    for q in printer_queues.values():
+        q.close()
+    printer_queues.clear()
@@ -0,0 +1,291 @@
+# printer_config.py
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from fastapi import APIRouter, Body
+from check_status import STATUS_COMMANDS
+from status_monitor import status_monitor
+from net_discovery import net_discovery
+from print_queue import queue_depths
+
+router = APIRouter()
+logger = logging.getLogger("printer-config")
+
+# Named printer groups and pools, saved by the API and read at startup
+PRINTERS_CONFIG = os.environ.get("PRINTERS_CONFIG",
+                                 os.path.join(os.path.expanduser("~"), ".printer-agent", "printers.json"))
+# Seconds a pool member that failed a job is passed over, unless it reports ready sooner
+POOL_FAILURE_HOLD = float(os.environ.get("POOL_FAILURE_HOLD", "30"))
+
+# DLE EOT messages of a printer that cannot print. A drawer pin, the FEED
+# button or paper near end show in the status too, but the printer prints
+PAPER_END = {"Paper end", "Paper is out"}
+NOT_READY = PAPER_END | {"Cover is open", "Printer is offline"}
+
+USB_TARGET = re.compile(r"^([0-9a-fA-F]{4})_([0-9a-fA-F]{4})$")
+
+
+def parse_target(target: str):
+    """
+    ``("usb", "vvvv_pppp", (pid, vid))`` for a USB printer, else
+    ``("network", ip, (ip,))``; the tuple is the transport's arguments.
+    """
+    m = USB_TARGET.match(target)
+    if m:
+        vid, pid = m.group(1).lower(), m.group(2).lower()
+        return "usb", f"{vid}_{pid}", (pid, vid)
+    return "network", target, (target,)
+
+
+def looks_like_printer(name: str) -> bool:
+    """A vid_pid or an address (IP, IPv6 or a dotted host name) rather than a group or pool name."""
+    return bool(USB_TARGET.match(name)) or "." in name or ":" in name
+
+
+# ================================================================
+# Groups and pools
+# ================================================================
+class PrinterConfig:
+    """
+    Printer groups and pools kept in a JSON file so they survive restarts:
+
+        {"groups": {"tickets": ["04b8_0202", "192.168.1.20"]},
+         "pools": {"kitchen": ["04b8_0e15", "192.168.1.30"]}}
+
+    A job sent to a group prints on every member, one sent to a pool on a
+    single member (see PoolBalancer). Members are printer targets:
+    ``vid_pid`` for USB, an IP for network.
+    """
+
+    def __init__(self, path: str = PRINTERS_CONFIG):
+        self.path = path
+        self.groups = {}
+        self.pools = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read printer config {self.path}: {e}")
+            return
+        self.groups = {name: list(members) for name, members in data.get("groups", {}).items()}
+        self.pools = {name: list(members) for name, members in data.get("pools", {}).items()}
+        logger.info(f"Loaded {len(self.groups)} printer groups and {len(self.pools)} pools from {self.path}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.to_dict(), f, indent=2)
+            os.replace(tmp, self.path)
+
+    def to_dict(self) -> dict:
+        return {"groups": self.groups, "pools": self.pools}
+
+    def expand(self, names) -> list:
+        """
+        Printer targets for a list of targets, group and pool names, in order
+        and without duplicates. Pool names are kept: their member is chosen
+        when the job is sent.
+        """
+        targets = []
+        for name in names:
+            name = name.strip()
+            if not name:
+                continue
+            if name in self.pools:
+                members = [name]
+            elif name in self.groups:
+                members = [parse_target(m)[1] for m in self.groups[name]]
+            elif looks_like_printer(name):
+                members = [parse_target(name)[1]]
+            else:
+                raise KeyError(name)
+            for member in members:
+                if member not in targets:
+                    targets.append(member)
+        return targets
+
+
+def cached_status(target: str):
+    """The printer's cached status, or None. USB ones come from the status monitor, network ones from discovery."""
+    transport, key, _ = parse_target(target)
+    status = status_monitor.statuses.get(key) if transport == "usb" else net_discovery.printers.get(key)
+    if not status or status.get("status") is None:
+        return None
+    return status
+
+
+def status_messages(status: dict):
+    """
+    The DLE EOT messages of a status ("Paper end", "Drawer pin 3 is high"...),
+    or None when the printer did not answer (not found, unreachable, timeout).
+    """
+    messages = set()
+    for line in (status["message"] or "").splitlines():
+        if not line.strip():
+            continue
+        name, _, found = line.partition(": ")
+        if name not in STATUS_COMMANDS:
+            return None
+        messages.update(found.split(", "))
+    return messages or None
+
+
+def member_ready(target: str):
+    """
+    Whether a printer can print according to its cached status (True or
+    False), or None when it has none yet. Only a printer that does not
+    answer, or reports paper end, an open cover or offline, is not ready.
+    Nothing is queried here.
+    """
+    status = cached_status(target)
+    if status is None:
+        return None
+    if status["status"] == "success":
+        return True
+    messages = status_messages(status)
+    return messages is not None and not messages & NOT_READY
+
+
+def member_paper_end(target: str) -> bool:
+    """Whether the printer's cached status reports paper end."""
+    status = cached_status(target)
+    if status is None or status["status"] == "success":
+        return False
+    return bool((status_messages(status) or set()) & PAPER_END)
+
+
+class PoolBalancer:
+    """
+    Picks the member of a pool a job goes to: ready members first, then
+    those without a status yet, then the rest (paper end, cover open,
+    unreachable, or a failed job within ``hold`` seconds). Within each the
+    least loaded member wins, load being its queue depth or the pool jobs
+    sent to it and not finished, whichever is higher (a job only shows in
+    the queue once enqueued). Ties keep the configured order.
+    """
+
+    def __init__(self, hold: float = POOL_FAILURE_HOLD):
+        self.hold = hold
+        self.failed = {}    # printer -> monotonic time of its last failed pool job
+        self.assigned = {}  # printer -> pool jobs sent and not finished
+
+    def held(self, target: str) -> bool:
+        failed = self.failed.get(target)
+        return failed is not None and time.monotonic() - failed < self.hold
+
+    def health(self, target: str) -> int:
+        if self.held(target):
+            return 2
+        ready = member_ready(target)
+        return 1 if ready is None else 0 if ready else 2
+
+    def rank(self, members) -> list:
+        depths = queue_depths()
+        members = list(dict.fromkeys(parse_target(m)[1] for m in members))
+        return sorted(members, key=lambda m: (
+            self.health(m), max(depths.get(m, 0), self.assigned.get(m, 0)), members.index(m)))
+
+    @contextmanager
+    def assign(self, target: str):
+        self.assigned[target] = self.assigned.get(target, 0) + 1
+        try:
+            yield
+        finally:
+            self.assigned[target] -= 1
+            if not self.assigned[target]:
+                del self.assigned[target]
+
+    def mark_failed(self, target: str):
+        self.failed[target] = time.monotonic()
+
+    def watch(self, members):
+        """Has the status monitor and network discovery keep the members' statuses fresh."""
+        for member in members:
+            transport, key, _ = parse_target(member)
+            if transport == "usb":
+                status_monitor.watched.add(key)
+            else:
+                net_discovery.watch(key, "Printer pool")
+
+    def on_status(self, key: str, old: dict, new: dict):
+        if new["status"] == "success":
+            self.failed.pop(key, None)
+
+
+printer_config = PrinterConfig()
+pool_balancer = PoolBalancer()
+
+
+# ================================================================
+# ROUTES
+# ================================================================
+def put_named(kind: str, name: str, members: list):
+    """Creates or replaces a group or pool; its name must not look like a printer or name the other kind."""
+    other = printer_config.pools if kind == "groups" else printer_config.groups
+    if looks_like_printer(name):
+        return {"status": "error", "message": f"Name {name!r} looks like a printer"}
+    if name in other:
+        return {"status": "error", "message": f"{name!r} is already a printer {'pool' if kind == 'groups' else 'group'}"}
+    members = [parse_target(m.strip())[1] for m in members if m.strip()]
+    getattr(printer_config, kind)[name] = members
+    printer_config.save()
+    return {"status": "success", "message": members}
+
+
+@router.get("/printer-groups")
+def list_groups():
+    return {"status": "success", "message": printer_config.groups}
+
+
+@router.put("/printer-groups/{name}")
+def put_group(name: str, members: list[str] = Body(..., examples=[["04b8_0202", "192.168.1.20"]])):
+    return put_named("groups", name, members)
+
+
+@router.delete("/printer-groups/{name}")
+def delete_group(name: str):
+    if printer_config.groups.pop(name, None) is None:
+        return {"status": "error", "message": f"No printer group {name!r}"}
+    printer_config.save()
+    return {"status": "success", "message": f"Group {name} deleted"}
+
+
+@router.get("/printer-pools")
+def list_pools():
+    """Each pool's members in the order the next job would try them, with their health and load."""
+    depths = queue_depths()
+    return {"status": "success", "message": {
+        name: [{"printer": m, "ready": member_ready(m), "queued": depths.get(m, 0),
+                "held": pool_balancer.held(m)}
+               for m in pool_balancer.rank(members)]
+        for name, members in printer_config.pools.items()}}
+
+
+@router.put("/printer-pools/{name}")
+async def put_pool(name: str, members: list[str] = Body(..., examples=[["04b8_0e15", "192.168.1.30"]])):
+    result = put_named("pools", name, members)
+    if result["status"] == "success":
+        pool_balancer.watch(result["message"])
+    return result
+
+
+@router.delete("/printer-pools/{name}")
+def delete_pool(name: str):
+    if printer_config.pools.pop(name, None) is None:
+        return {"status": "error", "message": f"No printer pool {name!r}"}
+    printer_config.save()
+    return {"status": "success", "message": f"Pool {name} deleted"}
@@ -0,0 +1,123 @@
+# printer_events.py
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger("printer-events")
+
+# A state (status, attach/detach) must hold this long before it is pushed,
+# so a flapping sensor or a bouncing USB connector sends one event at most
+EVENT_DEBOUNCE = float(os.environ.get("EVENT_DEBOUNCE", "1"))
+# Events buffered per subscriber; a slow client loses the oldest ones
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", "100"))
+
+# Event types whose latest value per printer is a state, diffed and debounced
+STATE_EVENTS = {"status", "device"}
+
+
+class EventSubscriber:
+    def __init__(self, printer: str = None):
+        self.printer = printer
+        self.queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+
+    def wants(self, event: dict) -> bool:
+        return self.printer is None or event.get("printer") == self.printer
+
+    def push(self, event: dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class PrinterEvents:
+    """
+    Fans printer events out to websocket and SSE subscribers:
+
+    - ``status``: status or message changed (from the status monitor),
+    - ``device``: a USB printer was attached or detached,
+    - ``job``: a print job finished, with its outcome.
+
+    ``publish`` may be called from any thread. State events are only pushed
+    when they differ from the last pushed state of that printer, after
+    ``EVENT_DEBOUNCE`` seconds without a newer one.
+    """
+
+    def __init__(self, debounce: float = EVENT_DEBOUNCE):
+        self.debounce = debounce
+        self.subscribers = set()
+        self.states = {}   # (type, printer) -> last pushed event
+        self.pending = {}  # (type, printer) -> (event, TimerHandle)
+        self.loop = None
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def publish(self, event: dict):
+        event.setdefault("time", time.time())
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._publish(event)
+        else:
+            loop.call_soon_threadsafe(self._publish, event)
+
+    def _publish(self, event: dict):
+        if event["type"] not in STATE_EVENTS:
+            self._deliver(event)
+            return
+        key = (event["type"], event.get("printer"))
+        previous = self.pending.pop(key, None)
+        if previous is not None:
+            previous[1].cancel()
+        self.pending[key] = (event, self.loop.call_later(self.debounce, self._settle, key))
+
+    def _settle(self, key):
+        event, _ = self.pending.pop(key)
+        last = self.states.get(key)
+        if last is not None and self._state(last) == self._state(event):
+            return  # flapped back to the state clients already have
+        self.states[key] = event
+        self._deliver(event)
+
+    @staticmethod
+    def _state(event: dict) -> dict:
+        return {k: v for k, v in event.items() if k not in ("time", "checked")}
+
+    def _deliver(self, event: dict):
+        for sub in list(self.subscribers):
+            if sub.wants(event):
+                sub.push(event)
+
+    def subscribe(self, printer: str = None) -> EventSubscriber:
+        """New subscriber, primed with the current state of every matching printer."""
+        sub = EventSubscriber(printer)
+        for event in self.states.values():
+            if sub.wants(event):
+                sub.push(event)
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: EventSubscriber):
+        self.subscribers.discard(sub)
+
+    def subscribed_printers(self) -> set:
+        """Printers someone subscribed to by name; a subscription to every printer names none."""
+        return {sub.printer for sub in list(self.subscribers) if sub.printer}
+
+    # Listener adapters for the status monitor and the USB discovery cache
+    def on_status(self, key: str, old: dict, new: dict):
+        self.publish({"type": "status", "printer": key, "status": new["status"],
+                      "message": new["message"], "checked": new.get("checked")})
+
+    def on_device(self, event: str, info: dict):
+        self.publish({"type": "device", "printer": f"{info['vid']:04x}_{info['pid']:04x}", "event": event,
+                      "manufacturer": info.get("manufacturer"), "product": info.get("product")})
+
+
+printer_events = PrinterEvents()
@@ -0,0 +1,176 @@
+# raster.py
+import os
+from bisect import bisect_left
+
+# Tallest raster sent in one command; smaller bands keep the printer's
+# receive buffer from stalling on full-page images
+RASTER_BAND_HEIGHT = int(os.environ.get("RASTER_BAND_HEIGHT", "256"))
+# Blank rows in a row shorter than this stay inside the image
+BLANK_RUN_MIN = int(os.environ.get("RASTER_BLANK_RUN_MIN", "8"))
+
+# Bytes of image data received vs. bytes actually emitted
+raster_stats = {"images": 0, "raw_bytes": 0, "sent_bytes": 0}
+
+
+# ================================================================
+# Commands
+# ================================================================
+class Commands(bytes):
+    """
+    ESC/POS bytes that remember where each command ends (``boundaries``,
+    byte offsets), so a write cut short can resume on a command boundary.
+    ``states`` lists ``(end, preamble)`` per compiled element: the commands
+    that restore the printer state (ESC @, alignment, size, code page...)
+    in effect up to that offset. Everywhere else they are the plain bytes.
+    """
+
+    def __new__(cls, data=b"", boundaries=(), states=()):
+        commands = super().__new__(cls, data)
+        commands.boundaries = tuple(boundaries)
+        commands.states = list(states)
+        return commands
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """Joins chunks of whole commands, keeping the boundaries inside chunks that have them."""
+        out = bytearray()
+        boundaries = []
+        for chunk in chunks:
+            if not chunk:
+                continue
+            start = len(out)
+            out += chunk
+            boundaries.extend(start + end for end in getattr(chunk, "boundaries", ()) if end < len(chunk))
+            boundaries.append(len(out))
+        return cls(out, boundaries)
+
+    def preamble(self, start: int) -> bytes:
+        """
+        The commands to send before resuming at boundary ``start``, so the
+        rest prints as it would have on a printer that was reset meanwhile.
+        Nothing from the start of the job, which sets everything itself.
+        """
+        if not start or not self.states:
+            return b""
+        # The element ending at or after ``start`` holds it (raster bands are inside their image)
+        i = bisect_left(self.states, (start,))
+        return self.states[min(i, len(self.states) - 1)][1]
+
+    def commands(self, start: int = 0):
+        """The bytes from ``start`` (a boundary) on, one command at a time, without copying."""
+        view = memoryview(self)
+        for end in self.boundaries:
+            if end > start:
+                yield view[start:end]
+                start = end
+        if start < len(self):
+            yield view[start:]
+
+
+def feed_dots(dots: int) -> bytes:
+    out = bytearray()
+    while dots > 0:
+        out += b"\x1bJ" + bytes([min(dots, 255)])  # ESC J n
+        dots -= 255
+    return bytes(out)
+
+
+def raster_command(width_bytes: int, height: int, data: bytes) -> bytes:
+    """GS v 0: print raster bit image."""
+    return b"\x1d\x76\x30\x00" + bytes([width_bytes & 0xFF, width_bytes >> 8, height & 0xFF, height >> 8]) + data
+
+
+def graphics_command(width_bytes: int, height: int, data: bytes) -> bytes:
+    """
+    GS ( L fn 112 stores the raster in the print buffer and fn 50 prints it.
+    Payloads over 64 KB switch to the GS 8 L form with a 32-bit length.
+    """
+    width = width_bytes * 8
+    params = b"0p0\x01\x011" + bytes([width & 0xFF, width >> 8, height & 0xFF, height >> 8])
+    size = len(params) + len(data)
+    if size <= 0xFFFF:
+        store = b"\x1d(L" + bytes([size & 0xFF, size >> 8])
+    else:
+        store = b"\x1d8L" + size.to_bytes(4, "little")
+    return store + params + data + b"\x1d(L\x02\x0002"
+
+
+IMAGE_COMMANDS = {
+    "raster": raster_command,
+    "graphics": graphics_command,
+}
+
+
+# ================================================================
+# Pipeline
+# ================================================================
+def encode_raster_image(raw: bytes, width_bytes: int, height: int, align: str = "left",
+                        mode: str = "raster") -> Commands:
+    """
+    Re-encodes a GS v 0 style bitmap for the wire:
+
+    - blank bytes on the sides are trimmed where the current alignment keeps
+      the image in place (right side for left, left side for right, the same
+      amount on both sides for center),
+    - runs of blank rows, and blank rows at the top and bottom, become
+      ESC J paper feeds,
+    - what is left is sent in bands of at most RASTER_BAND_HEIGHT rows,
+      as GS v 0 rasters or GS ( L graphics.
+
+    The printed result is the same as sending the bitmap as one GS v 0 image.
+    """
+    emit = IMAGE_COMMANDS.get(mode, raster_command)
+    zero = bytes(width_bytes)
+    rows = [raw[y * width_bytes:(y + 1) * width_bytes] for y in range(height)]
+    inked = [r for r in rows if r != zero]
+
+    raster_stats["images"] += 1
+    raster_stats["raw_bytes"] += len(raw)
+    if not inked:
+        out = feed_dots(height)
+        raster_stats["sent_bytes"] += len(out)
+        return Commands(out, [len(out)])
+
+    left = min(width_bytes - len(r.lstrip(b"\x00")) for r in inked)
+    right = min(width_bytes - len(r.rstrip(b"\x00")) for r in inked)
+    if align == "center":
+        left = right = min(left, right)
+    elif align == "right":
+        right = 0
+    else:
+        left = 0
+    end = width_bytes - right
+    band_width = end - left
+
+    out = bytearray()
+    boundaries = []  # where each band and feed ends
+    segment = []
+
+    def flush():
+        for top in range(0, len(segment), RASTER_BAND_HEIGHT):
+            band = segment[top:top + RASTER_BAND_HEIGHT]
+            out.extend(emit(band_width, len(band), b"".join(band)))
+            boundaries.append(len(out))
+        segment.clear()
+
+    y = 0
+    while y < height:
+        if rows[y] != zero:
+            segment.append(rows[y][left:end])
+            y += 1
+            continue
+        run_end = y
+        while run_end < height and rows[run_end] == zero:
+            run_end += 1
+        run = run_end - y
+        if run >= BLANK_RUN_MIN or y == 0 or run_end == height:
+            flush()
+            out += feed_dots(run)
+            boundaries.append(len(out))
+        else:
+            segment.extend([zero[left:end]] * run)
+        y = run_end
+    flush()
+
+    raster_stats["sent_bytes"] += len(out)
+    return Commands(out, boundaries)
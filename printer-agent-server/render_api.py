@@ -0,0 +1,133 @@
+# render_api.py
+import argparse
+import asyncio
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import APIRouter, Query, Request, Response
+from fastapi.responses import JSONResponse
+from PIL import Image
+from epos_compiler import compile_epos_xml
+from preview_handler import encode_preview, render_escpos_preview
+
+router = APIRouter()
+logger = logging.getLogger("render-api")
+
+# /render requests are rendered by their own pool, so bulk rendering never
+# delays live previews; requests beyond RENDER_QUEUE_DEPTH waiting ones get 503
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "2"))
+RENDER_QUEUE_DEPTH = int(os.environ.get("RENDER_QUEUE_DEPTH", "32"))
+# Thermal printers print 8 dots per mm, PDFs get the receipt's paper size
+RENDER_DPI = 203
+
+FORMATS = {"png": "image/png", "pdf": "application/pdf"}
+
+render_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+render_slots = asyncio.Semaphore(RENDER_WORKERS + RENDER_QUEUE_DEPTH)
+
+
+class RenderBusyError(Exception):
+    pass
+
+
+# ================================================================
+# Python API
+# ================================================================
+def is_epos_xml(data) -> bool:
+    """ESC/POS starts with a command or text, never with markup."""
+    head = data.lstrip()[:1]
+    return head in (b"<", "<")
+
+
+def encode_render(img: Image.Image, fmt: str = "png") -> bytes:
+    if fmt == "png":
+        return encode_preview(img)
+    if fmt == "pdf":
+        buf = io.BytesIO()
+        img.convert("1", dither=Image.Dither.NONE).save(buf, format="PDF", resolution=RENDER_DPI)
+        return buf.getvalue()
+    raise ValueError(f"Unknown render format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+
+def render_document(data, fmt: str = "png", image_mode: str = "raster") -> bytes:
+    """
+    Renders an ePOS XML document (str or bytes) or raw ESC/POS bytes to PNG
+    or PDF bytes. Images are compiled as the printer would receive them,
+    except that download graphics are never assumed to be stored.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown render format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    if is_epos_xml(data):
+        esc = compile_epos_xml(data, image_mode=image_mode)
+    else:
+        esc = data if isinstance(data, (bytes, bytearray)) else data.encode("latin-1")
+    return encode_render(render_escpos_preview(bytes(esc)), fmt)
+
+
+def render_many(documents, fmt: str = "png", workers: int = None, image_mode: str = "raster"):
+    """
+    Renders many documents across ``workers`` processes (the interpreter is
+    pure Python, threads would share one core) and yields the results in
+    input order.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(render_document, doc, fmt, image_mode) for doc in documents]
+        for future in futures:
+            yield future.result()
+
+
+async def render_async(data, fmt: str = "png", image_mode: str = "raster") -> bytes:
+    """``render_document`` on the render pool, raising RenderBusyError when its queue is full."""
+    if render_slots.locked():
+        raise RenderBusyError(f"{RENDER_WORKERS + RENDER_QUEUE_DEPTH} renders already running or waiting")
+    async with render_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(render_executor, render_document, data, fmt, image_mode)
+
+
+def render_response(body: bytes, fmt: str) -> Response:
+    return Response(body, media_type=FORMATS[fmt])
+
+
+# ================================================================
+# ROUTES
+# ================================================================
+@router.post("/render")
+async def render_route(request: Request, format: str = Query("png", pattern="^(png|pdf)$"),
+                       image_mode: str = Query("raster", pattern="^(raster|graphics)$")):
+    """
+    Renders the request body, an ePOS-Print XML document or raw ESC/POS
+    bytes, to a PNG or PDF receipt image.
+    """
+    data = await request.body()
+    try:
+        return render_response(await render_async(data, format, image_mode), format)
+    except RenderBusyError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse({"status": "error", "message": f"Render failed: {e}"}, status_code=400)
+
+
+# ================================================================
+# CLI
+# ================================================================
+# python render_api.py receipts/*.xml --format png --out rendered/
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render ePOS XML / ESC/POS files to PNG or PDF")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="png")
+    parser.add_argument("--out", default=".", help="directory for the rendered files")
+    parser.add_argument("--workers", type=int, default=None, help="processes, defaults to the CPU count")
+    args = parser.parse_args()
+
+    def read(path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    os.makedirs(args.out, exist_ok=True)
+    for path, body in zip(args.files, render_many(map(read, args.files), args.format, args.workers)):
+        target = os.path.join(args.out, os.path.splitext(os.path.basename(path))[0] + "." + args.format)
+        with open(target, "wb") as f:
+            f.write(body)
+        print(f"{path} -> {target} ({len(body)} bytes)")
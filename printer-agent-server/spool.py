@@ -0,0 +1,311 @@
+# spool.py
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from fastapi import APIRouter, Query
+from print_queue import submit_job, QueueFullError
+from metrics import register, Gauge
+
+router = APIRouter()
+logger = logging.getLogger("print-spool")
+
+# SQLite database holding failed jobs until they print, "" disables the spool
+SPOOL_PATH = os.environ.get("SPOOL_PATH", os.path.join(os.path.expanduser("~"), ".printer-agent", "spool.db"))
+# Retry backoff: SPOOL_RETRY_MIN seconds, doubled per attempt up to SPOOL_RETRY_MAX
+SPOOL_RETRY_MIN = float(os.environ.get("SPOOL_RETRY_MIN", "2"))
+SPOOL_RETRY_MAX = float(os.environ.get("SPOOL_RETRY_MAX", "60"))
+# A job older than this is not printed any more: a late kitchen ticket or
+# receipt does more harm than a missing one
+SPOOL_MAX_AGE = float(os.environ.get("SPOOL_MAX_AGE", "300"))
+# "1" answers a spooled job success='true' code='SPOOLED'. By default the POS
+# gets the print error, with the spool id, so a wrong printer is noticed
+SPOOL_REPLY_SUCCESS = os.environ.get("SPOOL_REPLY_SUCCESS", "0") == "1"
+# Finished, cancelled and expired jobs are kept this long for reprints
+SPOOL_RETENTION = float(os.environ.get("SPOOL_RETENTION", str(24 * 3600)))
+
+# pending → printing → done; pending → cancelled / expired
+STATES = ("pending", "printing", "done", "cancelled", "expired")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    printer TEXT NOT NULL,
+    transport TEXT NOT NULL,
+    args TEXT NOT NULL,
+    esc BLOB NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    next_attempt REAL NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_due ON jobs (state, next_attempt);
+"""
+
+
+class PrintSpool:
+    """
+    Jobs whose print failed, kept in SQLite until the printer takes them.
+    Only failures are written, so the happy path never touches the disk:
+    ``pending_printers`` tells in memory whether a printer has anything
+    spooled that a successful job could supersede.
+    The database runs in WAL mode with ``synchronous=NORMAL``: a commit is
+    an append to the log and fsyncs are batched into checkpoints, which
+    survives an agent crash (a power cut may lose the last commits).
+
+    Pending jobs are retried through the printer's own queue, oldest first,
+    with exponential backoff, and right away when the printer is attached
+    again or reports a healthy status. ``transports`` maps a transport name
+    to the print function (``func(esc, *args) -> bool``) used for retries.
+    """
+
+    def __init__(self, path: str = SPOOL_PATH):
+        self.path = path
+        self.transports = {}
+        self.db = None
+        self.pending_printers = set()  # printers with pending jobs, a superset between retry passes
+        self.loop = None
+        self._lock = threading.Lock()
+        self._wake = None
+        self._task = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.db is not None
+
+    def open(self):
+        if not self.path or self.db is not None:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(SCHEMA)
+        # Jobs interrupted by a crash are retried; the printer may get part of one twice
+        db.execute("UPDATE jobs SET state = 'pending' WHERE state = 'printing'")
+        pending = db.execute("SELECT printer FROM jobs WHERE state = 'pending'").fetchall()
+        self.pending_printers = {row["printer"] for row in pending}
+        # Only now: USB and status listeners on other threads check ``enabled`` and query the table
+        self.db = db
+        logger.info(f"Print spool at {self.path}, {len(pending)} pending jobs")
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self.db.execute(sql, params)
+
+    # ------------------------------------------------------------
+    # Jobs
+    # ------------------------------------------------------------
+    def add(self, printer: str, transport: str, esc: bytes, *args) -> int:
+        """Spools a job, or returns the id of the identical job already pending (the POS retried it)."""
+        row = self._execute("SELECT id FROM jobs WHERE printer = ? AND state = 'pending' AND esc = ?",
+                            (printer, esc)).fetchone()
+        if row is not None:
+            logger.info(f"Job for {printer} is already spooled as {row['id']}")
+            return row["id"]
+        now = time.time()
+        cur = self._execute(
+            "INSERT INTO jobs (printer, transport, args, esc, state, attempts, created, updated, next_attempt, error)"
+            " VALUES (?, ?, ?, ?, 'pending', 1, ?, ?, ?, 'Print failed')",
+            (printer, transport, json.dumps(args), esc, now, now, now + SPOOL_RETRY_MIN))
+        self.pending_printers.add(printer)
+        logger.warning(f"Spooled job {cur.lastrowid} for {printer} ({len(esc)} bytes)")
+        self.wake()
+        return cur.lastrowid
+
+    def list(self, state: str = None, printer: str = None) -> list:
+        """Jobs without their ESC/POS, newest first."""
+        sql = ("SELECT id, printer, transport, args, length(esc) AS bytes, state, attempts, created, updated,"
+               " next_attempt, error FROM jobs WHERE 1 = 1")
+        params = []
+        if state:
+            sql += " AND state = ?"
+            params.append(state)
+        if printer:
+            sql += " AND printer = ?"
+            params.append(printer)
+        rows = self._execute(sql + " ORDER BY id DESC", params).fetchall()
+        return [dict(row, args=json.loads(row["args"])) for row in rows]
+
+    def reprint(self, job_id: int) -> bool:
+        """Queues a job again, whatever its state, unless it is printing right now."""
+        now = time.time()
+        cur = self._execute(
+            "UPDATE jobs SET state = 'pending', attempts = 0, created = ?, updated = ?, next_attempt = ?, error = NULL"
+            " WHERE id = ? AND state != 'printing'", (now, now, now, job_id))
+        if cur.rowcount:
+            self.pending_printers.add(self._execute("SELECT printer FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+        self.wake()
+        return cur.rowcount > 0
+
+    def supersede(self, printer: str, esc: bytes):
+        """Cancels pending copies of a job that has just printed, e.g. when the POS retried it by hand."""
+        if not self.enabled or printer not in self.pending_printers:
+            return
+        cur = self._execute("UPDATE jobs SET state = 'cancelled', updated = ?, error = 'Printed by a later request'"
+                            " WHERE printer = ? AND state = 'pending' AND esc = ?", (time.time(), printer, esc))
+        if cur.rowcount:
+            logger.info(f"Cancelled {cur.rowcount} spooled copies of a job printed on {printer}")
+
+    def cancel(self, job_id: int) -> bool:
+        cur = self._execute("UPDATE jobs SET state = 'cancelled', updated = ? WHERE id = ? AND state = 'pending'",
+                            (time.time(), job_id))
+        return cur.rowcount > 0
+
+    def _set_state(self, job_id: int, state: str):
+        self._execute("UPDATE jobs SET state = ?, updated = ? WHERE id = ?", (state, time.time(), job_id))
+
+    def _backoff(self, job, error: str):
+        attempts = job["attempts"] + 1
+        delay = min(SPOOL_RETRY_MIN * 2 ** (attempts - 1), SPOOL_RETRY_MAX)
+        self._execute("UPDATE jobs SET state = 'pending', attempts = ?, updated = ?, next_attempt = ?, error = ?"
+                      " WHERE id = ? AND state = 'printing'",
+                      (attempts, time.time(), time.time() + delay, error, job["id"]))
+
+    # ------------------------------------------------------------
+    # Retries
+    # ------------------------------------------------------------
+    def wake(self, printer: str = None):
+        """Retries the pending jobs (of ``printer``, or all) now. Thread-safe."""
+        if not self.enabled:
+            return
+        if printer is not None:
+            self._execute("UPDATE jobs SET next_attempt = ? WHERE printer = ? AND state = 'pending'",
+                          (time.time(), printer))
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._wake.set)
+
+    async def retry_printer(self, printer: str, jobs: list):
+        for job in jobs:
+            if time.time() - job["created"] > SPOOL_MAX_AGE:
+                self._set_state(job["id"], "expired")
+                logger.warning(f"Spooled job {job['id']} for {printer} expired")
+                continue
+            # Taken by cancel() or reprint() meanwhile
+            if self._execute("UPDATE jobs SET state = 'printing' WHERE id = ? AND state = 'pending'",
+                             (job["id"],)).rowcount == 0:
+                continue
+            func = self.transports[job["transport"]]
+            try:
+                ok = await submit_job(printer, func, job["esc"], *json.loads(job["args"]))
+                error = None if ok else "Print failed"
+            except QueueFullError as e:
+                ok, error = False, str(e)
+            except Exception as e:
+                ok, error = False, str(e)
+            if not ok:
+                # Keep the order: later jobs of this printer wait for this one
+                self._backoff(job, error)
+                return
+            self._set_state(job["id"], "done")
+            logger.info(f"Spooled job {job['id']} printed on {printer}")
+
+    async def retry_due(self):
+        with self._lock:
+            rows = self.db.execute("SELECT * FROM jobs WHERE state = 'pending' ORDER BY id").fetchall()
+            # Under the lock: a job spooled meanwhile is either in ``rows`` or added after this
+            self.pending_printers = {row["printer"] for row in rows}
+        by_printer = {}
+        for row in rows:
+            by_printer.setdefault(row["printer"], []).append(row)
+        now = time.time()
+        due = {p: jobs for p, jobs in by_printer.items() if jobs[0]["next_attempt"] <= now}
+        await asyncio.gather(*(self.retry_printer(p, jobs) for p, jobs in due.items()))
+
+    def next_due(self):
+        row = self._execute("SELECT MIN(next_attempt) FROM jobs WHERE state = 'pending'").fetchone()
+        return row[0]
+
+    def counts(self) -> dict:
+        if not self.enabled:
+            return {}
+        rows = self._execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {(state,): count for state, count in rows}
+
+    def purge(self):
+        self._execute("DELETE FROM jobs WHERE state IN ('done', 'cancelled', 'expired') AND updated < ?",
+                      (time.time() - SPOOL_RETENTION,))
+
+    async def _run(self):
+        while True:
+            try:
+                await self.retry_due()
+                self.purge()
+            except Exception as e:
+                logger.warning(f"Spool retry failed: {e}")
+            next_due = self.next_due()
+            timeout = SPOOL_RETRY_MAX if next_due is None else min(max(next_due - time.time(), 0.1), SPOOL_RETRY_MAX)
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        try:
+            self.open()
+        except Exception as e:
+            logger.error(f"Print spool unavailable at {self.path}: {e}")
+            return
+        if not self.enabled:
+            return
+        self.loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = self.loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.loop = None
+        self.close()
+
+    # Listener adapters for the USB discovery cache, the status monitor and network discovery
+    def on_device(self, event: str, info: dict):
+        if event == "attached":
+            self.wake(f"{info['vid']:04x}_{info['pid']:04x}")
+
+    def on_status(self, key: str, old: dict, new: dict):
+        if new["status"] == "success":
+            self.wake(key)
+
+
+spool = PrintSpool()
+register(Gauge("print_agent_spool_jobs", "Spooled jobs by state", ("state",), spool.counts))
+
+
+# ================================================================
+# ROUTES
+# ================================================================
+@router.get("/spool")
+def spool_list(state: str = Query(None, pattern="^(" + "|".join(STATES) + ")$"), printer: str = None):
+    """Spooled jobs without their data, newest first, optionally of one state or one printer."""
+    if not spool.enabled:
+        return {"status": "success", "message": []}
+    return {"status": "success", "message": spool.list(state, printer)}
+
+
+@router.post("/spool/{job_id}/reprint")
+def spool_reprint(job_id: int):
+    if not spool.enabled or not spool.reprint(job_id):
+        return {"status": "error", "message": f"No spooled job {job_id}, or it is printing"}
+    return {"status": "success", "message": f"Job {job_id} queued"}
+
+
+@router.delete("/spool/{job_id}")
+def spool_cancel(job_id: int):
+    if not spool.enabled or not spool.cancel(job_id):
+        return {"status": "error", "message": f"No pending spooled job {job_id}"}
+    return {"status": "success", "message": f"Job {job_id} cancelled"}
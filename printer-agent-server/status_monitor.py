@@ -0,0 +1,114 @@
+# status_monitor.py
+import logging
+import os
+import threading
+import time
+from check_status import check_printer_status
+from get_printer_list import usb_discovery
+from printer_events import printer_events
+from usb_pool import usb_pool, parse_usb_id
+
+logger = logging.getLogger("status-monitor")
+
+# Seconds between two status polls of a printer, 0 disables the monitor
+STATUS_POLL_INTERVAL = float(os.environ.get("STATUS_POLL_INTERVAL", "5"))
+# A cached status older than this is refreshed by the route itself
+STATUS_MAX_AGE = float(os.environ.get("STATUS_MAX_AGE", str(max(STATUS_POLL_INTERVAL * 3, 15))))
+
+
+def printer_key(vid, pid) -> str:
+    return f"{parse_usb_id(vid):04x}_{parse_usb_id(pid):04x}"
+
+
+class StatusMonitor:
+    """
+    Polls the status of USB printers in the background and keeps the last
+    ``check_printer_status`` result of each, stamped with ``checked`` (epoch
+    seconds). Only printers someone watches are polled: their status was
+    asked for, they are in a pool, or an event subscriber names them.
+    Background polls release the handle they open, so a printer nobody
+    prints to goes back to the OS. Listeners get
+    ``(key, old, new)`` whenever a printer's status or message changes.
+    """
+
+    def __init__(self, interval: float = STATUS_POLL_INTERVAL, max_age: float = STATUS_MAX_AGE):
+        self.interval = interval
+        self.max_age = max_age
+        self.statuses = {}  # "vvvv_pppp" -> {"status", "message", "checked"}
+        self.watched = set()
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def poll(self, key: str, release: bool = False) -> dict:
+        vid, pid = key.split("_")
+        result = dict(check_printer_status(vid, pid, release=release), checked=time.time())
+        self._store(key, result)
+        return result
+
+    def _store(self, key: str, result: dict):
+        with self._lock:
+            old = self.statuses.get(key)
+            self.statuses[key] = result
+        if old is None or (old["status"], old["message"]) != (result["status"], result["message"]):
+            for listener in list(self.listeners):
+                try:
+                    listener(key, old, result)
+                except Exception as e:
+                    logger.warning(f"Status listener failed: {e}")
+
+    def poll_all(self):
+        # Claiming a printer nobody asked about takes it away from the OS spooler
+        subscribed = set()
+        for printer in printer_events.subscribed_printers():
+            vid, _, pid = printer.partition("_")
+            try:
+                subscribed.add(printer_key(vid, pid))
+            except ValueError:
+                pass  # an IP, polled by network discovery
+        keys = self.watched | subscribed
+        for key in keys:
+            # Never hold up a print job for a status poll, try again next round
+            if usb_pool.is_busy(*key.split("_")):
+                continue
+            try:
+                self.poll(key, release=True)
+            except Exception as e:
+                logger.warning(f"Status poll of {key} failed: {e}")
+
+    def get(self, vid, pid) -> dict:
+        """The cached status, polled right away when missing or older than ``max_age``."""
+        key = printer_key(vid, pid)
+        self.watched.add(key)
+        result = self.statuses.get(key)
+        if result is None or time.time() - result["checked"] > self.max_age:
+            result = self.poll(key)
+        return result
+
+    def _on_usb_event(self, event: str, info: dict):
+        key = printer_key(info["vid"], info["pid"])
+        if event == "detached" and key in self.statuses:
+            self._store(key, {"status": "error", "message": "Printer not found", "checked": time.time()})
+        elif event == "attached":
+            self._wake.set()
+
+    def start(self):
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        usb_discovery.listeners.append(self._on_usb_event)
+
+        def loop():
+            while True:
+                try:
+                    self.poll_all()
+                except Exception as e:
+                    logger.warning(f"Status monitor failed: {e}")
+                self._wake.wait(self.interval)
+                self._wake.clear()
+
+        self._thread = threading.Thread(target=loop, name="status-monitor", daemon=True)
+        self._thread.start()
+
+
+status_monitor = StatusMonitor()
@@ -0,0 +1,331 @@
+# usb_pool.py
+import logging
+import os
+import threading
+import time
+from collections import deque
+import usb.core
+import usb.util
+from usb.util import endpoint_direction, ENDPOINT_IN, ENDPOINT_OUT
+from ddl_path import get_libusb_backend
+from metrics import stage_seconds
+
+logger = logging.getLogger("usb-pool")
+
+# Claimed devices unused for this long are released back to the OS
+USB_IDLE_TIMEOUT = float(os.environ.get("USB_IDLE_TIMEOUT", "120"))
+# Bytes per bulk transfer, rounded down to a multiple of the endpoint's wMaxPacketSize
+USB_WRITE_CHUNK = int(os.environ.get("USB_WRITE_CHUNK", "4096"))
+# Milliseconds each bulk transfer may take, so a large job is not cut off by one overall timeout
+USB_WRITE_TIMEOUT = int(os.environ.get("USB_WRITE_TIMEOUT", "5000"))
+
+# libusb error codes meaning the cached handle points at a device that is gone
+# (unplugged, re-enumerated after a paper change, power cycled...)
+LIBUSB_ERROR_IO = -1
+LIBUSB_ERROR_NO_DEVICE = -4
+LIBUSB_ERROR_NOT_FOUND = -5
+STALE_HANDLE_ERRORS = {LIBUSB_ERROR_IO, LIBUSB_ERROR_NO_DEVICE, LIBUSB_ERROR_NOT_FOUND}
+
+
+class UsbDeviceNotFound(Exception):
+    pass
+
+
+def parse_usb_id(value) -> int:
+    return int(value, 16) if isinstance(value, str) else int(value)
+
+
+def is_stale_handle_error(e: Exception) -> bool:
+    return isinstance(e, usb.core.USBError) and (
+        e.backend_error_code in STALE_HANDLE_ERRORS or e.errno == 19  # ENODEV
+    )
+
+
+def transfer_size(max_packet: int, chunk: int = USB_WRITE_CHUNK) -> int:
+    """The largest multiple of ``max_packet`` not above ``chunk`` (at least one packet)."""
+    max_packet = max_packet or 64
+    return max(max_packet, chunk - chunk % max_packet)
+
+
+class WriteProgress:
+    """
+    How far a write got: ``written`` bytes were accepted by the printer and
+    ``committed`` is the end of the last command fully written, where a
+    retry resumes. Offsets count from the start of the job.
+    """
+
+    def __init__(self, total: int = None):
+        self.total = total
+        self.written = 0
+        self.committed = 0
+        self.transfers = 0
+        self.started = time.monotonic()
+
+    def as_dict(self) -> dict:
+        return {"total": self.total, "written": self.written, "committed": self.committed,
+                "transfers": self.transfers, "seconds": round(time.monotonic() - self.started, 3)}
+
+
+# ================================================================
+# Claimed device
+# ================================================================
+class UsbHandle:
+    """An opened printer with interface 0 claimed and its endpoints resolved."""
+
+    def __init__(self, vid: int, pid: int, dev, ep_out, ep_in):
+        self.vid = vid
+        self.pid = pid
+        self.dev = dev
+        self.ep_out = ep_out
+        self.ep_in = ep_in
+        self.lock = threading.RLock()
+        self.last_used = time.monotonic()
+        self.kernel_driver = False  # detached from the OS driver on open, given back on close
+
+    @classmethod
+    def open(cls, vid: int, pid: int):
+        with stage_seconds.time("usb_open", f"{vid:04x}_{pid:04x}"):
+            return cls._open(vid, pid)
+
+    @classmethod
+    def _open(cls, vid: int, pid: int):
+        dev = usb.core.find(idVendor=vid, idProduct=pid, backend=get_libusb_backend())
+        if dev is None:
+            raise UsbDeviceNotFound("USB printer not found")
+
+        kernel_driver = False
+        try:
+            if dev.is_kernel_driver_active(0):
+                dev.detach_kernel_driver(0)
+                kernel_driver = True
+        except:
+            pass
+
+        # Only configure devices that are not configured yet, re-running
+        # set_configuration resets the printer's interface state.
+        try:
+            cfg = dev.get_active_configuration()
+        except usb.core.USBError:
+            dev.set_configuration()
+            cfg = dev.get_active_configuration()
+
+        usb.util.claim_interface(dev, 0)
+        intf = cfg[(0, 0)]
+
+        ep_out = usb.util.find_descriptor(
+            intf, custom_match=lambda e: endpoint_direction(e.bEndpointAddress) == ENDPOINT_OUT
+        )
+        ep_in = usb.util.find_descriptor(
+            intf, custom_match=lambda e: endpoint_direction(e.bEndpointAddress) == ENDPOINT_IN
+        )
+        if ep_out is None:
+            usb.util.release_interface(dev, 0)
+            usb.util.dispose_resources(dev)
+            raise Exception("No USB OUT endpoint found")
+
+        logger.info(f"Claimed USB printer {vid:04x}:{pid:04x}")
+        handle = cls(vid, pid, dev, ep_out, ep_in)
+        handle.kernel_driver = kernel_driver
+        return handle
+
+    def close(self, reset: bool = False):
+        try:
+            usb.util.release_interface(self.dev, 0)
+            if reset:
+                self.dev.reset()
+        except Exception:
+            pass
+        if self.kernel_driver and not reset:
+            # Hand the printer back to the OS driver (usblp) we took it from
+            try:
+                self.dev.attach_kernel_driver(0)
+            except Exception:
+                pass
+        try:
+            usb.util.dispose_resources(self.dev)
+        except Exception:
+            pass
+
+
+# ================================================================
+# Pool
+# ================================================================
+class UsbDevicePool:
+    """
+    Keeps printers claimed between jobs, keyed by (vid, pid).
+    Printing and status checks share the same handle and take its lock,
+    so they never fight over interface 0.
+    """
+
+    def __init__(self, idle_timeout: float = USB_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._handles = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        self.writes = {}  # "vvvv_pppp" -> WriteProgress of the job being written
+        self.listeners = []  # called with ("reopened", {"vid", "pid"}) when a stale handle is reopened
+
+    def _get(self, vid: int, pid: int) -> UsbHandle:
+        key = (vid, pid)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is None:
+                handle = self._handles[key] = UsbHandle.open(vid, pid)
+                self._start_reaper()
+            return handle
+
+    def invalidate(self, vid: int, pid: int, reset: bool = False):
+        with self._lock:
+            handle = self._handles.get((vid, pid))
+        if handle is not None:
+            self._drop(handle, reset)
+
+    def _drop(self, handle: UsbHandle, reset: bool = False):
+        with self._lock:
+            if self._handles.get((handle.vid, handle.pid)) is handle:
+                del self._handles[(handle.vid, handle.pid)]
+            else:
+                return
+        with handle.lock:
+            handle.close(reset=reset)
+        logger.info(f"Released USB printer {handle.vid:04x}:{handle.pid:04x}")
+
+    def is_busy(self, vid, pid) -> bool:
+        """True while a job holds the printer's handle."""
+        handle = self._handles.get((parse_usb_id(vid), parse_usb_id(pid)))
+        if handle is None or not handle.lock.acquire(blocking=False):
+            return handle is not None
+        handle.lock.release()
+        return False
+
+    def run(self, vid, pid, func, reset: bool = True, release: bool = False):
+        """
+        Calls ``func(handle)`` with the printer's handle locked. A handle that
+        turns out to be stale is reopened once (hotplug, re-enumeration);
+        any other USB error drops the handle so the next job starts clean,
+        resetting the device too unless ``reset`` is false. With ``release``
+        the call keeps nothing claimed: a handle it had to open is released
+        again, and one already open is not marked as used, so the idle
+        reaper still gives the printer back.
+        """
+        vid, pid = parse_usb_id(vid), parse_usb_id(pid)
+        retried = False
+        while True:
+            opened = (vid, pid) not in self._handles
+            handle = self._get(vid, pid)
+            try:
+                with handle.lock:
+                    if self._handles.get((vid, pid)) is not handle:
+                        continue  # released by the idle reaper while we waited
+                    result = func(handle)
+                    if not release:
+                        handle.last_used = time.monotonic()
+                    elif opened:
+                        self._drop(handle)
+                    return result
+            except usb.core.USBError as e:
+                stale = is_stale_handle_error(e)
+                self._drop(handle, reset=reset and not stale)
+                if retried or not stale:
+                    raise
+                retried = True
+                logger.warning(f"USB handle {vid:04x}:{pid:04x} went stale ({e}), reconnecting")
+                self._notify("reopened", {"vid": vid, "pid": pid})
+
+    def _notify(self, event: str, info: dict):
+        for listener in list(self.listeners):
+            try:
+                listener(event, info)
+            except Exception as e:
+                logger.warning(f"USB {event} listener failed: {e}")
+
+    def write(self, vid, pid, data, timeout: int = USB_WRITE_TIMEOUT, progress: WriteProgress = None,
+              preamble=None):
+        """
+        Writes ``data`` to the printer's OUT endpoint and returns the bytes
+        written. ``data`` is bytes or an iterable of whole commands, consumed
+        as it is written. Transfers are whole commands packed up to
+        USB_WRITE_CHUNK bytes, or packet-aligned pieces of a larger command,
+        and each gets ``timeout`` milliseconds. ``progress`` follows the
+        write; when the handle has to be reopened the write resumes at the
+        last command fully written rather than at the start, after the bytes
+        ``preamble(offset)`` returns to restore the printer state there.
+        """
+        commands = iter([data] if isinstance(data, (bytes, bytearray, memoryview)) else data)
+        progress = progress or WriteProgress()
+        pending = bytearray()  # job bytes from progress.committed on, read from ``commands``
+        ends = deque()         # job offsets where the commands in ``pending`` end
+        key = f"{parse_usb_id(vid):04x}_{parse_usb_id(pid):04x}"
+
+        def write_chunks(h):
+            size = transfer_size(h.ep_out.wMaxPacketSize)
+            pos = progress.committed
+            with stage_seconds.time("usb_write", key):
+                # A reopened printer may have been reset: restore the state the job had reached
+                restore = preamble(pos) if preamble and pos else b""
+                if restore:
+                    h.ep_out.write(restore, timeout=timeout)
+                while True:
+                    while progress.committed + len(pending) - pos < size:
+                        command = next(commands, None)
+                        if command is None:
+                            break
+                        pending.extend(command)
+                        ends.append(progress.committed + len(pending))
+                    if pos >= progress.committed + len(pending):
+                        return progress.written
+                    # End the transfer on the last command boundary it holds, if any
+                    stop = pos + size
+                    boundary = next((e for e in reversed(ends) if pos < e <= stop), None)
+                    start = pos - progress.committed
+                    chunk = pending[start:(boundary or stop) - progress.committed]
+                    pos += h.ep_out.write(chunk, timeout=timeout)
+                    progress.written = pos
+                    progress.transfers += 1
+                    while ends and ends[0] <= pos:
+                        committed = ends.popleft()
+                        del pending[:committed - progress.committed]
+                        progress.committed = committed
+
+        self.writes[key] = progress
+        try:
+            return self.run(vid, pid, write_chunks)
+        finally:
+            self.writes.pop(key, None)
+
+    def reap_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [h for h in self._handles.values() if now - h.last_used > self.idle_timeout]
+        for handle in idle:
+            # Skip handles that are busy with a job right now
+            if handle.lock.acquire(blocking=False):
+                try:
+                    if time.monotonic() - handle.last_used > self.idle_timeout:
+                        self._drop(handle)
+                finally:
+                    handle.lock.release()
+
+    def close_all(self):
+        with self._lock:
+            handles = list(self._handles.values())
+        for handle in handles:
+            self._drop(handle)
+
+    def _start_reaper(self):
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+
+        def loop():
+            while True:
+                time.sleep(max(self.idle_timeout / 2, 1))
+                try:
+                    self.reap_idle()
+                except Exception as e:
+                    logger.warning(f"USB idle reaper failed: {e}")
+
+        self._reaper = threading.Thread(target=loop, name="usb-pool-reaper", daemon=True)
+        self._reaper.start()
+
+
+usb_pool = UsbDevicePool()